@@ -0,0 +1,540 @@
+"""
+Asyncio daemon for Discord Rich Presence.
+Runs Discord IPC (pypresence AioPresence), hook event ingestion, session
+liveness checks and config reload as independent tasks, so a slow Discord
+connect or update never holds up state processing or orphan cleanup.
+presence.run_daemon() remains the synchronous fallback.
+"""
+
+import asyncio
+import atexit
+import signal
+import sys
+import time
+import traceback
+from collections.abc import Mapping
+
+from pypresence import AioPresence
+from pypresence.exceptions import DiscordError, PyPresenceException, ServerError
+
+from state import (
+    DATA_DIR,
+    STATE_FILE,
+    JOURNAL_FILE,
+    StateFollower,
+    append_events,
+    apply_events_locked,
+    compact_journal,
+)
+from ingest import IngestServer
+from eventloop import DirWatcher, PidWatcher
+from scheduler import UpdateScheduler
+from segment import SegmentWriter
+from metrics import count, observe
+from toolstats import ToolLatency
+from timeline import TRACE_FLUSH_INTERVAL, TraceRecorder
+from history import HISTORY_INTERVAL, SessionHistory
+from presence import (
+    DISCORD_APP_ID,
+    SESSIONS_FILE,
+    ORPHAN_CHECK_INTERVAL,
+    CONFIG_RELOAD_INTERVAL,
+    DISCORD_CONNECT_MAX_RETRIES,
+    DISCORD_RETRY_DELAY,
+    DAEMON_POLL_INTERVAL,
+    DAEMON_COMPACT_SIZE,
+    METRICS_INTERVAL,
+    YAML_AVAILABLE,
+    DEBUG,
+    log,
+    get_config,
+    build_presence,
+    cleanup_dead_sessions,
+    session_pids,
+    session_check_interval,
+    write_pid,
+    remove_pid,
+    write_daemon_stats,
+    daemon_stats,
+    publish_daemon_stats,
+    TOOL_DISPLAY,
+)
+
+# loop.add_reader() needs a selector event loop (not Windows' proactor)
+ASYNC_AVAILABLE = sys.platform != "win32"
+
+# Per-call limits so a hung Discord client cannot wedge the IPC task
+DISCORD_CONNECT_TIMEOUT = 10
+DISCORD_UPDATE_TIMEOUT = 5
+
+MAX_CONSECUTIVE_ERRORS = 10  # Exit after this many consecutive ingest failures
+
+# Errors that mean "the Discord connection is gone" - reconnect, don't crash
+DISCORD_ERRORS = (PyPresenceException, ConnectionError, TimeoutError, asyncio.TimeoutError, OSError)
+
+# Discord answered with an ERROR frame (e.g. "You are being rate limited"):
+# the connection is fine, so the update is retried on it after a backoff
+DISCORD_REJECTIONS = (ServerError, DiscordError)
+MAX_REJECTED_UPDATES = 5  # Reconnect after this many rejections in a row
+REJECTED_RETRY_MAX = 20  # Longest backoff (seconds) before retrying a rejected update
+
+# First delay before reconnecting after a lost connection, doubling up to
+# DISCORD_RETRY_DELAY while connections keep dropping without an update getting through
+RECONNECT_DELAY = 1
+
+
+async def _wait_any(*events: asyncio.Event, timeout: float | None = None):
+    """Wait until any of events is set, or timeout elapses."""
+    waiters = [asyncio.ensure_future(event.wait()) for event in events]
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+class AsyncDaemon:
+    """
+    The daemon as eight cooperating tasks:
+
+    - ingest:   hook events from the socket / state journal -> in-memory state
+    - discord:  connect, render presence on every state change, reconnect
+    - sessions: drop exited sessions (pidfd, or polling), exit after the last one
+    - config:   hot reload, reconnect when discord_app_id changes
+    - metrics:  rewrite metrics.prom every METRICS_INTERVAL (metrics_textfile)
+    - trace:    append buffered session timeline records to DATA_DIR/traces
+    - history:  write queued session snapshots to history.db
+    - stats:    rewrite daemon_stats.json in a worker thread when counters moved
+
+    Usage:
+        asyncio.run(AsyncDaemon(get_config(force_reload=True)).run())
+    """
+
+    def __init__(self, config: Mapping):
+        self.config = config
+        self.app_id = config.get("discord_app_id") or DISCORD_APP_ID
+        self.follower = StateFollower()  # In-memory state, fed incrementally from the journal
+        self.segment = SegmentWriter()  # Lock-free copy of the in-memory state for `status`
+        self.ingest = IngestServer()
+        self.watcher = DirWatcher(DATA_DIR, {STATE_FILE.name, JOURNAL_FILE.name, SESSIONS_FILE.name})
+        self.pid_watcher = PidWatcher()
+        self.pending_events = []  # Ingested hook events not yet journaled
+        self.wake = asyncio.Event()  # Ingest socket or watched file readable
+        self.readable = []  # Sources whose reader is paused until ingest_task drains them
+        self.state_changed = asyncio.Event()  # Presence may need re-rendering
+        self.sessions_changed = asyncio.Event()  # sessions.json rewritten or a session process exited
+        self.reconnect = asyncio.Event()  # Discord connection must be rebuilt
+        self.stats_due = asyncio.Event()  # daemon_stats.json is behind (stats_task)
+        self.stats_write = None  # stats_task's write in progress, awaited on shutdown
+        self.trace_due = asyncio.Event()  # Trace ring is full enough to flush early (trace_task)
+        self.trace_write = None  # trace_task's write in progress, awaited on shutdown
+        self.stopping = asyncio.Event()
+        self.scheduler = UpdateScheduler()  # Rate limit + latest-wins coalescing, kept across reconnects
+        self.reconnect_delay = RECONNECT_DELAY
+        self.tool_latency = ToolLatency(TOOL_DISPLAY)  # Pairs update/done events into per-tool histograms
+        self.tracer = TraceRecorder()  # Session timelines for `trace export`
+        self.history = SessionHistory()  # Session totals for `report`, written to history.db in batches
+
+    def request_stop(self, reason: str):
+        if not self.stopping.is_set():
+            log(reason)
+            self.stopping.set()
+
+    # ─────────────────────────────────────────────────────────────
+    # Ingest
+    # ─────────────────────────────────────────────────────────────
+
+    def _open_sources(self):
+        loop = asyncio.get_running_loop()
+        if self.ingest.open():
+            loop.add_reader(self.ingest.fileno(), self._readable, self.ingest)
+            log(f"Listening for hook events on {self.ingest.path}")
+        else:
+            log("Ingest socket unavailable, hooks will write state.json directly")
+        if self.watcher.open():
+            loop.add_reader(self.watcher.fileno(), self._readable, self.watcher)
+            log("Watching state files for changes")
+        else:
+            log(f"State file watching unavailable, polling every {DAEMON_POLL_INTERVAL}s")
+        if self.pid_watcher.open():
+            loop.add_reader(self.pid_watcher.fileno(), self.sessions_changed.set)
+            log("Tracking session processes with pidfd")
+        else:
+            log(f"pidfd unavailable, checking sessions every {ORPHAN_CHECK_INTERVAL}s")
+        if not self.segment.open():
+            log("Warning: Could not create state segment, status will read state.json")
+
+    def _close_sources(self):
+        loop = asyncio.get_running_loop()
+        for source in (self.ingest, self.watcher, self.pid_watcher):
+            if source.is_open:
+                loop.remove_reader(source.fileno())
+        self.ingest.close()
+        self.watcher.close()
+        self.pid_watcher.close()
+        self.segment.close()
+
+    def _readable(self, source):
+        # One-shot: the selector reports a readable fd on every pass until
+        # ingest_task gets to drain it, and each report would wake it again
+        asyncio.get_running_loop().remove_reader(source.fileno())
+        self.readable.append(source)
+        self.wake.set()
+
+    def _resume_readers(self):
+        loop = asyncio.get_running_loop()
+        for source in self.readable:
+            if source.is_open:
+                loop.add_reader(source.fileno(), self._readable, source)
+        self.readable = []
+
+    async def ingest_task(self):
+        consecutive_errors = 0
+        while True:
+            count('loop_iterations_total{loop="ingest"}')
+            self.wake.clear()
+            try:
+                await self._process_events()
+            except OSError as e:
+                # Expected transient errors - log and continue with circuit breaker
+                consecutive_errors += 1
+                log(f"Daemon error (recoverable, {consecutive_errors}/{MAX_CONSECUTIVE_ERRORS}): {e}")
+                if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                    self.request_stop(f"ERROR: Too many consecutive errors ({consecutive_errors}), daemon exiting")
+                    return
+                await asyncio.sleep(5)
+                continue
+            consecutive_errors = 0
+            self._resume_readers()
+
+            timeout = None if self.watcher.is_open else DAEMON_POLL_INTERVAL
+            if self.pending_events:
+                timeout = 1  # Retry the failed journal write
+            await _wait_any(self.wake, timeout=timeout)
+
+    async def _process_events(self):
+        # Journal queued hook events with one append (no lock), then fold
+        # everything new in the journal into the in-memory state.
+        # Events stay pending if both write paths fail so they are retried.
+        drained = self.ingest.drain()
+        if drained:
+            count("hook_events_total", len(drained))
+            # "done" events only feed the tool latencies - they never reach the journal
+            self.pending_events.extend(event for event in drained if not self.tool_latency.observe(event))
+            now = time.time()
+            for event in drained:
+                self.tracer.observe(event, now)
+            if self.tracer.should_flush(now):
+                self.trace_due.set()
+        stop_requested = False
+        if self.pending_events:
+            events = self.pending_events
+            written = append_events(events, log)
+            if not written:
+                # Locked fallback can wait on state.lock - keep it off the loop
+                written = await asyncio.to_thread(apply_events_locked, events, log) is not None
+            if written:
+                stop_requested = any(event.get("op") == "stop" for event in events)
+                self.pending_events = []
+        # Drained after our own append so it does not wake us again; hook
+        # writes before this point are read by the refresh below
+        if SESSIONS_FILE.name in self.watcher.drain():
+            self.sessions_changed.set()
+        if self.follower.refresh(log):
+            self.segment.publish(self.follower.state)
+            self.history.observe(self.follower.state)
+            # Only real changes re-render; time-based ones (idle, token view
+            # flip) wake _present() through its own deadline
+            self.state_changed.set()
+        if self.follower.journal_size > DAEMON_COMPACT_SIZE:
+            await asyncio.to_thread(compact_journal, 0.5, log)
+
+        if stop_requested:
+            if await asyncio.to_thread(cleanup_dead_sessions) == 0:
+                self.request_stop("Stop requested via ingest socket, daemon exiting")
+            else:
+                log("Stop requested but sessions are still active, ignoring")
+
+    # ─────────────────────────────────────────────────────────────
+    # Discord
+    # ─────────────────────────────────────────────────────────────
+
+    async def discord_task(self):
+        attempts = 0
+        while True:
+            self.reconnect.clear()
+            app_id = self.app_id
+            rpc = AioPresence(app_id)
+            try:
+                await asyncio.wait_for(rpc.connect(), DISCORD_CONNECT_TIMEOUT)
+            except DISCORD_ERRORS as e:
+                attempts += 1
+                log(f"Failed to connect to Discord (attempt {attempts}/{DISCORD_CONNECT_MAX_RETRIES}): {str(e) or type(e).__name__}")
+                self._close_rpc(rpc)
+                if attempts >= DISCORD_CONNECT_MAX_RETRIES:
+                    self.request_stop(f"ERROR: Cannot connect to Discord after {DISCORD_CONNECT_MAX_RETRIES} attempts. Is Discord running?")
+                    return
+                await _wait_any(self.reconnect, timeout=DISCORD_RETRY_DELAY)
+                continue
+
+            attempts = 0
+            log(f"Connected to Discord with App ID: {app_id}")
+            try:
+                await self._present(rpc)
+            except DISCORD_ERRORS as e:
+                # Connection lost - reconnect after a short, growing delay
+                log(f"Failed to update presence (connection lost): {str(e) or type(e).__name__}, "
+                    f"reconnecting in {self.reconnect_delay}s")
+                count("discord_reconnects_total")
+                self._close_rpc(rpc)
+                await _wait_any(self.reconnect, timeout=self.reconnect_delay)
+                self.reconnect_delay = min(self.reconnect_delay * 2, DISCORD_RETRY_DELAY)
+                continue
+            except asyncio.CancelledError:
+                await self._clear_presence(rpc)
+                raise
+            # Reconnect requested (app ID changed)
+            await self._clear_presence(rpc)
+
+    async def _present(self, rpc):
+        """Render presence on every state change until a reconnect is requested."""
+        self.scheduler.reset()  # New connection starts with no presence
+        last_duration_ms = 0  # Track duration changes for jitter-free session_start
+        cached_session_start = int(time.time())  # Cached session_start timestamp
+        rejected = 0  # Consecutive updates Discord answered with an error
+        hold_until = 0.0  # No update before this time (backoff after a rejection)
+
+        while not self.reconnect.is_set():
+            count('loop_iterations_total{loop="present"}')
+            # Cleared before reading state so changes during the update below wake us again
+            self.state_changed.clear()
+            timeout = None
+            state = self.follower.state
+            if state:
+                now = time.time()
+                # Calculate session start from duration for Discord elapsed timer
+                # Only recalculate when duration_ms changes to prevent jitter
+                duration_ms = state.get("duration_ms", 0)
+                if duration_ms != last_duration_ms:
+                    last_duration_ms = duration_ms
+                    if duration_ms > 0:
+                        cached_session_start = int(now) - (duration_ms // 1000)
+                    else:
+                        cached_session_start = state.get("session_start", int(now))
+
+                current, next_change = build_presence(state, self.config, cached_session_start, now)
+                # Only send if something changed, within Discord's rate limit
+                self.scheduler.offer(current)
+                payload = self.scheduler.take() if now >= hold_until else None
+                if payload:
+                    log(f"Sending to Discord: {payload['details']} | {payload['state_line']}", DEBUG)
+                    update_started = time.perf_counter()
+                    try:
+                        await asyncio.wait_for(rpc.update(
+                            details=payload["details"],
+                            state=payload["state_line"],
+                            start=payload["start"],
+                            large_image="claude",
+                            large_text="Claude Code",
+                        ), DISCORD_UPDATE_TIMEOUT)
+                    except DISCORD_REJECTIONS as e:
+                        # Keep the connection; retry once the backoff and the rate limit allow
+                        self.scheduler.mark_failed(payload)
+                        count("rpc_update_failures_total")
+                        rejected += 1
+                        if rejected >= MAX_REJECTED_UPDATES:
+                            log(f"Discord rejected {rejected} updates in a row, reconnecting")
+                            raise
+                        backoff = min(2 ** (rejected - 1), REJECTED_RETRY_MAX)
+                        hold_until = time.time() + backoff
+                        log(f"Discord rejected presence update ({rejected}/{MAX_REJECTED_UPDATES}): "
+                            f"{str(e) or type(e).__name__}, retrying in {backoff}s")
+                    except DISCORD_ERRORS:
+                        self.scheduler.mark_failed(payload)
+                        count("rpc_update_failures_total")
+                        raise
+                    else:
+                        observe("rpc_update_seconds", time.perf_counter() - update_started)
+                        self.scheduler.mark_sent()
+                        rejected = 0
+                        self.reconnect_delay = RECONNECT_DELAY
+                    self.stats_due.set()
+
+                # Wake for the next self-change or when a held-back update may go out
+                deadline = next_change
+                delay = self.scheduler.wait_time()
+                if delay is not None:
+                    send_at = max(time.time() + delay, hold_until)
+                    deadline = send_at if deadline is None else min(deadline, send_at)
+                if deadline is not None:
+                    timeout = max(0.0, deadline - time.time())
+
+            await _wait_any(self.state_changed, self.reconnect, timeout=timeout)
+
+    async def _clear_presence(self, rpc):
+        try:
+            await asyncio.wait_for(rpc.clear(), DISCORD_UPDATE_TIMEOUT)
+        except DISCORD_ERRORS as e:
+            log(f"Warning: Error clearing presence: {str(e) or type(e).__name__}")
+        self._close_rpc(rpc)
+
+    @staticmethod
+    def _close_rpc(rpc):
+        # AioPresence.close() also closes the event loop, so hang up by hand
+        writer = getattr(rpc, "sock_writer", None)
+        if writer is None:
+            return
+        try:
+            rpc.send_data(2, {"v": 1, "client_id": rpc.client_id})
+            writer.close()
+        except (OSError, RuntimeError):
+            pass
+
+    # ─────────────────────────────────────────────────────────────
+    # Sessions and config
+    # ─────────────────────────────────────────────────────────────
+
+    async def sessions_task(self):
+        poll = False  # First pass only starts watching the registered sessions
+        while True:
+            count('loop_iterations_total{loop="sessions"}')
+            self.sessions_changed.clear()
+            exited = self.pid_watcher.exited()
+            if exited or poll:
+                if exited:
+                    log(f"Session process exited: {', '.join(str(pid) for pid in sorted(exited))}")
+                self.stats_due.set()
+                # Takes sessions.lock and probes PIDs - run off the loop
+                if await asyncio.to_thread(cleanup_dead_sessions, exited) == 0:
+                    self.request_stop("No active sessions remaining, daemon exiting")
+                    return
+            unwatched = self.pid_watcher.watch(await asyncio.to_thread(session_pids))
+            interval = session_check_interval(self.pid_watcher, self.watcher, unwatched)
+            await _wait_any(self.sessions_changed, timeout=interval)
+            poll = not self.sessions_changed.is_set()
+
+    async def config_task(self):
+        while True:
+            await asyncio.sleep(CONFIG_RELOAD_INTERVAL)
+            config = await asyncio.to_thread(get_config)
+            if config is self.config:
+                continue  # config.yaml unchanged - same snapshot
+            self.config = config
+            self.state_changed.set()  # Display toggles may have changed
+            new_app_id = self.config.get("discord_app_id") or DISCORD_APP_ID
+            if new_app_id != self.app_id:
+                log(f"App ID changed from {self.app_id} to {new_app_id}, reconnecting...")
+                count("discord_reconnects_total")
+                self.app_id = new_app_id
+                self.reconnect.set()
+
+    async def metrics_task(self):
+        while True:
+            # Idle while metrics_textfile is off - config_task swaps self.config
+            await asyncio.sleep(METRICS_INTERVAL if self.config["metrics_textfile"] else CONFIG_RELOAD_INTERVAL)
+            if self.config["metrics_textfile"]:
+                self.stats_due.set()
+
+    async def stats_task(self):
+        while True:
+            await self.stats_due.wait()
+            self.stats_due.clear()
+            stats, hints = daemon_stats(self.scheduler.stats(), self.follower.stats(), self.tool_latency)
+            # Up to three atomic file rewrites - keep them off the loop. Shielded
+            # so shutdown waits for a write in progress instead of racing it.
+            self.stats_write = asyncio.ensure_future(
+                asyncio.to_thread(publish_daemon_stats, stats, hints, self.config["metrics_textfile"]))
+            await asyncio.shield(self.stats_write)
+
+    async def trace_task(self):
+        while True:
+            await _wait_any(self.trace_due, timeout=TRACE_FLUSH_INTERVAL)
+            self.trace_due.clear()
+            batches = self.tracer.take()
+            if not batches:
+                continue
+            # Appends, rotation and pruning - keep them off the loop. Shielded
+            # so shutdown waits for a write in progress instead of racing it.
+            self.trace_write = asyncio.ensure_future(asyncio.to_thread(self.tracer.write, batches, log))
+            self.tracer.restore(await asyncio.shield(self.trace_write))
+            self.trace_write = None
+
+    async def history_task(self):
+        while True:
+            await asyncio.sleep(HISTORY_INTERVAL)
+            rows = self.history.take()
+            # SQLite may wait on a reader's lock - keep it off the loop
+            if rows and not await asyncio.to_thread(self.history.write, rows, log):
+                self.history.restore(rows)
+
+    # ─────────────────────────────────────────────────────────────
+    # Supervisor
+    # ─────────────────────────────────────────────────────────────
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.request_stop, "Received shutdown signal")
+
+        self._open_sources()
+        tasks = {
+            asyncio.create_task(self.ingest_task(), name="ingest"),
+            asyncio.create_task(self.discord_task(), name="discord"),
+            asyncio.create_task(self.sessions_task(), name="sessions"),
+            asyncio.create_task(self.config_task(), name="config"),
+            asyncio.create_task(self.metrics_task(), name="metrics"),
+            asyncio.create_task(self.trace_task(), name="trace"),
+            asyncio.create_task(self.history_task(), name="history"),
+            asyncio.create_task(self.stats_task(), name="stats"),
+        }
+        stop_waiter = asyncio.create_task(self.stopping.wait())
+        try:
+            done, _ = await asyncio.wait(tasks | {stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stop_waiter and not task.cancelled() and task.exception():
+                    # Unexpected errors (programming bugs) - exit rather than run half a daemon
+                    e = task.exception()
+                    log(f"Daemon error (FATAL unexpected in {task.get_name()}): {e}\n"
+                        f"{''.join(traceback.format_exception(type(e), e, e.__traceback__))}")
+        finally:
+            for task in tasks | {stop_waiter}:
+                task.cancel()
+            await asyncio.gather(*tasks, stop_waiter, return_exceptions=True)
+            self._close_sources()
+            if self.trace_write is not None:
+                # Cancelled mid-write: its failed records go into the final flush
+                failed, = await asyncio.gather(self.trace_write, return_exceptions=True)
+                if isinstance(failed, list):
+                    self.tracer.restore(failed)
+            self.tracer.flush(log)
+            self.history.close(log)
+            if self.stats_write is not None:
+                await asyncio.gather(self.stats_write, return_exceptions=True)
+            stats = self.scheduler.stats()
+            write_daemon_stats(stats, self.follower.stats(), self.config["metrics_textfile"], self.tool_latency)
+            log(f"Discord updates: {stats['sent']} sent, {stats['failed']} failed, {stats['coalesced']} coalesced, "
+                f"{stats['dropped']} dropped")
+
+
+def run_async_daemon():
+    """Run the asyncio daemon (see AsyncDaemon)."""
+    log("Daemon starting (asyncio)...")
+    try:
+        write_pid()
+    except OSError as e:
+        log(f"FATAL: Could not write PID file, aborting to prevent duplicate daemons: {e}")
+        return
+    atexit.register(remove_pid)
+
+    # Log YAML availability on startup for easier debugging
+    if not YAML_AVAILABLE:
+        log("Info: PyYAML not installed - config.yaml support disabled. Install with: pip install pyyaml")
+
+    config = get_config(force_reload=True)
+    log(f"Using Discord App ID: {config.get('discord_app_id') or DISCORD_APP_ID}")
+
+    try:
+        asyncio.run(AsyncDaemon(config).run())
+    except KeyboardInterrupt:
+        pass
+    log("Daemon stopped")
@@ -0,0 +1,274 @@
+"""
+Configuration for Discord Rich Presence.
+Parses .claude-plugin/config.yaml into a frozen snapshot (read-only mappings,
+so callers share one object instead of copying it) and re-parses only when
+the file's inode, size or mtime changes. Each parse is also written to
+DATA_DIR as plain JSON keyed on that signature, so the PreToolUse hook can
+read the settings without importing PyYAML.
+"""
+
+import json
+import os
+from pathlib import Path
+from types import MappingProxyType
+
+from state import DATA_DIR, atomic_write_json
+from logfile import LOG_LEVELS
+from metrics import count
+
+CONFIG_FILE_NAME = "config.yaml"
+CONFIG_CACHE_FILE = DATA_DIR / "config.cache.json"
+CONFIG_CACHE_VERSION = 3
+
+DEFAULT_CONFIG = {
+    "discord_app_id": None,  # Uses DISCORD_APP_ID constant if None
+    "display": {
+        "show_tokens": True,
+        "show_cost": True,
+        "show_model": True,
+        "show_branch": True,
+        "show_file": True,
+        "show_lines": True,  # Show lines added/removed on Discord
+        "show_context_warning": True,  # Show context % warning at >80%
+        "show_session_totals": False,  # Tokens and cost summed over all sessions instead of the active one
+    },
+    "idle_timeout": 300,  # 5 minutes in seconds
+    "daemon_mode": "async",  # "async" (asyncio tasks) or "sync" (single loop)
+    "log_level": "info",  # "debug" also logs every hook event and Discord update
+    "metrics_textfile": False,  # Write DATA_DIR/output/metrics.prom for node-exporter's textfile collector
+}
+CONFIG_RELOAD_INTERVAL = 30  # How often the daemon checks config.yaml for changes (one stat)
+
+_yaml = None  # Imported on first parse - hooks never need it
+_yaml_warning_logged = False
+
+
+def yaml_available() -> bool:
+    """Import PyYAML if it is installed. Returns False when it is not."""
+    global _yaml
+    if _yaml is None:
+        try:
+            import yaml
+            _yaml = yaml
+        except ImportError:
+            _yaml = False
+    return _yaml is not False
+
+
+def freeze(value):
+    """Return value with every dict wrapped as a read-only MappingProxyType."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    return value
+
+
+def _defaults() -> dict:
+    return {**DEFAULT_CONFIG, "display": dict(DEFAULT_CONFIG["display"])}
+
+
+# ═══════════════════════════════════════════════════════════════
+# Parsing
+# ═══════════════════════════════════════════════════════════════
+
+def get_plugin_root(logger=None) -> Path | None:
+    """Get plugin root directory from CLAUDE_PLUGIN_ROOT environment variable."""
+    plugin_root = os.environ.get("CLAUDE_PLUGIN_ROOT")
+    if plugin_root:
+        path = Path(plugin_root)
+        if path.exists():
+            return path
+        if logger:
+            logger(f"Warning: CLAUDE_PLUGIN_ROOT '{plugin_root}' does not exist, config.yaml will not be loaded")
+    return None
+
+
+def config_path(logger=None) -> Path | None:
+    """Location of config.yaml: {CLAUDE_PLUGIN_ROOT}/.claude-plugin/config.yaml"""
+    plugin_root = get_plugin_root(logger)
+    return plugin_root / ".claude-plugin" / CONFIG_FILE_NAME if plugin_root else None
+
+
+def _signature(path: Path | None) -> tuple | None:
+    """(inode, size, mtime_ns) of path, or None when it does not exist."""
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _parse_config(path: Path | None, logger=None) -> tuple[dict, bool]:
+    """Parse and validate path. Returns (config, cacheable) - cacheable is
+    False when the result does not follow from the file's contents alone
+    (missing file, PyYAML not installed, read error)."""
+    global _yaml_warning_logged
+
+    config = _defaults()
+    if path is None or not path.exists():
+        return config, False
+
+    # Warn if config.yaml exists but PyYAML is not installed
+    if not yaml_available():
+        if logger and not _yaml_warning_logged:
+            logger("Warning: PyYAML not installed - config.yaml is being IGNORED. Install with: pip install pyyaml")
+            _yaml_warning_logged = True
+        return config, False
+
+    log = logger or (lambda message: None)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            user_config = _yaml.safe_load(f) or {}
+        if not isinstance(user_config, dict):
+            log(f"Warning: Config file {path} is not a mapping, using default settings")
+            return config, True
+
+        # Merge discord_app_id (validate 17-19 digit numeric string)
+        if "discord_app_id" in user_config and user_config["discord_app_id"]:
+            app_id = str(user_config["discord_app_id"])
+            if app_id.isdigit() and 17 <= len(app_id) <= 19:
+                config["discord_app_id"] = app_id
+            else:
+                log(f"Warning: Invalid discord_app_id format '{app_id}', using default")
+
+        # Merge display toggles
+        if "display" in user_config and isinstance(user_config["display"], dict):
+            for key in config["display"]:
+                if key in user_config["display"]:
+                    config["display"][key] = bool(user_config["display"][key])
+
+        # Merge idle_timeout (1 second to 24 hours)
+        if "idle_timeout" in user_config:
+            timeout = user_config["idle_timeout"]
+            if isinstance(timeout, (int, float)) and timeout >= 1 and timeout <= 86400:
+                config["idle_timeout"] = int(timeout)
+            else:
+                log(f"Warning: idle_timeout must be 1-86400 seconds, got '{timeout}', using default")
+
+        # Merge daemon_mode (takes effect on the next daemon start)
+        if "daemon_mode" in user_config:
+            mode = user_config["daemon_mode"]
+            if mode in ("async", "sync"):
+                config["daemon_mode"] = mode
+            else:
+                log(f"Warning: daemon_mode must be 'async' or 'sync', got '{mode}', using default")
+
+        # Merge metrics_textfile
+        if "metrics_textfile" in user_config:
+            config["metrics_textfile"] = bool(user_config["metrics_textfile"])
+
+        # Merge log_level
+        if "log_level" in user_config:
+            level = str(user_config["log_level"]).lower()
+            if level in LOG_LEVELS:
+                config["log_level"] = level
+            else:
+                log(f"Warning: log_level must be one of {', '.join(LOG_LEVELS)}, got '{user_config['log_level']}', using default")
+
+        log(f"Loaded config from {path}")
+
+    except _yaml.YAMLError as e:
+        log(f"ERROR: Config file {path} has invalid YAML syntax: {e}")
+        log(f"ERROR: Using ALL default settings until config is fixed")
+    except OSError as e:
+        log(f"ERROR: Could not read config file {path}: {e}")
+        return config, False
+
+    return config, True
+
+
+def load_config(logger=None) -> dict:
+    """Load configuration from YAML file, falling back to defaults.
+
+    Returns a new, mutable dict with defaults for any missing keys.
+    """
+    return _parse_config(config_path(logger), logger)[0]
+
+
+# ═══════════════════════════════════════════════════════════════
+# Compiled Cache
+# ═══════════════════════════════════════════════════════════════
+
+def _write_compiled(path: Path, signature: tuple, config: dict, logger=None):
+    try:
+        atomic_write_json(CONFIG_CACHE_FILE, {
+            "version": CONFIG_CACHE_VERSION,
+            "path": str(path),
+            "signature": list(signature),
+            "config": config,
+        })
+    except OSError as e:
+        if logger:
+            logger(f"Warning: Could not write config cache: {e}")
+
+
+def _read_compiled(path: Path, signature: tuple) -> dict | None:
+    try:
+        with open(CONFIG_CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if (not isinstance(cache, dict) or cache.get("version") != CONFIG_CACHE_VERSION
+            or cache.get("path") != str(path) or cache.get("signature") != list(signature)
+            or not isinstance(cache.get("config"), dict)):
+        return None
+    return cache["config"]
+
+
+def compiled_config():
+    """
+    Frozen config from the compiled cache alone - never parses YAML.
+
+    Returns the defaults when there is no config.yaml, and None when the
+    cache does not match the file's current signature (not parsed since it
+    last changed); callers then leave config-dependent decisions to the
+    daemon.
+    """
+    path = config_path()
+    signature = _signature(path)
+    if signature is None:
+        return freeze(_defaults())
+    config = _read_compiled(path, signature)
+    return freeze(config) if config is not None else None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Snapshot
+# ═══════════════════════════════════════════════════════════════
+
+_snapshot = None
+_snapshot_key = None  # (config path, signature) the snapshot was built from
+
+
+def get_config(force_reload: bool = False, logger=None):
+    """
+    Current config as a frozen snapshot (nested read-only mappings).
+
+    Costs one stat while config.yaml is unchanged; when its signature moves
+    the file is re-parsed (or taken from the compiled cache another process
+    wrote for the same signature). force_reload always parses the YAML, so
+    validation warnings are logged again.
+    """
+    global _snapshot, _snapshot_key
+
+    count("config_checks_total")
+    path = config_path(logger)
+    signature = _signature(path)
+    key = (path, signature)
+    if not force_reload and _snapshot is not None and key == _snapshot_key:
+        return _snapshot
+    count("config_reloads_total")
+
+    config = None
+    if signature is not None and not force_reload:
+        config = _read_compiled(path, signature)
+    if config is None:
+        config, cacheable = _parse_config(path, logger)
+        # Only cache when the file did not change while it was being read
+        if cacheable and signature is not None and _signature(path) == signature:
+            _write_compiled(path, signature, config, logger)
+
+    _snapshot = freeze(config)
+    _snapshot_key = key
+    return _snapshot
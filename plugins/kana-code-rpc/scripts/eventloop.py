@@ -0,0 +1,310 @@
+"""
+Event loop primitives for the Discord Rich Presence daemon.
+Lets run_daemon() block until something actually happens - a hook event on
+the ingest socket, a state file write seen through inotify, or the next
+timer deadline - instead of waking every second to poll.
+"""
+
+import heapq
+import os
+import selectors
+import struct
+import sys
+import time
+
+# ═══════════════════════════════════════════════════════════════
+# Timers
+# ═══════════════════════════════════════════════════════════════
+
+
+class Timers:
+    """
+    Named one-shot deadlines on a heap.
+
+    Rescheduling a name replaces its deadline; superseded heap entries are
+    discarded lazily when they reach the top.
+
+    Usage:
+        timers = Timers()
+        timers.schedule("orphan", time.time() + 30)
+        for name in timers.pop_due(time.time()):
+            ...
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def schedule(self, name: str, deadline: float):
+        self._deadlines[name] = deadline
+        heapq.heappush(self._heap, (deadline, name))
+
+    def cancel(self, name: str):
+        self._deadlines.pop(name, None)
+
+    def pending(self, name: str) -> bool:
+        return name in self._deadlines
+
+    def _discard_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: float) -> set:
+        """Remove and return the names of all timers due at or before now."""
+        due = set()
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, name = heapq.heappop(self._heap)
+            del self._deadlines[name]
+            due.add(name)
+            self._discard_stale()
+        return due
+
+    def next_deadline(self) -> float | None:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Directory Watcher (Linux inotify)
+# ═══════════════════════════════════════════════════════════════
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class DirWatcher:
+    """
+    Wakes the daemon when hooks write state files without going through the
+    ingest socket (journal appends, locked state.json rewrites).
+
+    Usage:
+        watcher = DirWatcher(DATA_DIR, {"state.journal", "state.json"})
+        if watcher.open():
+            selector.register(watcher, ...)
+            changed = watcher.drain()   # Watched names touched since the last drain
+        watcher.close()
+
+    Only finished writes are reported: a writer closing the file (journal
+    appends) or renaming one into place (atomic rewrites). inotify watches
+    the whole directory, so files the daemon writes for itself live in
+    OUTPUT_DIR, one level down.
+
+    Only Linux has inotify; elsewhere open() returns False and the daemon
+    falls back to a bounded poll interval.
+    """
+
+    def __init__(self, path, names):
+        self.path = path
+        self.names = {name.encode("utf-8") for name in names}
+        self._fd = -1
+
+    @property
+    def is_open(self) -> bool:
+        return self._fd >= 0
+
+    def open(self) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd < 0:
+                return False
+            mask = _IN_CLOSE_WRITE | _IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.fsencode(self.path), mask) < 0:
+                os.close(fd)
+                return False
+        except (OSError, AttributeError):
+            return False  # No libc symbol (musl without inotify, sandboxing)
+        self._fd = fd
+        return True
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def drain(self) -> set:
+        """Consume queued inotify events. Returns the watched names that changed."""
+        changed = set()
+        while self._fd >= 0:
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError:
+                break  # BlockingIOError: queue is empty
+            if not data:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                start = offset + _EVENT_HEADER.size
+                name = data[start:start + length].rstrip(b"\0")
+                if name in self.names:
+                    changed.add(name.decode("utf-8"))
+                offset = start + length
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = -1
+
+
+# ═══════════════════════════════════════════════════════════════
+# Process Watcher (Linux pidfd)
+# ═══════════════════════════════════════════════════════════════
+
+class PidWatcher:
+    """
+    Notices session processes exiting the moment they exit.
+
+    Holds one pidfd per watched PID inside a private epoll set; the epoll fd
+    itself becomes readable when any watched process exits, so the daemon
+    registers a single source however many sessions there are.
+
+    Usage:
+        pids = PidWatcher()
+        if pids.open():
+            selector.register(pids, ...)
+            unwatched = pids.watch({1234, 5678})  # PIDs that could not be watched
+            exited = pids.exited()                # PIDs that have exited since
+        pids.close()
+
+    open() fails without pidfd_open (Linux < 5.3, Python < 3.9, other
+    platforms); callers keep polling is_process_alive() instead.
+    """
+
+    def __init__(self):
+        self._selector = None
+        self._fds = {}  # pid -> pidfd
+
+    @property
+    def is_open(self) -> bool:
+        return self._selector is not None
+
+    def open(self) -> bool:
+        if not hasattr(os, "pidfd_open") or not hasattr(selectors, "EpollSelector"):
+            return False
+        try:
+            os.close(os.pidfd_open(os.getpid()))  # Kernel support check
+            self._selector = selectors.EpollSelector()
+        except OSError:
+            return False
+        return True
+
+    def fileno(self) -> int:
+        return self._selector.fileno() if self._selector else -1
+
+    def watch(self, pids) -> set:
+        """Watch exactly pids (adding and dropping pidfds as needed).
+
+        Returns the PIDs that could not be watched - already gone or not
+        accessible - which the caller should check by polling.
+        """
+        if self._selector is None:
+            return set(pids)
+        pids = set(pids)
+        for pid in list(self._fds):
+            if pid not in pids:
+                self._forget(pid)
+        unwatched = set()
+        for pid in pids - self._fds.keys():
+            try:
+                fd = os.pidfd_open(pid)
+            except OSError:
+                unwatched.add(pid)  # ESRCH: already exited, EPERM/EINVAL: can't watch
+                continue
+            self._fds[pid] = fd
+            self._selector.register(fd, selectors.EVENT_READ, pid)
+        return unwatched
+
+    def exited(self) -> set:
+        """Return (and stop watching) every watched PID that has exited."""
+        if self._selector is None:
+            return set()
+        try:
+            ready = self._selector.select(0)
+        except OSError:
+            return set()
+        pids = {key.data for key, _ in ready}
+        for pid in pids:
+            self._forget(pid)
+        return pids
+
+    def _forget(self, pid: int):
+        fd = self._fds.pop(pid, None)
+        if fd is None:
+            return
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._selector is None:
+            return
+        for pid in list(self._fds):
+            self._forget(pid)
+        self._selector.close()
+        self._selector = None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Waiter
+# ═══════════════════════════════════════════════════════════════
+
+class Waiter:
+    """
+    Blocks on any number of registered sources until one is readable.
+
+    Usage:
+        waiter = Waiter()
+        waiter.register(ingest, "ingest")
+        ready = waiter.wait(timeout)   # {"ingest"} or set() on timeout
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+
+    def register(self, source, tag: str) -> bool:
+        try:
+            self._selector.register(source, selectors.EVENT_READ, tag)
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def unregister(self, source):
+        try:
+            self._selector.unregister(source)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def wait(self, timeout: float) -> set:
+        """Wait up to timeout seconds. Returns the tags of readable sources."""
+        timeout = max(0.0, timeout)
+        if not self._selector.get_map():
+            # Nothing to wait on (Windows select() rejects empty sets)
+            time.sleep(timeout)
+            return set()
+        try:
+            events = self._selector.select(timeout)
+        except (OSError, ValueError):
+            time.sleep(min(timeout, 1.0))
+            return set()
+        return {key.data for key, _ in events}
+
+    def close(self):
+        try:
+            self._selector.close()
+        except OSError:
+            pass
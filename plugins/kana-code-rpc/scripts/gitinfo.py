@@ -0,0 +1,351 @@
+"""
+Git metadata for Discord Rich Presence.
+Resolves the current branch by reading .git/HEAD directly (following gitdir:
+files for worktrees and submodules) instead of forking git on every
+statusline refresh, and the project's repo name and remote from .git/config.
+Results are cached in DATA_DIR, keyed on the inode/mtime/size of the file
+they came from, so an unchanged checkout costs one stat per call.
+"""
+
+import json
+import os
+import re
+from urllib.parse import urlsplit
+
+from state import DATA_DIR, atomic_write_json
+
+# ═══════════════════════════════════════════════════════════════
+# Cache Setup
+# ═══════════════════════════════════════════════════════════════
+
+GIT_CACHE_FILE = DATA_DIR / "git_cache.json"
+PROJECT_CACHE_FILE = DATA_DIR / "projects.json"
+CACHE_MAX_ENTRIES = 64  # Distinct directories remembered per cache file
+
+# Environment variables that change how git discovers the repository;
+# when any is set only git itself gives the right answer
+_GIT_ENV_OVERRIDES = ("GIT_DIR", "GIT_WORK_TREE", "GIT_CEILING_DIRECTORIES", "GIT_COMMON_DIR")
+
+# ═══════════════════════════════════════════════════════════════
+# Repository Discovery
+# ═══════════════════════════════════════════════════════════════
+
+
+def find_git_dir(path: str) -> str | None:
+    """Return the git directory for path, walking up like git does.
+
+    A `.git` directory is used as is; a `.git` file (worktrees, submodules)
+    is followed through its `gitdir:` line. Returns None when path is not
+    inside a working tree or the layout is not recognised.
+    """
+    current = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(current, ".git")
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            return _read_gitdir_file(dot_git)
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+
+def _read_gitdir_file(dot_git: str) -> str | None:
+    """Follow a `gitdir: <path>` file. Relative paths are relative to the file."""
+    try:
+        with open(dot_git, "r", encoding="utf-8") as f:
+            line = f.readline().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+    if not line.startswith("gitdir:"):
+        return None
+    git_dir = line[len("gitdir:"):].strip()
+    if not os.path.isabs(git_dir):
+        git_dir = os.path.join(os.path.dirname(dot_git), git_dir)
+    git_dir = os.path.normpath(git_dir)
+    return git_dir if os.path.isdir(git_dir) else None
+
+
+def parse_head(content: str) -> str | None:
+    """Turn HEAD file content into the `git rev-parse --abbrev-ref HEAD` answer.
+
+    "ref: refs/heads/main" -> "main", a bare commit id (detached) -> "HEAD".
+    Returns None for anything else (other ref namespaces, reftable stubs).
+    """
+    content = content.strip()
+    if content.startswith("ref:"):
+        ref = content[len("ref:"):].strip()
+        if ref.startswith("refs/heads/"):
+            branch = ref[len("refs/heads/"):]
+            # reftable repositories keep a placeholder HEAD pointing here
+            return branch if branch and branch != ".invalid" else None
+        return None
+    if len(content) in (40, 64) and all(c in "0123456789abcdef" for c in content):
+        return "HEAD"
+    return None
+
+
+def find_common_dir(git_dir: str) -> str:
+    """Return the directory holding config/refs shared by all worktrees."""
+    try:
+        with open(os.path.join(git_dir, "commondir"), "r", encoding="utf-8") as f:
+            common = f.readline().strip()
+    except (OSError, UnicodeDecodeError):
+        return git_dir  # Main worktree or submodule: everything lives in git_dir
+    if not os.path.isabs(common):
+        common = os.path.join(git_dir, common)
+    return os.path.normpath(common)
+
+
+# ═══════════════════════════════════════════════════════════════
+# Caches (shared across invocations through DATA_DIR)
+# ═══════════════════════════════════════════════════════════════
+
+def _load_cache(path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError, ValueError):
+        return {}
+
+
+def _save_cache(path, cache: dict):
+    # Oldest entries first (insertion order), trimmed to the cap
+    while len(cache) > CACHE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)))
+    try:
+        atomic_write_json(path, cache)
+    except OSError:
+        pass  # Cache only - the next call resolves again
+
+
+def _file_signature(path: str) -> list | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # git rewrites HEAD and config via lock file + rename, so the inode changes too
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+
+# ═══════════════════════════════════════════════════════════════
+# Branch
+# ═══════════════════════════════════════════════════════════════
+
+def _resolve_from_head(git_dir: str) -> tuple[str | None, list | None]:
+    head_path = os.path.join(git_dir, "HEAD")
+    signature = _file_signature(head_path)
+    if signature is None or os.path.islink(head_path):
+        return None, None  # Missing or legacy symlink HEAD
+    try:
+        with open(head_path, "r", encoding="utf-8") as f:
+            content = f.read(256)
+    except (OSError, UnicodeDecodeError):
+        return None, None
+    return parse_head(content), signature
+
+
+def _branch_via_subprocess(path: str, timeout: float, logger=None) -> str:
+    """Ask git itself (exotic layouts, GIT_DIR overrides)."""
+    import subprocess  # Lazy: only needed when the direct read cannot answer
+    try:
+        result = subprocess.run(
+            ["git", "-C", path, "rev-parse", "--abbrev-ref", "HEAD"],
+            capture_output=True, text=True, timeout=timeout
+        )
+        if result.returncode == 0:
+            return result.stdout.strip()
+    except subprocess.TimeoutExpired:
+        if logger:
+            logger(f"Git branch command timed out for {path}")
+    except FileNotFoundError:
+        pass  # git not installed
+    except OSError as e:
+        if logger:
+            logger(f"Error getting git branch: {e}")
+    return ""
+
+
+def get_git_branch(path: str, timeout: float = 5, logger=None) -> str:
+    """Get the current branch for a working directory.
+
+    Returns the branch name, "HEAD" when detached (like git rev-parse
+    --abbrev-ref HEAD), or "" when path is not in a repository.
+
+    Cache hit (HEAD unchanged since last call for this path): one stat.
+    Cache miss: walk up to .git, read HEAD, update the cache.
+    Falls back to running git for layouts the direct read cannot handle.
+    """
+    if not path:
+        return ""
+    if any(os.environ.get(name) for name in _GIT_ENV_OVERRIDES):
+        return _branch_via_subprocess(path, timeout, logger)
+
+    key = os.path.abspath(path)
+    cache = _load_cache(GIT_CACHE_FILE)
+    entry = cache.get(key)
+    if isinstance(entry, dict) and entry.get("git_dir"):
+        if _file_signature(os.path.join(entry["git_dir"], "HEAD")) == entry.get("head"):
+            return entry.get("branch", "")
+
+    git_dir = find_git_dir(key)
+    if git_dir is None:
+        # Bare repositories and paths inside a git directory have no .git above them
+        if os.path.basename(key).endswith(".git") or f"{os.sep}.git{os.sep}" in key:
+            return _branch_via_subprocess(path, timeout, logger)
+        return ""  # Not a repository (same answer rev-parse gives)
+
+    branch, signature = _resolve_from_head(git_dir)
+    if branch is None:
+        return _branch_via_subprocess(path, timeout, logger)
+
+    cache.pop(key, None)
+    cache[key] = {"git_dir": git_dir, "head": signature, "branch": branch}
+    _save_cache(GIT_CACHE_FILE, cache)
+    return branch
+
+
+# ═══════════════════════════════════════════════════════════════
+# Project Metadata
+# ═══════════════════════════════════════════════════════════════
+
+# Config sections that can change what `git remote get-url` reports
+_CONFIG_INDIRECTIONS = re.compile(r'^\s*\[\s*(include|includeif|url)\b', re.IGNORECASE)
+_SECTION = re.compile(r'^\s*\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+
+
+def read_remote_url(config_path: str, remote: str = "origin") -> str | None:
+    """Read remote.<remote>.url from a git config file.
+
+    Returns "" when the remote is not configured and None when the file
+    cannot be read or uses include/insteadOf sections (ask git instead).
+    """
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    in_remote = False
+    url = ""
+    for line in lines:
+        if _CONFIG_INDIRECTIONS.match(line):
+            return None
+        section = _SECTION.match(line)
+        if section:
+            in_remote = section.group(1).lower() == "remote" and section.group(2) == remote
+            line = line[section.end():]
+        if not in_remote:
+            continue
+        name, sep, value = line.partition("=")
+        if sep and name.strip().lower() == "url" and not url:
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            url = value
+    return url
+
+
+def parse_repo_name(remote_url: str) -> str:
+    """Repo name from a remote URL ('my-repo' from github.com/user/my-repo.git)."""
+    # Handles: https://github.com/user/repo.git, git@github.com:user/repo.git
+    match = re.search(r'[/:]([^/:]+?)(?:\.git)?/?$', remote_url)
+    return match.group(1) if match else ""
+
+
+def normalize_web_url(remote_url: str) -> str:
+    """Browser URL for a remote, e.g. git@github.com:user/repo.git -> https://github.com/user/repo.
+
+    Credentials and ssh ports are dropped. Returns "" for local paths and
+    anything that does not look like a hosted repository.
+    """
+    url = remote_url.strip()
+    if "://" in url:
+        try:
+            parts = urlsplit(url)
+            host = parts.hostname or ""
+            port = parts.port
+        except ValueError:
+            return ""
+        if parts.scheme not in ("http", "https", "ssh", "git", "git+ssh", "ssh+git"):
+            return ""
+        if parts.scheme in ("http", "https") and port:
+            host = f"{host}:{port}"
+        path = parts.path
+    else:
+        # scp-like syntax: [user@]host:path
+        host_part, sep, path = url.partition(":")
+        if not sep or "/" in host_part or len(host_part) == 1:  # "C:" is a drive letter
+            return ""
+        host = host_part.rpartition("@")[2]
+    path = path.strip("/")
+    if path.endswith(".git"):
+        path = path[:-4]
+    if not host or not path:
+        return ""
+    return f"https://{host}/{path}"
+
+
+def _remote_url_via_subprocess(path: str, timeout: float, logger=None) -> str:
+    import subprocess  # Lazy: only needed when the config cannot be read directly
+    try:
+        result = subprocess.run(
+            ["git", "-C", path, "remote", "get-url", "origin"],
+            capture_output=True, text=True, timeout=timeout
+        )
+        if result.returncode == 0:
+            return result.stdout.strip()
+    except subprocess.TimeoutExpired:
+        if logger:
+            logger(f"Git command timed out for {path}")
+    except FileNotFoundError:
+        pass  # git not installed
+    except OSError as e:
+        if logger:
+            logger(f"Error running git: {e}")
+    return ""
+
+
+def get_project_info(project_path: str, timeout: float = 5, logger=None) -> dict:
+    """Project metadata for a working directory.
+
+    Returns {"name", "remote_url", "web_url"}. name is the origin repo name,
+    falling back to the folder name; the URLs are "" without an origin.
+
+    Known project with unchanged .git/config: one stat plus a lookup in
+    DATA_DIR/projects.json. Otherwise the config is parsed (or git is asked
+    for layouts the parser does not handle) and the index is updated.
+    """
+    key = os.path.abspath(project_path)
+    folder_name = os.path.basename(key)
+    info = {"name": folder_name, "remote_url": "", "web_url": ""}
+
+    cache = _load_cache(PROJECT_CACHE_FILE)
+    entry = cache.get(key)
+    if isinstance(entry, dict) and entry.get("config_path"):
+        if _file_signature(entry["config_path"]) == entry.get("config"):
+            info.update({k: entry[k] for k in info if isinstance(entry.get(k), str)})
+            return info
+
+    git_dir = find_git_dir(key)
+    if git_dir is None:
+        return info  # Not a repository: folder name only, nothing worth caching
+
+    config_path = os.path.join(find_common_dir(git_dir), "config")
+    signature = _file_signature(config_path)
+    remote_url = read_remote_url(config_path)
+    if remote_url is None or any(os.environ.get(name) for name in _GIT_ENV_OVERRIDES):
+        remote_url = _remote_url_via_subprocess(key, timeout, logger)
+
+    if remote_url:
+        info["remote_url"] = remote_url
+        info["name"] = parse_repo_name(remote_url) or folder_name
+        info["web_url"] = normalize_web_url(remote_url)
+
+    if signature is not None:
+        cache.pop(key, None)
+        cache[key] = {"config_path": config_path, "config": signature, **info}
+        _save_cache(PROJECT_CACHE_FILE, cache)
+    return info
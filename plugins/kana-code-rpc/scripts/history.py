@@ -0,0 +1,337 @@
+"""
+Session history for Discord Rich Presence.
+The daemon keeps every session's tokens, cost, lines, duration and model in
+a SQLite database (DATA_DIR/output/history.db) instead of losing them when the
+session ends and its state record is dropped.
+
+Each time the in-memory state changes, the daemon compares every session
+record with the last values it saw. Changed sessions are queued, and so are
+sessions that just ended, with their last values. Once a minute the queue is
+written in one transaction (WAL mode, so `presence.py report` can read at the
+same time):
+
+    sessions     one row per session, its latest totals; indexed by
+                 project, branch, model and day
+    snapshots    the values at each write, for a session's history
+    daily_usage  totals per (day, project, branch, model). Each write adds
+                 the session's change since its previous write to the row
+                 for the day the change was seen, so reports sum a few rows
+                 per day and never scan sessions or snapshots.
+
+sqlite3 is imported lazily, so hooks that import presence.py pay nothing
+for it.
+"""
+
+import threading
+import time
+
+from state import OUTPUT_DIR, format_tokens
+
+HISTORY_FILE = OUTPUT_DIR / "history.db"
+HISTORY_INTERVAL = 60  # Seconds between batched writes from the daemon
+SCHEMA_VERSION = 1
+REPORT_DAYS_MAX = 31  # Rows in a report's per-day table, most recent first
+
+# Cumulative per-session values; daily_usage holds the sum of their changes
+USAGE_KEYS = ("input", "output", "cache_read", "cache_write", "cost", "lines_added", "lines_removed", "duration_ms")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id    TEXT PRIMARY KEY,
+    project       TEXT NOT NULL,
+    branch        TEXT NOT NULL,
+    model         TEXT NOT NULL,
+    day           TEXT NOT NULL,      -- Local date the session started (YYYY-MM-DD)
+    started       INTEGER NOT NULL,
+    updated       INTEGER NOT NULL,
+    ended         INTEGER,
+    input         INTEGER NOT NULL,
+    output        INTEGER NOT NULL,
+    cache_read    INTEGER NOT NULL,
+    cache_write   INTEGER NOT NULL,
+    cost          REAL NOT NULL,
+    lines_added   INTEGER NOT NULL,
+    lines_removed INTEGER NOT NULL,
+    duration_ms   INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_project ON sessions (project, day);
+CREATE INDEX IF NOT EXISTS sessions_branch ON sessions (branch, day);
+CREATE INDEX IF NOT EXISTS sessions_model ON sessions (model, day);
+CREATE INDEX IF NOT EXISTS sessions_day ON sessions (day);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    session_id    TEXT NOT NULL,
+    ts            INTEGER NOT NULL,
+    context_pct   REAL NOT NULL,
+    input         INTEGER NOT NULL,
+    output        INTEGER NOT NULL,
+    cache_read    INTEGER NOT NULL,
+    cache_write   INTEGER NOT NULL,
+    cost          REAL NOT NULL,
+    lines_added   INTEGER NOT NULL,
+    lines_removed INTEGER NOT NULL,
+    duration_ms   INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_session ON snapshots (session_id, ts);
+
+CREATE TABLE IF NOT EXISTS daily_usage (
+    day           TEXT NOT NULL,
+    project       TEXT NOT NULL,
+    branch        TEXT NOT NULL,
+    model         TEXT NOT NULL,
+    sessions      INTEGER NOT NULL DEFAULT 0,
+    input         INTEGER NOT NULL DEFAULT 0,
+    output        INTEGER NOT NULL DEFAULT 0,
+    cache_read    INTEGER NOT NULL DEFAULT 0,
+    cache_write   INTEGER NOT NULL DEFAULT 0,
+    cost          REAL NOT NULL DEFAULT 0,
+    lines_added   INTEGER NOT NULL DEFAULT 0,
+    lines_removed INTEGER NOT NULL DEFAULT 0,
+    duration_ms   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, project, branch, model)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_usage_project ON daily_usage (project, day);
+CREATE INDEX IF NOT EXISTS daily_usage_model ON daily_usage (model, day);
+"""
+
+
+def _day(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def session_row(session_id: str, record: dict) -> dict | None:
+    """History values of one state session record, or None before the
+    statusline has reported a model (nothing to record yet)."""
+    if not record.get("model"):
+        return None
+    tokens = record.get("tokens") if isinstance(record.get("tokens"), dict) else {}
+    row = {
+        "session_id": session_id,
+        "project": record.get("project") or "",
+        "branch": record.get("git_branch") or "",
+        "model": record["model"],
+        "started": int(_number(record.get("session_start"))),
+        "context_pct": _number(record.get("context_pct")),
+    }
+    for key in ("input", "output", "cache_read", "cache_write", "cost"):
+        row[key] = _number(tokens.get(key))
+    for key in ("lines_added", "lines_removed", "duration_ms"):
+        row[key] = _number(record.get(key))
+    return row
+
+
+# ═══════════════════════════════════════════════════════════════
+# Recorder (daemon)
+# ═══════════════════════════════════════════════════════════════
+
+class SessionHistory:
+    """
+    Queues session snapshots from the daemon's state and writes them in batches.
+
+    Usage (daemon):
+        history = SessionHistory()
+        if follower.refresh(log):
+            history.observe(follower.state)
+        ...
+        history.flush(log)                     # Every HISTORY_INTERVAL
+        ...
+        history.close(log)                     # On shutdown
+
+    The asyncio daemon writes off the event loop instead:
+        rows = history.take()
+        if not await asyncio.to_thread(history.write, rows, log):
+            history.restore(rows)
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.seen = {}  # session_id -> last row observed
+        self.pending = {}  # session_id -> row not yet written (latest values only)
+        self._db = None
+        self._write_lock = threading.Lock()  # write() may run on a worker thread
+        self.disabled = False
+
+    def observe(self, state: dict, now: float | None = None):
+        """Queue the sessions whose values changed, and those that ended."""
+        now = int(now or time.time())
+        sessions = state.get("sessions") if isinstance(state.get("sessions"), dict) else {}
+        for session_id, record in sessions.items():
+            if not isinstance(record, dict):
+                continue
+            row = session_row(session_id, record)
+            if row is not None and row != self.seen.get(session_id):
+                self.seen[session_id] = row
+                self.pending[session_id] = dict(row, ts=now, ended=None)
+        for session_id in [sid for sid in self.seen if sid not in sessions]:
+            self.pending[session_id] = dict(self.seen.pop(session_id), ts=now, ended=now)
+
+    def take(self) -> list[dict]:
+        rows = list(self.pending.values())
+        self.pending.clear()
+        return rows
+
+    def restore(self, rows: list[dict]):
+        """Requeue rows that could not be written, unless newer ones are queued."""
+        for row in rows:
+            self.pending.setdefault(row["session_id"], row)
+
+    def flush(self, logger=None) -> bool:
+        rows = self.take()
+        if rows and not self.write(rows, logger):
+            self.restore(rows)
+            return False
+        return True
+
+    def _connect(self):
+        import sqlite3  # Lazy: only the daemon and `report` need it
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=2, check_same_thread=False)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; a crash loses at most a batch
+            db.executescript(SCHEMA)
+            db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        except sqlite3.Error:
+            db.close()
+            raise
+        return db
+
+    def write(self, rows: list[dict], logger=None) -> bool:
+        """Write rows in one transaction. Returns False if they were not written."""
+        if not rows or self.disabled:
+            return True
+        try:
+            import sqlite3
+        except ImportError:
+            self.disabled = True
+            if logger:
+                logger("Info: sqlite3 unavailable - session history disabled")
+            return True
+        with self._write_lock:
+            try:
+                if self._db is None:
+                    self._db = self._connect()
+                with self._db:
+                    for row in rows:
+                        self._write_row(row)
+            except (sqlite3.Error, OSError) as e:
+                if logger:
+                    logger(f"Warning: Could not write session history: {e}")
+                return False
+        return True
+
+    def _write_row(self, row: dict):
+        db = self._db
+        old = db.execute(f"SELECT {', '.join(USAGE_KEYS)} FROM sessions WHERE session_id = ?",
+                         (row["session_id"],)).fetchone()
+        values = tuple(row[key] for key in USAGE_KEYS)
+        started = row["started"] or row["ts"]
+        if old is None:
+            db.execute(
+                f"INSERT INTO sessions (session_id, project, branch, model, day, started, updated, ended, "
+                f"{', '.join(USAGE_KEYS)}) VALUES ({', '.join('?' * (8 + len(USAGE_KEYS)))})",
+                (row["session_id"], row["project"], row["branch"], row["model"], _day(started), started,
+                 row["ts"], row["ended"]) + values)
+            delta = values
+        else:
+            db.execute(
+                f"UPDATE sessions SET project = ?, branch = ?, model = ?, updated = ?, "
+                f"ended = ?, {', '.join(f'{key} = ?' for key in USAGE_KEYS)} "
+                f"WHERE session_id = ?",
+                (row["project"], row["branch"], row["model"], row["ts"], row["ended"]) + values
+                + (row["session_id"],))
+            delta = tuple(new - prev for new, prev in zip(values, old))
+
+        # Usage goes to the day it was seen; a session is counted once, on
+        # the day it started, under the project/branch/model it is first seen with
+        additions = {}  # day -> [sessions, *usage changes]
+        if any(delta):
+            additions[_day(row["ts"])] = [0, *delta]
+        if old is None:
+            additions.setdefault(_day(started), [0] * (1 + len(USAGE_KEYS)))[0] += 1
+        for day, sums in additions.items():
+            db.execute(
+                f"INSERT INTO daily_usage (day, project, branch, model, sessions, {', '.join(USAGE_KEYS)}) "
+                f"VALUES ({', '.join('?' * (5 + len(USAGE_KEYS)))}) "
+                f"ON CONFLICT (day, project, branch, model) DO UPDATE SET sessions = sessions + excluded.sessions, "
+                f"{', '.join(f'{key} = {key} + excluded.{key}' for key in USAGE_KEYS)}",
+                (day, row["project"], row["branch"], row["model"], *sums))
+        db.execute(
+            f"INSERT INTO snapshots (session_id, ts, context_pct, {', '.join(USAGE_KEYS)}) "
+            f"VALUES ({', '.join('?' * (3 + len(USAGE_KEYS)))})",
+            (row["session_id"], row["ts"], row["context_pct"]) + values)
+
+    def close(self, logger=None):
+        """Write what is queued and close the database (safe to call twice)."""
+        self.flush(logger)
+        with self._write_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Reports
+# ═══════════════════════════════════════════════════════════════
+
+def _format_duration(ms: int) -> str:
+    minutes = int(ms) // 60_000
+    return f"{minutes // 60}h{minutes % 60:02d}m" if minutes >= 60 else f"{minutes}m"
+
+
+def read_report(days: int = 30, project: str = "", path=HISTORY_FILE) -> dict | None:
+    """Rollups from daily_usage over the last days days (0: all time),
+    optionally for one project: {"by_project", "by_model", "by_day",
+    ["by_branch"]}, each a list of row dicts, biggest cost first (by_day:
+    the REPORT_DAYS_MAX most recent days). None if there is no history yet."""
+    import sqlite3  # Lazy: only the daemon and `report` need it
+    if not path.exists():
+        return None
+    conditions, params = [], []
+    if days > 0:
+        conditions.append("day >= ?")
+        params.append(_day(time.time() - (days - 1) * 86400))
+    if project:
+        conditions.append("project = ?")
+        params.append(project)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sums = ", ".join(f"SUM({key}) AS {key}" for key in ("sessions",) + USAGE_KEYS)
+
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=2)
+    db.row_factory = sqlite3.Row
+    try:
+        report = {}
+        groups = [("by_project", "project", "cost DESC"), ("by_model", "model", "cost DESC"),
+                  ("by_day", "day", f"day DESC LIMIT {REPORT_DAYS_MAX}")]
+        if project:
+            groups.append(("by_branch", "branch", "cost DESC"))
+        for name, column, order in groups:
+            rows = db.execute(f"SELECT {column} AS name, {sums} FROM daily_usage {where} "
+                              f"GROUP BY {column} ORDER BY {order}", params).fetchall()
+            report[name] = [dict(row) for row in rows]
+        return report
+    finally:
+        db.close()
+
+
+def report_lines(report: dict) -> list[str]:
+    """Printable tables for read_report()'s result."""
+    lines = []
+    titles = (("by_project", "By project"), ("by_branch", "By branch"), ("by_model", "By model"),
+              ("by_day", "By day"))
+    for key, title in titles:
+        rows = report.get(key)
+        if not rows:
+            continue
+        width = max(len(row["name"] or "-") for row in rows)
+        lines.append(f"{title}:")
+        for row in rows:
+            tokens = format_tokens(int(row["input"] + row["output"]))
+            lines.append(f"  {row['name'] or '-':<{width}}  {row['sessions']:>4} sessions  {tokens:>7} tokens  "
+                         f"{'$' + format(row['cost'], '.2f'):>9}  +{row['lines_added']} -{row['lines_removed']} lines  "
+                         f"{_format_duration(row['duration_ms'])}")
+    return lines
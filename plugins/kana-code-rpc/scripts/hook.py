@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+PreToolUse/PostToolUse hook entry point for Discord Rich Presence.
+Runs on every tool call, so it imports only what an update needs (state,
+ingest, config cache, log file, recording) - YAML, subprocess and pypresence stay in presence.py, which is
+loaded lazily for every other command. Settings come from the compiled
+config cache (see config.compiled_config), never from config.yaml itself.
+"""
+
+import sys
+import json
+import time
+from pathlib import Path
+
+from ingest import send_event, submit_event
+from jsonstream import read_json_fields
+from config import compiled_config
+from logfile import DEBUG, log, set_log_level
+from recording import record_payload
+
+# Tools that operate on files (for filename display)
+FILE_TOOLS = {"Edit", "Write", "Read", "NotebookEdit", "NotebookRead"}
+
+# The parts of a PreToolUse payload cmd_update reads
+UPDATE_FIELDS = (("tool_name",), ("tool_input", "file_path"), ("tool_input", "notebook_path"), ("session_id",),
+                 ("tool_use_id",))
+
+# The parts of a PostToolUse payload cmd_done reads (never tool_response)
+DONE_FIELDS = (("tool_name",), ("tool_use_id",), ("session_id",))
+
+
+def read_hook_input(fields=None) -> dict:
+    """Read JSON input from stdin (provided by Claude Code hooks).
+
+    fields lists the key paths the caller needs, e.g. ("tool_input",
+    "file_path"); only those are extracted (see jsonstream), so a Write
+    carrying a multi-megabyte file costs no more than a Read. None returns
+    the whole payload, () just consumes it.
+
+    Stops reading as soon as the JSON object is complete rather than
+    waiting for EOF, since pipe closure may not happen promptly in Claude
+    Code 2.1.34+.
+    """
+    try:
+        if sys.stdin is None or sys.stdin.isatty():
+            return {}
+        return read_json_fields(fields)
+    except (json.JSONDecodeError, OSError, UnicodeDecodeError, ValueError) as e:
+        log(f"Warning: Could not parse hook input: {e}")
+    return {}
+
+
+def extract_file_from_tool_input(hook_input: dict) -> str:
+    """Extract filename from hook input's tool_input field.
+
+    For Edit/Write/Read tools, tool_input contains:
+    {
+        "file_path": "/path/to/file.py",
+        ...
+    }
+
+    For NotebookEdit/NotebookRead tools, tool_input contains:
+    {
+        "notebook_path": "/path/to/notebook.ipynb",
+        ...
+    }
+
+    Returns just the filename (not full path), or empty string if not available.
+    """
+    tool_name = hook_input.get("tool_name", "")
+    if tool_name not in FILE_TOOLS:
+        return ""
+
+    tool_input = hook_input.get("tool_input")
+    if not isinstance(tool_input, dict):
+        return ""
+
+    # Check file_path (Edit/Write/Read) or notebook_path (NotebookEdit/NotebookRead)
+    file_path = tool_input.get("file_path", "") or tool_input.get("notebook_path", "")
+    if not file_path:
+        return ""
+
+    try:
+        return Path(file_path).name
+    except (ValueError, OSError, TypeError) as e:
+        log(f"Warning: Could not extract filename from '{file_path}': {e}")
+        return ""
+
+
+def cmd_update():
+    """Handle 'update' command - update current activity.
+
+    Hands the event to the daemon's ingest socket when it is listening,
+    otherwise appends it to the state journal (see ingest.submit_event).
+    With display.show_file off (per the compiled config cache) the filename
+    is never recorded; without a current cache it is, and the daemon applies
+    the toggle when it renders.
+
+    The event also carries the tool_use_id and the time the hook started,
+    which the daemon pairs with cmd_done's to time the tool.
+    """
+    started = time.time()
+    hook_input = read_hook_input(UPDATE_FIELDS)
+    record_payload("update", hook_input)
+    tool_name = hook_input.get("tool_name", "")
+    filename = extract_file_from_tool_input(hook_input)
+    config = compiled_config()
+    if config is not None:
+        set_log_level(config["log_level"])
+    hide_file = config is not None and not config["display"]["show_file"]
+
+    event = {"op": "update", "ts": int(time.time()), "tool": tool_name}
+    if hook_input.get("session_id"):
+        event["session_id"] = hook_input["session_id"]
+    if hook_input.get("tool_use_id"):
+        event["tool_use_id"] = hook_input["tool_use_id"]
+        event["t"] = round(started, 3)
+    if filename and not hide_file:
+        event["file"] = filename
+    elif hide_file or tool_name not in FILE_TOOLS:
+        event["file"] = ""
+
+    # Note: tokens are updated by statusline.py (no JSONL parsing needed)
+    if not submit_event(event, log):
+        log("Warning: Could not update session state")
+        return
+
+    log(f"Updated: {tool_name}" + (f" ({event['file']})" if event.get("file") else ""), DEBUG)
+
+
+def cmd_done():
+    """Handle 'done' command (PostToolUse) - report that a tool finished.
+
+    Only goes to a listening daemon: it pairs the event with the tool's
+    update event by tool_use_id to build per-tool latency histograms (see
+    toolstats). Without a daemon there is nothing to pair it with, so it
+    is not journaled.
+    """
+    finished = time.time()
+    hook_input = read_hook_input(DONE_FIELDS)
+    record_payload("done", hook_input)
+    if not hook_input.get("tool_use_id"):
+        return
+    event = {"op": "done", "ts": int(finished), "t": round(finished, 3),
+             "tool": hook_input.get("tool_name", ""), "tool_use_id": hook_input["tool_use_id"]}
+    if hook_input.get("session_id"):
+        event["session_id"] = hook_input["session_id"]
+    send_event(event)
+
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "update":
+        cmd_update()
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] == "done":
+        cmd_done()
+        return
+
+    # Everything else needs the full daemon module
+    import presence
+    presence.main()
+
+
+if __name__ == "__main__":
+    main()
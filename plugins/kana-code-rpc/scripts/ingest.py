@@ -0,0 +1,187 @@
+"""
+Daemon ingest socket for Discord Rich Presence.
+Lets hook commands hand state events to the running daemon as one local
+datagram, with the append-only state journal as the fallback when no daemon
+is listening.
+"""
+
+import json
+import os
+import select
+import socket
+import sys
+import time
+
+from state import DATA_DIR, JOURNAL_RECORD_MAX, append_event, apply_events_locked
+
+# ═══════════════════════════════════════════════════════════════
+# Socket Setup
+# ═══════════════════════════════════════════════════════════════
+
+INGEST_SOCKET = DATA_DIR / "daemon.sock"
+
+# Unix datagram sockets only (Windows AF_UNIX has no SOCK_DGRAM support)
+INGEST_AVAILABLE = sys.platform != "win32" and hasattr(socket, "AF_UNIX")
+
+# Events are a few hundred bytes; the daemon re-journals them, so the
+# datagram limit matches the journal record limit
+MAX_EVENT_SIZE = JOURNAL_RECORD_MAX
+
+# How long a hook waits for room in a full daemon queue before falling back
+SEND_TIMEOUT = 0.05
+
+
+# ═══════════════════════════════════════════════════════════════
+# Client (hook commands)
+# ═══════════════════════════════════════════════════════════════
+
+def send_event(event: dict) -> bool:
+    """Send one event datagram to the daemon's ingest socket.
+
+    Waits at most SEND_TIMEOUT for room in the daemon's queue. Returns False
+    when no daemon is listening, the queue stays full, or the event is too
+    large — callers then fall back to the journal (see submit_event).
+    """
+    if not INGEST_AVAILABLE:
+        return False
+    try:
+        payload = json.dumps(event, separators=(",", ":")).encode("utf-8")
+    except (TypeError, ValueError):
+        return False
+    if len(payload) > MAX_EVENT_SIZE:
+        return False
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            # Connected datagram sockets poll as unwritable while the daemon's
+            # queue is full (net.unix.max_dgram_qlen, often just 10), so a
+            # short timeout rides out bursts instead of falling back
+            sock.connect(str(INGEST_SOCKET))
+            sock.settimeout(SEND_TIMEOUT)
+            sock.send(payload)
+        return True
+    except OSError:
+        # FileNotFoundError / ConnectionRefusedError: no daemon listening
+        # TimeoutError: daemon backlog stayed full
+        return False
+
+
+def submit_event(event: dict, logger=None) -> bool:
+    """Deliver a state event by the cheapest path available.
+
+    1. Datagram to the daemon (no file I/O at all)
+    2. One O_APPEND record in the state journal (no lock)
+    3. Locked read-modify-write of state.json (Windows, oversized events)
+
+    Returns False only if all three failed.
+    """
+    if send_event(event):
+        return True
+    if append_event(event, logger):
+        return True
+    return apply_events_locked([event], logger) is not None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Server (daemon)
+# ═══════════════════════════════════════════════════════════════
+
+class IngestServer:
+    """
+    Daemon side of the ingest socket.
+
+    Usage:
+        server = IngestServer()
+        if server.open():
+            server.wait(1.0)          # block until an event arrives or timeout
+            events = server.drain()   # every queued event, oldest first
+        server.close()
+
+    When open() fails (Windows, path too long, permission error) the daemon
+    keeps working: wait() degrades to a plain sleep and drain() returns [].
+    """
+
+    def __init__(self, path=None):
+        self.path = path or INGEST_SOCKET
+        self._sock = None
+        self._inode = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._sock is not None
+
+    def open(self) -> bool:
+        """Bind the socket, replacing any stale socket file. Returns True on success."""
+        if not INGEST_AVAILABLE:
+            return False
+        try:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            try:
+                os.unlink(self.path)  # Stale socket from a crashed daemon
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                sock.bind(str(self.path))
+                os.chmod(self.path, 0o600)
+                sock.setblocking(False)
+                self._inode = os.stat(self.path).st_ino
+            except OSError:
+                sock.close()
+                raise
+        except OSError as e:
+            try:
+                print(f"[ingest] Warning: Could not open ingest socket {self.path}: {e}", file=sys.stderr)
+            except (ValueError, OSError, TypeError):
+                pass
+            return False
+        self._sock = sock
+        return True
+
+    def fileno(self) -> int:
+        return self._sock.fileno() if self._sock else -1
+
+    def wait(self, timeout: float) -> bool:
+        """Block until an event is readable or timeout elapses. Returns True if readable."""
+        if self._sock is None:
+            time.sleep(timeout)
+            return False
+        try:
+            readable, _, _ = select.select([self._sock], [], [], timeout)
+        except (OSError, ValueError):
+            return False
+        return bool(readable)
+
+    def drain(self, limit: int = 1024) -> list:
+        """Return all queued events (up to limit). Malformed datagrams are skipped."""
+        events = []
+        if self._sock is None:
+            return events
+        while len(events) < limit:
+            try:
+                data = self._sock.recv(MAX_EVENT_SIZE)
+            except OSError:
+                break  # BlockingIOError: queue is empty
+            try:
+                event = json.loads(data.decode("utf-8"))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if isinstance(event, dict):
+                events.append(event)
+        return events
+
+    def close(self):
+        """Close the socket and remove its file (only if it is still ours)."""
+        if self._sock is None:
+            return
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        try:
+            # A newer daemon may already have re-bound the path — leave its socket alone
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,223 @@
+"""
+Streaming field extraction for hook and statusline stdin payloads.
+Hook payloads for Write/Edit carry whole file contents in tool_input, but
+the hooks only need a few short fields. FieldScanner walks the JSON bytes
+chunk by chunk, skipping strings with bytes.find(), and keeps only the raw
+bytes of the requested fields - memory stays flat however large the
+payload is, and nothing else is ever decoded.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+READ_CHUNK = 65536
+
+# How long a reader waits for the rest of a payload (Unix only - Windows
+# pipes can't be polled, and the reader stops once the object is complete)
+READ_TIMEOUT = 2.0
+
+_SIGNIFICANT = re.compile(rb'[{}\[\]",:]')
+
+
+class FieldScanner:
+    """
+    Incremental JSON scanner that captures the values at a set of key paths.
+
+    Usage:
+        scanner = FieldScanner([("tool_name",), ("tool_input", "file_path")])
+        for chunk in chunks:
+            scanner.feed(chunk)
+            if scanner.done:
+                break
+        fields = scanner.result()   # {"tool_name": ..., "tool_input": {"file_path": ...}}
+
+    Paths only address object keys (values inside arrays are never
+    captured). The top-level value must be an object; anything else sets
+    error. done becomes True when the top-level object closes.
+    """
+
+    def __init__(self, paths):
+        self.paths = {tuple(path) for path in paths}
+        self.done = False
+        self.error = ""
+        self._raw = {}  # path -> captured value bytes
+        self._stack = []  # [is_object, key, expecting_key] per open container
+        self._in_string = False
+        self._string_is_key = False
+        self._key = bytearray()
+        self._escape = False  # Previous chunk ended inside a string escape
+        self._capture_path = None
+        self._capture_depth = 0
+        self._capture = bytearray()
+        self._started = False
+
+    def _close_capture(self, data: bytes, start: int, end: int):
+        self._capture += data[start:end]
+        self._raw[self._capture_path] = bytes(self._capture)
+        self._capture_path = None
+        self._capture = bytearray()
+
+    def _string_end(self, data: bytes, start: int) -> int:
+        """Index of the quote closing the current string, or -1 if it runs
+        past this chunk (an escape cut by the chunk boundary is carried)."""
+        if self._escape:
+            self._escape = False
+            start += 1
+        j = data.find(b'"', start)
+        if j >= 0 and (j == start or data[j - 1] != 0x5C):
+            return j  # Common case: no backslash before the quote
+        # Blank out escaped backslashes, then escaped quotes - the first quote
+        # left closes the string. Windows grow so short strings stay cheap.
+        size = j - start + 1 if j >= 0 else len(data) - start
+        while start < len(data):
+            stop = min(len(data), start + size)
+            window = data[start:stop]
+            if b"\\" in window:
+                window = window.replace(b"\\\\", b"__").replace(b'\\"', b"__")
+            end = window.find(b'"')
+            if end >= 0:
+                return start + end
+            escape = window.endswith(b"\\")  # Escapes the byte after the window
+            if stop == len(data):
+                self._escape = escape
+                break
+            start = stop + escape
+            size *= 2
+        return -1
+
+    def feed(self, data: bytes):
+        """Scan the next chunk of the payload."""
+        if self.done or self.error:
+            return
+        i = 0
+        n = len(data)
+        capture_from = 0  # Start of this chunk's part of the captured value
+        while i < n:
+            if self._in_string:
+                j = self._string_end(data, i)
+                if j < 0:
+                    if self._string_is_key:
+                        self._key += data[i:]
+                    break
+                self._in_string = False
+                if self._string_is_key:
+                    self._key += data[i:j]
+                    try:
+                        key = json.loads(b'"' + bytes(self._key) + b'"')
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        key = None
+                    self._stack[-1][1] = key
+                    self._stack[-1][2] = False
+                i = j + 1
+                continue
+
+            match = _SIGNIFICANT.search(data, i)
+            if match is None:
+                break
+            pos = match.start()
+            char = data[pos]
+            i = pos + 1
+            if not self._started:
+                self._started = True
+                if char != 0x7B or data[:pos].strip():  # "{"
+                    self.error = "payload is not a JSON object"
+                    return
+
+            if char == 0x22:  # '"'
+                self._in_string = True
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = bool(top and top[0] and top[2])
+                self._key = bytearray()
+            elif char == 0x7B or char == 0x5B:  # { [
+                self._stack.append([char == 0x7B, None, char == 0x7B])
+            elif char == 0x7D or char == 0x5D:  # } ]
+                if self._capture_path is not None and len(self._stack) == self._capture_depth:
+                    self._close_capture(data, capture_from, pos)
+                if not self._stack:
+                    self.error = "unbalanced JSON payload"
+                    return
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                    return
+            elif char == 0x2C:  # ,
+                if self._capture_path is not None and len(self._stack) == self._capture_depth:
+                    self._close_capture(data, capture_from, pos)
+                if self._stack and self._stack[-1][0]:
+                    self._stack[-1][1] = None
+                    self._stack[-1][2] = True
+            elif char == 0x3A:  # :
+                if self._capture_path is None and self._stack and self._stack[-1][0]:
+                    path = tuple(entry[1] for entry in self._stack)
+                    if all(entry[0] for entry in self._stack) and path in self.paths:
+                        self._capture_path = path
+                        self._capture_depth = len(self._stack)
+                        self._capture = bytearray()
+                        capture_from = i
+
+        if self._capture_path is not None:
+            self._capture += data[capture_from:]
+
+    def result(self) -> dict:
+        """Captured fields as nested dicts (undecodable values are left out)."""
+        fields = {}
+        for path, raw in self._raw.items():
+            try:
+                value = json.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            target = fields
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+                if not isinstance(target, dict):
+                    break
+            else:
+                target[path[-1]] = value
+        return fields
+
+
+def read_json_fields(paths=None, fd: int | None = None, timeout: float = READ_TIMEOUT) -> dict:
+    """
+    Read a JSON object from fd (default: stdin) and return only paths.
+
+    Reads until the object is complete, EOF, or timeout seconds pass without
+    it completing - so a payload larger than a pipe buffer is never cut
+    short, and a writer that keeps the pipe open does not hang the reader.
+    paths=None returns the whole object; paths=() just consumes it.
+    Returns {} for empty input; raises ValueError for a malformed or
+    incomplete payload.
+    """
+    if fd is None:
+        fd = sys.stdin.fileno()
+    scanner = FieldScanner(paths or ())
+    chunks = [] if paths is None else None
+    deadline = time.monotonic() + timeout
+    poll = sys.platform != "win32"
+    if poll:
+        import select
+    received = False
+    while not scanner.done:
+        if poll:
+            remaining = deadline - time.monotonic()
+            ready = select.select([fd], [], [], max(0.0, remaining))[0] if remaining > 0 else []
+            if not ready:
+                raise ValueError(f"payload incomplete after {timeout:g}s")
+        chunk = os.read(fd, READ_CHUNK)
+        if not chunk:
+            break  # EOF
+        received = received or bool(chunk.strip())
+        scanner.feed(chunk)
+        if chunks is not None:
+            chunks.append(chunk)
+        if scanner.error:
+            raise ValueError(scanner.error)
+    if not scanner.done:
+        if not received:
+            return {}
+        raise ValueError("payload ended before the JSON object was complete")
+    if chunks is not None:
+        return json.loads(b"".join(chunks).decode("utf-8", errors="replace"))
+    return scanner.result()
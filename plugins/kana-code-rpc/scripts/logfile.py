@@ -0,0 +1,221 @@
+"""
+Leveled logging to daemon.log for Discord Rich Presence.
+Short-lived commands (hooks, start/stop) append each line with one write()
+on a descriptor opened once per process. The daemon instead queues lines
+in memory and a background thread writes them in batches, so Discord and
+state handling never wait on the log file. Rotation renames daemon.log to
+daemon.log.1 (shifting older backups up) and never reads old content back.
+"""
+
+import os
+import sys
+import time
+
+from state import OUTPUT_DIR
+
+LOG_FILE = OUTPUT_DIR / "daemon.log"
+LOG_MAX_SIZE = 1_048_576  # Rotate when daemon.log passes 1 MB
+LOG_BACKUPS = 3  # daemon.log.1 (newest) ... daemon.log.3
+LOG_QUEUE_SIZE = 1024  # Lines buffered before the daemon starts dropping them
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+
+_level = INFO
+_fd = -1
+_log_to_file_failed = False
+_writer = None  # LogWriter while the daemon's background writer runs
+
+
+def set_log_level(level):
+    """Set the minimum level written - a LOG_LEVELS name or number."""
+    global _level
+    _level = LOG_LEVELS.get(level, INFO) if isinstance(level, str) else int(level)
+
+
+def message_level(message: str) -> int:
+    """Level of a message without an explicit one, from its prefix."""
+    if message.startswith(("ERROR", "FATAL", "Daemon error")):
+        return ERROR
+    if message.startswith(("Warning", "WARNING")):
+        return WARNING
+    return INFO
+
+
+def log(message: str, level: int | None = None):
+    """Append message to the log file, with stderr fallback on failure.
+
+    level defaults to the one implied by the message's "Warning:" /
+    "ERROR:" prefix, else INFO. Messages below the configured level cost
+    only the comparison.
+    """
+    if (message_level(message) if level is None else level) < _level:
+        return
+    # time.strftime avoids importing datetime on the hook path
+    line = f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}\n"
+    if _writer is not None:
+        _writer.put(line)
+    else:
+        _write(line.encode("utf-8", errors="replace"))
+
+
+# ═══════════════════════════════════════════════════════════════
+# File Output
+# ═══════════════════════════════════════════════════════════════
+
+def _open_log() -> int:
+    global _fd
+    if _fd < 0:
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        _fd = os.open(LOG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    return _fd
+
+
+def _close_log():
+    global _fd
+    if _fd >= 0:
+        try:
+            os.close(_fd)
+        except OSError:
+            pass
+        _fd = -1
+
+
+def _write(data: bytes):
+    """Append data with a single O_APPEND write (whole lines never interleave)."""
+    global _log_to_file_failed
+    try:
+        os.write(_open_log(), data)
+        return  # Success
+    except OSError as e:
+        _close_log()
+        # File logging failed - fall back to stderr
+        if not _log_to_file_failed:
+            _log_to_file_failed = True
+            print(f"[presence] Warning: Log file unavailable ({e}), falling back to stderr", file=sys.stderr)
+
+    # Fallback: write to stderr so diagnostics aren't completely lost
+    try:
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            print(f"[presence] {line}", file=sys.stderr)
+    except (OSError, ValueError, TypeError):
+        pass  # Last resort - don't crash if stderr is closed or invalid
+
+
+def rotate_log(max_size: int = LOG_MAX_SIZE, backups: int = LOG_BACKUPS) -> bool:
+    """Rename daemon.log to daemon.log.1 (older backups move up one, the
+    oldest is dropped) once it is larger than max_size. Returns True if it
+    rotated. Only the daemon rotates, so renames never race each other."""
+    try:
+        if os.stat(LOG_FILE).st_size <= max_size:
+            return False
+        _close_log()  # Windows cannot rename a file this process holds open; next write reopens
+        for index in range(backups - 1, 0, -1):
+            older = f"{LOG_FILE}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{LOG_FILE}.{index + 1}")
+        if backups > 0:
+            os.replace(LOG_FILE, f"{LOG_FILE}.1")
+        else:
+            os.unlink(LOG_FILE)
+    except OSError:
+        return False  # Missing file, or held open by a hook on Windows - try again later
+    return True
+
+
+# ═══════════════════════════════════════════════════════════════
+# Background Writer (daemon)
+# ═══════════════════════════════════════════════════════════════
+
+class LogWriter:
+    """
+    Bounded queue of log lines drained by a background thread.
+
+    Usage:
+        start_log_writer()   # In the daemon process only
+        log("...")           # Now just enqueues
+        stop_log_writer()    # Flushes what is queued (also registered atexit)
+
+    When the queue is full new lines are dropped and counted; the count is
+    written with the next batch. Each batch is one write(), followed by a
+    size check that rotates the file by rename.
+    """
+
+    def __init__(self, max_lines: int = LOG_QUEUE_SIZE):
+        import queue
+        import threading
+        self._queue = queue.Queue(max_lines)
+        self._full = queue.Full
+        self._empty = queue.Empty
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._stopping = False
+        self.dropped = 0
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, line: str):
+        try:
+            self._queue.put_nowait(line)
+        except self._full:
+            self.dropped += 1
+
+    def _drain(self, first) -> tuple[list, bool]:
+        lines = [] if first is None else [first]
+        stop = first is None
+        while True:
+            try:
+                line = self._queue.get_nowait()
+            except self._empty:
+                return lines, stop
+            if line is None:
+                stop = True
+            else:
+                lines.append(line)
+
+    def _run(self):
+        while True:
+            lines, stop = self._drain(self._queue.get())  # Whatever queued up meanwhile
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
+                             f"Warning: {dropped} log messages dropped (log queue full)\n")
+            if lines:
+                _write("".join(lines).encode("utf-8", errors="replace"))
+                rotate_log()
+            if stop:
+                return
+
+    def stop(self, timeout: float = 2.0):
+        if self._stopping:
+            return
+        self._stopping = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except self._full:
+            return  # Writer thread is stuck - don't hang the exit on it
+        self._thread.join(timeout)
+
+
+def start_log_writer():
+    """Route log() through a background writer for the rest of this process."""
+    global _writer
+    if _writer is not None:
+        return
+    import atexit
+    rotate_log()
+    writer = LogWriter()
+    writer.start()
+    _writer = writer
+    atexit.register(stop_log_writer)
+
+
+def stop_log_writer():
+    """Flush queued lines and return to writing them directly."""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
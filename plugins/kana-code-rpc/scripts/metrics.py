@@ -0,0 +1,197 @@
+"""
+Daemon metrics for Discord Rich Presence.
+Counters and latency histograms live in plain dicts and lists, so recording
+one costs a dict lookup and an add (well under a microsecond). The daemon
+publishes them with its other counters in daemon_stats.json; this module
+turns that file into the `presence.py metrics` report and into Prometheus
+text format for node-exporter's textfile collector.
+
+Names may carry Prometheus labels, e.g. 'loop_iterations_total{loop="ingest"}'.
+"""
+
+import bisect
+
+# Upper bounds (seconds) of the latency histogram buckets; one more bucket
+# above the last catches everything slower (+Inf)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRIC_PREFIX = "kana_rpc_"
+
+# Help text per metric family, in report order
+METRIC_HELP = {
+    "loop_iterations_total": ("counter", "Daemon loop wakeups"),
+    "hook_events_total": ("counter", "Hook events received on the ingest socket"),
+    "state_reads_total": ("counter", "State refreshes, by whether the files had changed"),
+    "lock_acquisitions_total": ("counter", "StateLock acquisitions by the daemon, by caller and result"),
+    "lock_wait_seconds": ("histogram", "Time the daemon waited to acquire a StateLock"),
+    "discord_updates_total": ("counter", "Presence payloads by outcome in the update scheduler"),
+    "rpc_update_seconds": ("histogram", "Latency of rpc.update calls to Discord"),
+    "rpc_update_failures_total": ("counter", "rpc.update calls that failed"),
+    "discord_reconnects_total": ("counter", "Discord connections torn down and rebuilt"),
+    "orphan_sweeps_total": ("counter", "Dead-session sweeps over sessions.json"),
+    "config_checks_total": ("counter", "config.yaml change checks"),
+    "config_reloads_total": ("counter", "config.yaml parses after a change"),
+    "trace_records_dropped_total": ("counter", "Session trace records lost to a full trace ring"),
+}
+
+_counters = {}
+_histograms = {}  # name -> [bucket counts (len(LATENCY_BUCKETS) + 1), sum of values]
+
+
+# ═══════════════════════════════════════════════════════════════
+# Recording
+# ═══════════════════════════════════════════════════════════════
+
+def count(name: str, amount: int = 1):
+    """Add amount to counter name."""
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name: str, seconds: float):
+    """Record one latency sample in histogram name."""
+    hist = _histograms.get(name)
+    if hist is None:
+        hist = _histograms[name] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+    hist[0][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    hist[1] += seconds
+
+
+def metrics_snapshot() -> dict:
+    """Counters and histograms recorded in this process (JSON-serializable)."""
+    return {
+        "counters": dict(_counters),
+        "histograms": {name: {"counts": list(counts), "sum": total}
+                       for name, (counts, total) in _histograms.items()},
+        "buckets": list(LATENCY_BUCKETS),
+    }
+
+
+def reset_metrics():
+    _counters.clear()
+    _histograms.clear()
+
+
+# ═══════════════════════════════════════════════════════════════
+# Export
+# ═══════════════════════════════════════════════════════════════
+
+def _family(name: str) -> str:
+    return name.split("{", 1)[0]
+
+
+def _with_label(name: str, label: str) -> str:
+    if "{" in name:
+        return name[:-1] + "," + label + "}"
+    return name + "{" + label + "}"
+
+
+def collect(stats: dict) -> dict:
+    """
+    Metric families from a daemon_stats.json dict.
+
+    Returns {family: {"type", "help", "counters": {name: value},
+    "histograms": {name: {"counts", "sum"}}, "buckets"}}, folding in the
+    scheduler, state-read and lock counters the daemon already keeps.
+    """
+    metrics = stats.get("metrics") if isinstance(stats.get("metrics"), dict) else {}
+    counters = dict(metrics.get("counters") or {})
+    histograms = dict(metrics.get("histograms") or {})
+    buckets = metrics.get("buckets") or list(LATENCY_BUCKETS)
+
+    updates = stats.get("discord_updates")
+    if isinstance(updates, dict):
+        for result in ("sent", "failed", "coalesced", "dropped"):
+            counters[f'discord_updates_total{{result="{result}"}}'] = updates.get(result, 0)
+    reads = stats.get("state_reads")
+    if isinstance(reads, dict) and reads:
+        counters['state_reads_total{result="read"}'] = reads.get("reads", 0)
+        counters['state_reads_total{result="unchanged"}'] = reads.get("skipped", 0)
+    locks = stats.get("locks")
+    if isinstance(locks, dict):
+        for caller, lock in sorted(locks.items()):
+            if isinstance(lock, dict):
+                for result in ("acquired", "contended", "timeouts"):
+                    counters[f'lock_acquisitions_total{{caller="{caller}",result="{result}"}}'] = lock.get(result, 0)
+
+    families = {}
+    for family, (kind, text) in METRIC_HELP.items():
+        families[family] = {"type": kind, "help": text, "counters": {}, "histograms": {}, "buckets": buckets}
+    for name, value in counters.items():
+        family = families.setdefault(_family(name), {"type": "counter", "help": "", "counters": {},
+                                                     "histograms": {}, "buckets": buckets})
+        family["counters"][name] = value
+    for name, hist in histograms.items():
+        if isinstance(hist, dict) and len(hist.get("counts") or ()) == len(buckets) + 1:
+            family = families.setdefault(_family(name), {"type": "histogram", "help": "", "counters": {},
+                                                         "histograms": {}, "buckets": buckets})
+            family["histograms"][name] = hist
+    return families
+
+
+def histogram_quantile(counts: list, buckets: list, q: float) -> float | None:
+    """Upper bound of the bucket holding quantile q (None without samples,
+    inf when it falls in the +Inf bucket)."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, n in zip(list(buckets) + [float("inf")], counts):
+        seen += n
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def render_prometheus(stats: dict) -> str:
+    """daemon_stats.json as Prometheus text exposition format."""
+    lines = []
+    if isinstance(stats.get("updated"), (int, float)):
+        # Lets alerts tell a stale file (daemon gone) from a quiet daemon
+        full = METRIC_PREFIX + "stats_updated_timestamp_seconds"
+        lines += [f"# HELP {full} When the daemon last published these metrics",
+                  f"# TYPE {full} gauge", f"{full} {stats['updated']}"]
+    for family, data in collect(stats).items():
+        if not data["counters"] and not data["histograms"]:
+            continue
+        full = METRIC_PREFIX + family
+        if data["help"]:
+            lines.append(f"# HELP {full} {data['help']}")
+        lines.append(f"# TYPE {full} {data['type']}")
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"{METRIC_PREFIX}{name} {value}")
+        for name, hist in sorted(data["histograms"].items()):
+            cumulative = 0
+            bounds = [format(b, "g") for b in data["buckets"]] + ["+Inf"]
+            for bound, n in zip(bounds, hist["counts"]):
+                cumulative += n
+                bucket = _with_label(name.replace(family, family + "_bucket", 1), f'le="{bound}"')
+                lines.append(f"{METRIC_PREFIX}{bucket} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name.replace(family, family + '_sum', 1)} {hist['sum']:.9g}")
+            lines.append(f"{METRIC_PREFIX}{name.replace(family, family + '_count', 1)} {cumulative}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def format_report(stats: dict) -> list[str]:
+    """Human-readable lines for `presence.py metrics`."""
+    families = collect(stats).values()
+    width = max((len(name) for data in families for name in (*data["counters"], *data["histograms"])), default=0)
+    lines = []
+    for data in families:
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"{name:<{width}} {value:>10}")
+        for name, hist in sorted(data["histograms"].items()):
+            counts = hist["counts"]
+            samples = sum(counts)
+            if not samples:
+                continue
+            p50 = histogram_quantile(counts, data["buckets"], 0.5)
+            p99 = histogram_quantile(counts, data["buckets"], 0.99)
+            lines.append(f"{name:<{width}} {samples:>10}  mean {hist['sum'] / samples * 1000:.2f}ms  "
+                         f"p50 <={_ms(p50)}  p99 <={_ms(p99)}")
+    return lines
+
+
+def _ms(seconds: float) -> str:
+    return "inf" if seconds == float("inf") else f"{seconds * 1000:g}ms"
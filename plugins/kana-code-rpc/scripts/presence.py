@@ -4,54 +4,77 @@ Discord Rich Presence for Claude Code
 Manages Discord RPC connection and updates presence based on Claude Code activity.
 """
 
-import copy
 import sys
 import os
 import json
-import re
 import subprocess
 import time
 import atexit
 import signal
+from collections.abc import Mapping
 from pathlib import Path
-from datetime import datetime
 
 # Shared state management (provides process-safe file locking and utilities)
 from state import (
     DATA_DIR,
+    OUTPUT_DIR,
+    STATE_FILE,
+    JOURNAL_FILE,
     StateLock,
+    StateFollower,
     read_state,
     clear_state,
-    read_state_unlocked,
-    write_state_unlocked,
+    forget_statusline_digest,
+    statusline_heartbeat,
     atomic_write_json,
+    append_events,
+    apply_events_locked,
+    compact_journal,
     format_tokens,
+    lock_stats,
+    reset_lock_stats,
+)
+from ingest import IngestServer, send_event, submit_event
+from eventloop import DirWatcher, PidWatcher, Timers, Waiter
+from scheduler import UpdateScheduler
+from segment import SegmentWriter, read_segment
+from gitinfo import get_project_info, get_git_branch as resolve_git_branch
+from config import (
+    CONFIG_RELOAD_INTERVAL,
+    yaml_available,
+    get_config as _get_config,
+    load_config as _load_config,
 )
 
-# Optional YAML support for config file
-try:
-    import yaml
-    YAML_AVAILABLE = True
-except ImportError:
-    YAML_AVAILABLE = False
-
-# Track if YAML warning has been logged (always defined at module level)
-_yaml_warning_logged = False
+# Hook-path helpers live in hook.py so PreToolUse never imports this module
+from hook import FILE_TOOLS, read_hook_input, cmd_update, cmd_done
+from logfile import DEBUG, LOG_FILE, log, set_log_level, start_log_writer
+from toolstats import ToolLatency, latency_table, write_tool_hints
+from history import HISTORY_INTERVAL, SessionHistory, read_report, report_lines
+from timeline import TRACE_FLUSH_INTERVAL, TraceRecorder, export_trace, find_trace, list_traces
+from recording import RECORDING_FILE, record_payload, recording_active, start_recording, stop_recording
+from metrics import count, observe, metrics_snapshot, reset_metrics, render_prometheus, format_report
 
 # Discord Application ID
 DISCORD_APP_ID = "1330919293709324449"
 
+# PyYAML is optional - without it config.yaml is ignored
+YAML_AVAILABLE = yaml_available()
+
 # Data files (DATA_DIR imported from state module)
 PID_FILE = DATA_DIR / "daemon.pid"
-LOG_FILE = DATA_DIR / "daemon.log"
 SESSIONS_FILE = DATA_DIR / "sessions.json"
 SESSIONS_LOCK_FILE = DATA_DIR / "sessions.lock"
+STATS_FILE = OUTPUT_DIR / "daemon_stats.json"
+METRICS_TEXTFILE = OUTPUT_DIR / "metrics.prom"  # Prometheus text format, when metrics_textfile is on
 
 # Orphan check interval (seconds) - how often daemon checks for stale sessions
 ORPHAN_CHECK_INTERVAL = 30
+# Same check when pidfd already reports every session exit (Linux 5.3+)
+ORPHAN_SAFETY_INTERVAL = 300
 
 # Tool to display name mapping (keep short for Discord limit)
-## Keep in sync with PreToolUse matcher in hooks/hooks.json
+## Keep in sync with the PreToolUse/PostToolUse matchers in hooks/hooks.json
 TOOL_DISPLAY = {
     # File operations
     "Edit": "Editing",
@@ -89,208 +112,33 @@ TOOL_DISPLAY = {
 # Default idle timeout - used as fallback when config cannot be loaded
 IDLE_TIMEOUT = 5 * 60  # 5 minutes
 
-# Configuration
-CONFIG_FILE_NAME = "config.yaml"
-DEFAULT_CONFIG = {
-    "discord_app_id": None,  # Uses DISCORD_APP_ID constant if None
-    "display": {
-        "show_tokens": True,
-        "show_cost": True,
-        "show_model": True,
-        "show_branch": True,
-        "show_file": True,
-        "show_lines": True,  # Show lines added/removed on Discord
-        "show_context_warning": True,  # Show context % warning at >80%
-    },
-    "idle_timeout": 300,  # 5 minutes in seconds
-}
-CONFIG_RELOAD_INTERVAL = 30  # Reload config every 30 seconds
-
 # Discord connection retry limit (12 retries * 5 seconds = 1 minute before giving up)
 DISCORD_CONNECT_MAX_RETRIES = 12
+DISCORD_RETRY_DELAY = 5  # Seconds between connection attempts
 
-# Log rotation threshold
-LOG_MAX_SIZE = 1_048_576  # 1 MB
-
-# Tools that operate on files (for filename display)
-FILE_TOOLS = {"Edit", "Write", "Read", "NotebookEdit", "NotebookRead"}
-
-
-_log_to_file_failed = False
-
-
-def log(message: str):
-    """Append message to log file, with stderr fallback on failure."""
-    global _log_to_file_failed
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    formatted = f"[{timestamp}] {message}"
-
-    try:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(formatted + "\n")
-        return  # Success
-    except OSError as e:
-        # File logging failed - fall back to stderr
-        if not _log_to_file_failed:
-            _log_to_file_failed = True
-            print(f"[presence] Warning: Log file unavailable ({e}), falling back to stderr", file=sys.stderr)
-
-    # Fallback: write to stderr so diagnostics aren't completely lost
-    try:
-        print(f"[presence] {formatted}", file=sys.stderr)
-    except (OSError, ValueError, TypeError):
-        pass  # Last resort - don't crash if stderr is closed or invalid
+# Longest daemon sleep when state files cannot be watched (no inotify)
+DAEMON_POLL_INTERVAL = 1
 
+# Journal size at which the daemon folds it back into state.json
+DAEMON_COMPACT_SIZE = 64 * 1024
 
-def _rotate_log():
-    """Rotate log file if it exceeds LOG_MAX_SIZE. Keeps the last half."""
-    try:
-        if LOG_FILE.exists() and LOG_FILE.stat().st_size > LOG_MAX_SIZE:
-            content = LOG_FILE.read_bytes()
-            # Find a newline boundary near the midpoint to avoid splitting a line
-            midpoint = len(content) - LOG_MAX_SIZE // 2
-            newline_pos = content.find(b"\n", midpoint)
-            if newline_pos != -1:
-                midpoint = newline_pos + 1
-            LOG_FILE.write_bytes(content[midpoint:])
-            log("Log file rotated (exceeded 1MB)")
-    except OSError:
-        pass  # Non-critical — log will just keep growing
-
-
-def get_plugin_root() -> Path | None:
-    """Get plugin root directory from CLAUDE_PLUGIN_ROOT environment variable."""
-    plugin_root = os.environ.get("CLAUDE_PLUGIN_ROOT")
-    if plugin_root:
-        path = Path(plugin_root)
-        if path.exists():
-            return path
-        log(f"Warning: CLAUDE_PLUGIN_ROOT '{plugin_root}' does not exist, config.yaml will not be loaded")
-    return None
+# How often the daemon rewrites metrics.prom (only with metrics_textfile on)
+METRICS_INTERVAL = 15
 
 
 def load_config() -> dict:
-    """Load configuration from YAML file, falling back to defaults.
-
-    Config location: {CLAUDE_PLUGIN_ROOT}/.claude-plugin/config.yaml
-
-    Returns merged config with defaults for any missing keys.
-    """
-    global _yaml_warning_logged
-
-    config = copy.deepcopy(DEFAULT_CONFIG)
-
-    plugin_root = get_plugin_root()
-
-    # Warn if config.yaml exists but PyYAML is not installed
-    if not YAML_AVAILABLE:
-        if plugin_root:
-            config_path = plugin_root / ".claude-plugin" / CONFIG_FILE_NAME
-            if config_path.exists() and not _yaml_warning_logged:
-                log(f"Warning: PyYAML not installed - config.yaml is being IGNORED. Install with: pip install pyyaml")
-                _yaml_warning_logged = True
-        return config
-
-    if not plugin_root:
-        return config
-
-    config_path = plugin_root / ".claude-plugin" / CONFIG_FILE_NAME
-    if not config_path.exists():
-        return config
-
-    try:
-        with open(config_path, "r", encoding="utf-8") as f:
-            user_config = yaml.safe_load(f) or {}
-
-        # Merge discord_app_id (validate 17-19 digit numeric string)
-        if "discord_app_id" in user_config and user_config["discord_app_id"]:
-            app_id = str(user_config["discord_app_id"])
-            if app_id.isdigit() and 17 <= len(app_id) <= 19:
-                config["discord_app_id"] = app_id
-            else:
-                log(f"Warning: Invalid discord_app_id format '{app_id}', using default")
-
-        # Merge display toggles
-        if "display" in user_config and isinstance(user_config["display"], dict):
-            for key in config["display"]:
-                if key in user_config["display"]:
-                    config["display"][key] = bool(user_config["display"][key])
-
-        # Merge idle_timeout (1 second to 24 hours)
-        if "idle_timeout" in user_config:
-            timeout = user_config["idle_timeout"]
-            if isinstance(timeout, (int, float)) and timeout >= 1 and timeout <= 86400:
-                config["idle_timeout"] = int(timeout)
-            else:
-                log(f"Warning: idle_timeout must be 1-86400 seconds, got '{timeout}', using default")
-
-        log(f"Loaded config from {config_path}")
-
-    except yaml.YAMLError as e:
-        log(f"ERROR: Config file {config_path} has invalid YAML syntax: {e}")
-        log(f"ERROR: Using ALL default settings until config is fixed")
-    except OSError as e:
-        log(f"ERROR: Could not read config file {config_path}: {e}")
-
-    return config
-
-
-# Global config cache for daemon
-_config_cache = None
-_config_last_load = 0
-
-
-def get_config(force_reload: bool = False) -> dict:
-    """Get cached config, reloading periodically for hot-reload support.
-
-    Returns a deep copy of the cached config to prevent accidental mutation.
-    """
-    global _config_cache, _config_last_load
-
-    now = time.time()
-    if force_reload or _config_cache is None or (now - _config_last_load > CONFIG_RELOAD_INTERVAL):
-        _config_cache = load_config()
-        _config_last_load = now
-
-    return copy.deepcopy(_config_cache)
+    """Parse config.yaml into a new dict (see config.load_config), logging to daemon.log."""
+    return _load_config(logger=log)
 
 
-def extract_file_from_tool_input(hook_input: dict) -> str:
-    """Extract filename from hook input's tool_input field.
-
-    For Edit/Write/Read tools, tool_input contains:
-    {
-        "file_path": "/path/to/file.py",
-        ...
-    }
+def get_config(force_reload: bool = False):
+    """Frozen config snapshot, re-parsed only when config.yaml changes (see config.get_config).
 
-    For NotebookEdit/NotebookRead tools, tool_input contains:
-    {
-        "notebook_path": "/path/to/notebook.ipynb",
-        ...
-    }
-
-    Returns just the filename (not full path), or empty string if not available.
+    Also applies its log_level, so a reload takes effect without a restart.
     """
-    tool_name = hook_input.get("tool_name", "")
-    if tool_name not in FILE_TOOLS:
-        return ""
-
-    tool_input = hook_input.get("tool_input")
-    if not isinstance(tool_input, dict):
-        return ""
-
-    # Check file_path (Edit/Write/Read) or notebook_path (NotebookEdit/NotebookRead)
-    file_path = tool_input.get("file_path", "") or tool_input.get("notebook_path", "")
-    if not file_path:
-        return ""
-
-    try:
-        return Path(file_path).name
-    except (ValueError, OSError, TypeError) as e:
-        log(f"Warning: Could not extract filename from '{file_path}': {e}")
-        return ""
+    config = _get_config(force_reload, logger=log)
+    set_log_level(config["log_level"])
+    return config
 
 
 def truncate_filename(filename: str, max_length: int = 25) -> str:
@@ -377,49 +225,13 @@ def get_project_name(project_path: str = "") -> str:
     if not project_path:
         project_path = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
 
-    folder_name = Path(project_path).name
-
-    # Try to get git remote origin URL
-    try:
-        result = subprocess.run(
-            ["git", "-C", project_path, "remote", "get-url", "origin"],
-            capture_output=True, text=True, timeout=5
-        )
-        if result.returncode == 0:
-            remote_url = result.stdout.strip()
-            # Parse repo name from URL
-            # Handles: https://github.com/user/repo.git, git@github.com:user/repo.git
-            match = re.search(r'[/:]([^/:]+?)(?:\.git)?$', remote_url)
-            if match:
-                return match.group(1)
-    except subprocess.TimeoutExpired:
-        log(f"Git command timed out for {project_path}")
-    except FileNotFoundError:
-        pass  # git not installed
-    except OSError as e:
-        log(f"Error running git: {e}")
-
-    return folder_name
+    # Cached in DATA_DIR/projects.json until .git/config changes
+    return get_project_info(project_path, timeout=5, logger=log)["name"]
 
 
 def get_git_branch(project_path: str) -> str:
-    """Get current git branch name."""
-    if not project_path:
-        return ""
-    try:
-        result = subprocess.run(
-            ["git", "-C", project_path, "rev-parse", "--abbrev-ref", "HEAD"],
-            capture_output=True, text=True, timeout=5
-        )
-        if result.returncode == 0:
-            return result.stdout.strip()
-    except subprocess.TimeoutExpired:
-        log(f"Git branch command timed out for {project_path}")
-    except FileNotFoundError:
-        pass  # git not installed
-    except OSError as e:
-        log(f"Error getting git branch: {e}")
-    return ""
+    """Get current git branch name ("HEAD" when detached)."""
+    return resolve_git_branch(project_path, timeout=5, logger=log)
 
 
 _kernel32_cache = None
@@ -636,8 +448,13 @@ def remove_session(pid: int):
         return -1
 
 
-def cleanup_dead_sessions() -> int:
-    """Remove sessions whose parent PIDs are no longer alive. Returns remaining count."""
+def cleanup_dead_sessions(exited=()) -> int:
+    """Remove sessions whose parent PIDs are no longer alive. Returns remaining count.
+
+    exited: PIDs already known to have exited (pidfd). They are removed even
+    if is_process_alive() still sees them as unreaped zombies.
+    """
+    count("orphan_sweeps_total")
     try:
         with StateLock(lock_file=SESSIONS_LOCK_FILE):
             sessions = _read_sessions_unlocked()
@@ -651,42 +468,278 @@ def cleanup_dead_sessions() -> int:
                 except ValueError:
                     log(f"Invalid PID in sessions file: {pid_str}, removing")
                     continue
-                if is_process_alive(pid):
+                if pid not in exited and is_process_alive(pid):
                     alive_sessions[pid_str] = timestamp
                 else:
                     log(f"Session PID {pid} is dead, removing")
 
             if len(alive_sessions) != len(sessions):
                 _write_sessions_unlocked(alive_sessions)
-
-            return len(alive_sessions)
     except (OSError, TimeoutError) as e:
         log(f"Warning: Could not cleanup sessions: {e}")
         return -1
 
+    # Drop the state records of sessions that died without a SessionEnd hook
+    if alive_sessions:
+        for pid_str in sessions.keys() - alive_sessions.keys():
+            if pid_str.isdigit() and not submit_event({"op": "end", "pid": int(pid_str)}, log):
+                log(f"Warning: Could not remove state of session PID {pid_str}")
+    return len(alive_sessions)
+
+
+def session_pids() -> set:
+    """PIDs of all registered sessions (for the daemon's pidfd watcher)."""
+    pids = set()
+    for pid_str in read_sessions():
+        try:
+            pids.add(int(pid_str))
+        except ValueError:
+            continue  # cleanup_dead_sessions removes it
+    return pids
+
+
+def session_check_interval(pid_watcher, file_watcher, unwatched: set) -> int:
+    """Seconds until the next session liveness poll.
+
+    With every session PID held as a pidfd and sessions.json watched for new
+    sessions, exits are seen immediately and the poll is only a safety net.
+    """
+    if pid_watcher.is_open and file_watcher.is_open and not unwatched:
+        return ORPHAN_SAFETY_INTERVAL
+    return ORPHAN_CHECK_INTERVAL
+
+
+# Token view cycle: simple (input + output) for 5s, then cached totals for 3s
+TOKEN_CYCLE_PERIOD = 8
+TOKEN_CYCLE_SIMPLE = 5
+
+
+def build_presence(state: dict, config: Mapping, session_start: int, now: float) -> tuple[dict, float | None]:
+    """Build the Discord presence for a state snapshot.
+
+    Returns (presence, next_change) where presence holds details, state_line,
+    start and the token view, and next_change is the earliest time the same
+    state would render differently (idle timeout, token view flip), or None.
+    """
+    # Get display settings from config
+    display_cfg = config.get("display", {})
+    show_tokens = display_cfg.get("show_tokens", True)
+    show_cost = display_cfg.get("show_cost", True)
+    show_model = display_cfg.get("show_model", True)
+    show_branch = display_cfg.get("show_branch", True)
+    show_file = display_cfg.get("show_file", True)
+    show_lines = display_cfg.get("show_lines", True)
+    show_context_warning = display_cfg.get("show_context_warning", True)
+    show_session_totals = display_cfg.get("show_session_totals", False)
+
+    # Check for idle timeout - show "Idling" instead of clearing
+    last_update = state.get("last_update", 0)
+    idle_timeout = config.get("idle_timeout", IDLE_TIMEOUT)
+    is_idle = now - last_update > idle_timeout
+    next_change = None if is_idle else last_update + idle_timeout + 0.01
+
+    # Get state values
+    tool = state.get("tool", "")
+    project = state.get("project", "Claude Code")
+    git_branch = state.get("git_branch", "") if show_branch else ""
+    model = state.get("model", "") if show_model else ""
+    current_file = state.get("file", "") if show_file else ""
+    agent_name = state.get("agent_name", "")
+
+    # Get token data (only if needed for display): the active session's, or
+    # the rollup over every session
+    tokens = state.get("totals") if show_session_totals and state.get("totals") else state.get("tokens", {})
+    input_tokens = tokens.get("input", 0)
+    output_tokens = tokens.get("output", 0)
+    cache_read = tokens.get("cache_read", 0)
+    cache_write = tokens.get("cache_write", 0)
+    cost = tokens.get("cost", 0.0)
+
+    # Get lines changed and context percentage
+    lines_added = state.get("lines_added", 0)
+    lines_removed = state.get("lines_removed", 0)
+    context_pct = state.get("context_pct", 0)
+
+    # Determine activity - show "Idling" if idle timeout reached
+    if is_idle:
+        activity = "Idling"
+    elif tool == "Task" and agent_name:
+        activity = f"Delegating to {agent_name}"
+    elif tool in TOOL_DISPLAY:
+        activity = TOOL_DISPLAY[tool]
+    elif tool.startswith("mcp__"):
+        activity = "Using MCP"
+    else:
+        activity = "Working"
+        if tool:  # Don't log for empty tool (normal between tool uses)
+            log(f"Unmapped tool '{tool}', showing generic activity")
+
+    # Only show file for non-idle file operations
+    display_file = current_file if not is_idle and tool in FILE_TOOLS else ""
+
+    # Build activity string with optional filename
+    if display_file:  # show_file already checked when setting display_file
+        truncated_file = truncate_filename(display_file)
+        activity_str = f"{activity} {truncated_file}"
+    else:
+        activity_str = activity
+
+    # Build details line: "Activity [file] on project [(branch)]"
+    if git_branch:
+        details = f"{activity_str} on {project} ({git_branch})"
+    else:
+        details = f"{activity_str} on {project}"
+
+    # Truncate details if too long for Discord (max ~128 chars)
+    if len(details) > 120:
+        if git_branch:
+            details = f"{activity_str} on {project}"
+        if len(details) > 120:
+            max_proj = 120 - len(activity_str) - 4
+            details = f"{activity_str} on {project[:max(10, max_proj)]}..."
+
+    # Cycle token display between two views every 8 seconds:
+    # - Simple (5s): input + output tokens only
+    # - Cached (3s): total tokens including cache reads/writes
+    cycle_pos = int(now) % TOKEN_CYCLE_PERIOD
+    show_simple = cycle_pos < TOKEN_CYCLE_SIMPLE
+
+    simple_tokens = input_tokens + output_tokens
+    cached_tokens = input_tokens + output_tokens + cache_read + cache_write
+
+    # Build state line with config toggles
+    parts = []
+
+    if show_model and model:
+        parts.append(model)
+
+    if show_tokens:
+        if show_simple:
+            parts.append(f"{format_tokens(simple_tokens)} tokens")
+        else:
+            parts.append(f"{format_tokens(cached_tokens)} cached")
+        flip = int(now) - cycle_pos + (TOKEN_CYCLE_SIMPLE if show_simple else TOKEN_CYCLE_PERIOD)
+        next_change = flip if next_change is None else min(next_change, flip)
+
+    if show_cost and cost > 0:
+        parts.append(f"${cost:.2f}")
+
+    if show_lines and (lines_added > 0 or lines_removed > 0):
+        parts.append(f"+{lines_added} -{lines_removed}")
+
+    if show_context_warning and context_pct > 80:
+        if context_pct > 95:
+            parts.append(f"\U0001f534 {int(context_pct)}% ctx")
+        else:
+            parts.append(f"\u26a0 {int(context_pct)}% ctx")
+
+    state_line = " \u2022 ".join(parts) if parts else "Claude Code"
+
+    # Include view type so a token view flip counts as a change even when
+    # both views happen to render the same text
+    presence = {"details": details, "state_line": state_line, "start": session_start, "view": show_simple}
+    return presence, next_change
+
+
+def write_daemon_stats(update_stats: dict, read_stats: dict | None = None, textfile: bool = False,
+                       tools: ToolLatency | None = None):
+    """Publish the daemon's Discord update, state read and lock counters, its
+    metrics and per-tool latency for `presence.py status` / `metrics`, and to
+    metrics.prom when textfile is set (the metrics_textfile option). The
+    statusline's slowest-tool hints are rewritten when the latencies moved."""
+    stats, hints = daemon_stats(update_stats, read_stats, tools)
+    publish_daemon_stats(stats, hints, textfile)
+
+
+def daemon_stats(update_stats: dict, read_stats: dict | None = None,
+                 tools: ToolLatency | None = None) -> tuple[dict, dict | None]:
+    """Snapshot for publish_daemon_stats: the stats dict, and the tool hints
+    when the latencies moved since the last snapshot (else None).
+
+    Only copies counters, so the asyncio daemon takes it on the event loop
+    and leaves the file writes to a worker thread."""
+    stats = {"pid": os.getpid(), "updated": int(time.time()),
+             "discord_updates": update_stats, "state_reads": read_stats or {},
+             "locks": lock_stats(), "metrics": metrics_snapshot()}
+    hints = None
+    if tools is not None:
+        stats["tools"] = tools.snapshot()
+        if tools.changed:
+            hints = tools.hints()
+            tools.changed = False
+    return stats, hints
+
+
+def publish_daemon_stats(stats: dict, hints: dict | None = None, textfile: bool = False):
+    """Write a daemon_stats() snapshot to daemon_stats.json (and
+    tool_hints.json, metrics.prom when given / enabled)."""
+    if hints is not None:
+        write_tool_hints(hints, log)
+    try:
+        atomic_write_json(STATS_FILE, stats)
+    except OSError as e:
+        log(f"Warning: Could not write daemon stats: {e}")
+    if textfile:
+        write_metrics_textfile(stats)
+
 
-def read_hook_input() -> dict:
-    """Read JSON input from stdin (provided by Claude Code hooks).
+def write_metrics_textfile(stats: dict):
+    """Write stats to metrics.prom for node-exporter's textfile collector.
 
-    Uses os.read() instead of sys.stdin.read() to avoid blocking on EOF.
-    os.read() returns immediately when data is available in the pipe,
-    while sys.stdin.read() waits for pipe closure (EOF) which may not
-    happen promptly in Claude Code 2.1.34+.
+    Written aside and renamed into place - the collector only reads *.prom
+    files, so it never sees a partial one.
     """
+    tmp_path = f"{METRICS_TEXTFILE}.{os.getpid()}.tmp"
     try:
-        if sys.stdin is None or sys.stdin.isatty():
-            return {}
-        raw = os.read(sys.stdin.fileno(), 262144)
-        if raw:
-            return json.loads(raw.decode("utf-8", errors="replace"))
-    except (json.JSONDecodeError, OSError, UnicodeDecodeError, ValueError) as e:
-        log(f"Warning: Could not parse hook input: {e}")
-    return {}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus(stats))
+        os.replace(tmp_path, METRICS_TEXTFILE)
+    except OSError as e:
+        log(f"Warning: Could not write metrics textfile: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def read_daemon_stats() -> dict:
+    try:
+        with open(STATS_FILE, "r", encoding="utf-8") as f:
+            stats = json.load(f)
+        return stats if isinstance(stats, dict) else {}
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+        return {}
+
+
+def daemon_main():
+    """Run the asyncio daemon (aiodaemon.py) where supported, else run_daemon()."""
+    reset_lock_stats()  # Counters inherited from the forking `start` command
+    reset_metrics()
+    start_log_writer()  # Rotates daemon.log if oversized; log() only enqueues from here on
+    if get_config().get("daemon_mode", "async") == "async":
+        try:
+            from aiodaemon import ASYNC_AVAILABLE, run_async_daemon
+        except ImportError as e:
+            # pypresence without AioPresence
+            log(f"Warning: asyncio daemon unavailable ({e}), using sync loop")
+        else:
+            if ASYNC_AVAILABLE:
+                run_async_daemon()
+                return
+    run_daemon()
 
 
 def run_daemon():
-    """Run the Discord RPC daemon loop."""
+    """Run the Discord RPC daemon loop (synchronous fallback for daemon_main).
+
+    The loop blocks until there is something to do: a hook event on the
+    ingest socket, a state file written by a hook (inotify), or the next
+    timer - orphan check, config reload, Discord reconnect, trace or history
+    write, or the moment the presence would change by itself (idle timeout, token view
+    flip).
+    """
     from pypresence import Presence
+    from pypresence.exceptions import PyPresenceException
 
     log("Daemon starting...")
     try:
@@ -705,9 +758,6 @@ def run_daemon():
     app_id = config.get("discord_app_id") or DISCORD_APP_ID
     log(f"Using Discord App ID: {app_id}")
 
-    # Rotate log if oversized
-    _rotate_log()
-
     # Handle graceful shutdown
     def shutdown(signum, frame):
         log("Received shutdown signal")
@@ -717,12 +767,49 @@ def run_daemon():
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
 
+    waiter = Waiter()
+    timers = Timers()
+
+    # Listen for hook events (hooks fall back to state.json when this fails)
+    ingest = IngestServer()
+    if ingest.open():
+        atexit.register(ingest.close)
+        waiter.register(ingest, "ingest")
+        log(f"Listening for hook events on {ingest.path}")
+    else:
+        log("Ingest socket unavailable, hooks will write state.json directly")
+
+    # Watch for hooks that bypass the socket (queue full, daemon restarting)
+    # and for sessions registered by SessionStart
+    watcher = DirWatcher(DATA_DIR, {STATE_FILE.name, JOURNAL_FILE.name, SESSIONS_FILE.name})
+    if watcher.open() and waiter.register(watcher, "files"):
+        log("Watching state files for changes")
+    else:
+        watcher.close()
+        log(f"State file watching unavailable, polling every {DAEMON_POLL_INTERVAL}s")
+
+    # Hold a pidfd per session so an exited Claude Code process is noticed at once
+    pid_watcher = PidWatcher()
+    if pid_watcher.open() and waiter.register(pid_watcher, "pids"):
+        log("Tracking session processes with pidfd")
+    else:
+        pid_watcher.close()
+        log(f"pidfd unavailable, checking sessions every {ORPHAN_CHECK_INTERVAL}s")
+
     # Connect to Discord
     rpc = None
     connected = False
     current_app_id = app_id
-    last_sent = {}  # Track last sent state to avoid redundant updates
-    last_orphan_check = 0  # Track when we last checked for stale sessions
+    scheduler = UpdateScheduler()  # Rate limit + latest-wins coalescing for rpc.update
+    pending_events = []  # Ingested hook events not yet journaled
+    follower = StateFollower()  # In-memory state, fed incrementally from the journal
+    tool_latency = ToolLatency(TOOL_DISPLAY)  # Pairs update/done events into per-tool histograms
+    tracer = TraceRecorder()  # Session timelines for `trace export`, streamed to DATA_DIR/traces
+    history = SessionHistory()  # Session totals for `report`, written to history.db in batches
+    atexit.register(history.close, log)  # SIGTERM exits through sys.exit
+    segment = SegmentWriter()  # Lock-free copy of the in-memory state for `status`
+    if not segment.open():
+        log("Warning: Could not create state segment, status will read state.json")
     discord_connect_attempts = 0  # Track connection retry attempts
     consecutive_errors = 0  # Track consecutive loop errors for circuit breaker
     consecutive_update_errors = 0  # Track consecutive RPC update failures
@@ -730,36 +817,103 @@ def run_daemon():
     last_duration_ms = 0  # Track duration changes for jitter-free session_start
     cached_session_start = int(time.time())  # Cached session_start timestamp
 
+    now = time.time()
+    timers.schedule("orphan", now)  # Also starts watching the registered sessions
+    timers.schedule("config", now + CONFIG_RELOAD_INTERVAL)
+    timers.schedule("connect", now)
+    timers.schedule("history", now + HISTORY_INTERVAL)
+    if config["metrics_textfile"]:
+        timers.schedule("metrics", now + METRICS_INTERVAL)
+
     while True:
         try:
-            # Periodically reload config for hot-reload support
-            config = get_config()
-            new_app_id = config.get("discord_app_id") or DISCORD_APP_ID
-
-            # Check if app ID changed - need to reconnect
-            if new_app_id != current_app_id and connected:
-                log(f"App ID changed from {current_app_id} to {new_app_id}, reconnecting...")
-                try:
-                    rpc.clear()
-                    rpc.close()
-                except (ConnectionError, ConnectionResetError, BrokenPipeError,
-                        TimeoutError, OSError) as e:
-                    log(f"Warning: Error during RPC disconnect before reconnect: {e}")
-                connected = False
-                rpc = None
-                current_app_id = new_app_id
-
-            # Periodically check for dead sessions (orphan cleanup)
+            count('loop_iterations_total{loop="main"}')
             now = time.time()
-            if now - last_orphan_check > ORPHAN_CHECK_INTERVAL:
-                last_orphan_check = now
-                active_count = cleanup_dead_sessions()
+            due = timers.pop_due(now)
+
+            # Periodically reload config for hot-reload support
+            if "config" in due:
+                timers.schedule("config", now + CONFIG_RELOAD_INTERVAL)
+                config = get_config()
+                new_app_id = config.get("discord_app_id") or DISCORD_APP_ID
+                if config["metrics_textfile"] and not timers.pending("metrics"):
+                    timers.schedule("metrics", now)
+
+                # Check if app ID changed - need to reconnect
+                if new_app_id != current_app_id:
+                    if connected:
+                        log(f"App ID changed from {current_app_id} to {new_app_id}, reconnecting...")
+                        count("discord_reconnects_total")
+                        try:
+                            rpc.clear()
+                            rpc.close()
+                        except (ConnectionError, ConnectionResetError, BrokenPipeError,
+                                TimeoutError, OSError) as e:
+                            log(f"Warning: Error during RPC disconnect before reconnect: {e}")
+                        connected = False
+                        rpc = None
+                        timers.schedule("connect", now)
+                        due.add("connect")
+                    current_app_id = new_app_id
+
+            # Check for dead sessions: at once when a pidfd reports an exit,
+            # otherwise on the orphan timer (PIDs pidfd cannot watch)
+            exited = pid_watcher.exited()
+            if exited or "orphan" in due or "metrics" in due:
+                if "metrics" in due and config["metrics_textfile"]:
+                    timers.schedule("metrics", now + METRICS_INTERVAL)
+                write_daemon_stats(scheduler.stats(), follower.stats(), config["metrics_textfile"], tool_latency)
+            if exited or "orphan" in due:
+                if exited:
+                    log(f"Session process exited: {', '.join(str(pid) for pid in sorted(exited))}")
+                active_count = cleanup_dead_sessions(exited)
                 if active_count == 0:
                     log("No active sessions remaining, daemon exiting")
                     break
+            # Journal queued hook events with one append (no lock), then fold
+            # everything new in the journal into the in-memory state.
+            # Events stay pending if both write paths fail so they are retried next loop.
+            stop_requested = False
+            drained = ingest.drain()
+            if drained:
+                count("hook_events_total", len(drained))
+                # "done" events only feed the tool latencies - they never reach the journal
+                pending_events.extend(event for event in drained if not tool_latency.observe(event))
+                for event in drained:
+                    tracer.observe(event, now)
+            if tracer.should_flush():
+                tracer.flush(log)
+            if tracer.ring and not timers.pending("trace"):
+                timers.schedule("trace", tracer.last_flush + TRACE_FLUSH_INTERVAL)
+            if pending_events and (append_events(pending_events, log)
+                                   or apply_events_locked(pending_events, log) is not None):
+                stop_requested = any(event.get("op") == "stop" for event in pending_events)
+                pending_events = []
+            # Drained after our own append so it does not wake us again; hook
+            # writes before this point are read by the refresh below
+            changed_files = watcher.drain()
+            if exited or "orphan" in due or SESSIONS_FILE.name in changed_files:
+                unwatched = pid_watcher.watch(session_pids())
+                interval = session_check_interval(pid_watcher, watcher, unwatched)
+                timers.schedule("orphan", now + interval)
+            if follower.refresh(log):
+                segment.publish(follower.state)
+                history.observe(follower.state)
+            if follower.journal_size > DAEMON_COMPACT_SIZE:
+                compact_journal(timeout=0.5, logger=log)
+            if "history" in due:
+                timers.schedule("history", now + HISTORY_INTERVAL)
+                history.flush(log)
+
+            if stop_requested:
+                if cleanup_dead_sessions() == 0:
+                    log("Stop requested via ingest socket, daemon exiting")
+                    break
+                log("Stop requested but sessions are still active, ignoring")
 
-            # Try to connect if not connected
-            if not connected:
+            # Try to connect if not connected (retries are timer-driven so
+            # hook events keep being journaled while Discord is unreachable)
+            if not connected and "connect" in due:
                 discord_connect_attempts += 1
                 if discord_connect_attempts > DISCORD_CONNECT_MAX_RETRIES:
                     log(f"ERROR: Cannot connect to Discord after {DISCORD_CONNECT_MAX_RETRIES} attempts. Is Discord running?")
@@ -769,191 +923,109 @@ def run_daemon():
                     rpc.connect()
                     connected = True
                     discord_connect_attempts = 0  # Reset on successful connection
+                    scheduler.reset()  # New connection starts with no presence
                     log(f"Connected to Discord with App ID: {current_app_id}")
                 except (ConnectionError, ConnectionRefusedError, ConnectionResetError,
-                        BrokenPipeError, TimeoutError, OSError) as e:
-                    # Expected connection failures - retry
+                        BrokenPipeError, TimeoutError, OSError, PyPresenceException) as e:
+                    # Expected connection failures (incl. Discord not running) - retry
                     log(f"Failed to connect to Discord (attempt {discord_connect_attempts}/{DISCORD_CONNECT_MAX_RETRIES}): {e}")
-                    time.sleep(5)
-                    continue
+                    rpc = None
+                    timers.schedule("connect", now + DISCORD_RETRY_DELAY)
                 except Exception as e:
                     # Unexpected error (likely a bug) - fail fast with traceback
                     import traceback
                     log(f"FATAL: Unexpected error connecting to Discord: {e}\n{traceback.format_exc()}")
                     break
 
-            # Read current state (pass logger for error visibility)
-            state = read_state(log)
-
-            if state is None:
-                # Lock/read failure — back off longer to reduce contention
-                time.sleep(3)
-                continue
-            if not state:
-                # Legitimately empty state (no session data yet)
-                time.sleep(1)
-                continue
-
-            # Get display settings from config
-            display_cfg = config.get("display", {})
-            show_tokens = display_cfg.get("show_tokens", True)
-            show_cost = display_cfg.get("show_cost", True)
-            show_model = display_cfg.get("show_model", True)
-            show_branch = display_cfg.get("show_branch", True)
-            show_file = display_cfg.get("show_file", True)
-            show_lines = display_cfg.get("show_lines", True)
-            show_context_warning = display_cfg.get("show_context_warning", True)
-
-            # Check for idle timeout - show "Idling" instead of clearing
-            last_update = state.get("last_update", 0)
-            idle_timeout = config.get("idle_timeout", IDLE_TIMEOUT)
-            is_idle = time.time() - last_update > idle_timeout
-
-            # Get state values
-            tool = state.get("tool", "")
-            project = state.get("project", "Claude Code")
-            git_branch = state.get("git_branch", "") if show_branch else ""
-            model = state.get("model", "") if show_model else ""
-            current_file = state.get("file", "") if show_file else ""
-            agent_name = state.get("agent_name", "")
-
-            # Get duration from statusline API (milliseconds)
-            duration_ms = state.get("duration_ms", 0)
-
-            # Calculate session start from duration for Discord elapsed timer
-            # Only recalculate when duration_ms changes to prevent jitter
-            if duration_ms != last_duration_ms:
-                last_duration_ms = duration_ms
-                if duration_ms > 0:
-                    cached_session_start = int(time.time()) - (duration_ms // 1000)
-                else:
-                    cached_session_start = state.get("session_start", int(time.time()))
-            session_start = cached_session_start
-
-            # Get token data (only if needed for display)
-            tokens = state.get("tokens", {})
-            input_tokens = tokens.get("input", 0)
-            output_tokens = tokens.get("output", 0)
-            cache_read = tokens.get("cache_read", 0)
-            cache_write = tokens.get("cache_write", 0)
-            cost = tokens.get("cost", 0.0)
-
-            # Get lines changed and context percentage
-            lines_added = state.get("lines_added", 0)
-            lines_removed = state.get("lines_removed", 0)
-            context_pct = state.get("context_pct", 0)
-
-            # Determine activity - show "Idling" if idle timeout reached
-            if is_idle:
-                activity = "Idling"
-            elif tool == "Task" and agent_name:
-                activity = f"Delegating to {agent_name}"
-            elif tool in TOOL_DISPLAY:
-                activity = TOOL_DISPLAY[tool]
-            elif tool.startswith("mcp__"):
-                activity = "Using MCP"
-            else:
-                activity = "Working"
-                if tool:  # Don't log for empty tool (normal between tool uses)
-                    log(f"Unmapped tool '{tool}', showing generic activity")
-
-            # Only show file for non-idle file operations
-            display_file = current_file if not is_idle and tool in FILE_TOOLS else ""
-
-            # Build activity string with optional filename
-            if display_file:  # show_file already checked when setting display_file
-                truncated_file = truncate_filename(display_file)
-                activity_str = f"{activity} {truncated_file}"
-            else:
-                activity_str = activity
-
-            # Build details line: "Activity [file] on project [(branch)]"
-            if git_branch:
-                details = f"{activity_str} on {project} ({git_branch})"
-            else:
-                details = f"{activity_str} on {project}"
-
-            # Truncate details if too long for Discord (max ~128 chars)
-            if len(details) > 120:
-                if git_branch:
-                    details = f"{activity_str} on {project}"
-                if len(details) > 120:
-                    max_proj = 120 - len(activity_str) - 4
-                    details = f"{activity_str} on {project[:max(10, max_proj)]}..."
-
-            # Cycle token display between two views every 8 seconds:
-            # - Simple (5s): input + output tokens only
-            # - Cached (3s): total tokens including cache reads/writes
-            cycle_pos = int(time.time()) % 8
-            show_simple = cycle_pos < 5
-
-            simple_tokens = input_tokens + output_tokens
-            cached_tokens = input_tokens + output_tokens + cache_read + cache_write
-
-            # Build state line with config toggles
-            parts = []
-
-            if show_model and model:
-                parts.append(model)
-
-            if show_tokens:
-                if show_simple:
-                    parts.append(f"{format_tokens(simple_tokens)} tokens")
-                else:
-                    parts.append(f"{format_tokens(cached_tokens)} cached")
-
-            if show_cost and cost > 0:
-                parts.append(f"${cost:.2f}")
-
-            if show_lines and (lines_added > 0 or lines_removed > 0):
-                parts.append(f"+{lines_added} -{lines_removed}")
-
-            if show_context_warning and context_pct > 80:
-                if context_pct > 95:
-                    parts.append(f"\U0001f534 {int(context_pct)}% ctx")
+            state = follower.state
+            if connected and state:
+                # Get duration from statusline API (milliseconds)
+                duration_ms = state.get("duration_ms", 0)
+
+                # Calculate session start from duration for Discord elapsed timer
+                # Only recalculate when duration_ms changes to prevent jitter
+                if duration_ms != last_duration_ms:
+                    last_duration_ms = duration_ms
+                    if duration_ms > 0:
+                        cached_session_start = int(now) - (duration_ms // 1000)
+                    else:
+                        cached_session_start = state.get("session_start", int(now))
+
+                current, next_change = build_presence(state, config, cached_session_start, now)
+                if next_change is not None:
+                    timers.schedule("render", next_change)
                 else:
-                    parts.append(f"\u26a0 {int(context_pct)}% ctx")
-
-            state_line = " \u2022 ".join(parts) if parts else "Claude Code"
-
-            # Only update if something changed (include view type to avoid
-            # redundant updates within the same token cycling phase)
-            current = {"details": details, "state_line": state_line, "view": show_simple}
-            if current != last_sent:
-                log(f"Sending to Discord: {details} | {state_line}")
-                try:
-                    rpc.update(
-                        details=details,
-                        state=state_line,
-                        start=session_start,
-                        large_image="claude",
-                        large_text="Claude Code",
-                    )
-                    last_sent = current
-                    consecutive_update_errors = 0
-                except (ConnectionError, ConnectionResetError, BrokenPipeError,
-                        TimeoutError, OSError) as e:
-                    # Connection lost - will reconnect on next iteration
-                    log(f"Failed to update presence (connection lost): {e}")
-                    connected = False
-                    rpc = None
-                except (TypeError, ValueError, KeyError, AttributeError) as e:
-                    # Programming bug in payload construction — reconnect won't fix this
-                    import traceback
-                    log(f"FATAL: Bug in presence payload: {e}\n{traceback.format_exc()}")
-                    break
-                except Exception as e:
-                    # Unexpected transient error — retry with reconnect
-                    import traceback
-                    log(f"Failed to update presence (unexpected): {e}\n{traceback.format_exc()}")
-                    consecutive_update_errors += 1
-                    if consecutive_update_errors >= 5:
-                        log("Too many consecutive update failures, reconnecting")
+                    timers.cancel("render")
+
+                # Only send if something changed, within Discord's rate limit
+                # (start is excluded so a recalculated timer alone costs nothing)
+                scheduler.offer(current)
+                payload = scheduler.take()
+                if payload:
+                    log(f"Sending to Discord: {payload['details']} | {payload['state_line']}", DEBUG)
+                    update_started = time.perf_counter()
+                    try:
+                        rpc.update(
+                            details=payload["details"],
+                            state=payload["state_line"],
+                            start=payload["start"],
+                            large_image="claude",
+                            large_text="Claude Code",
+                        )
+                        observe("rpc_update_seconds", time.perf_counter() - update_started)
+                        scheduler.mark_sent()
+                        consecutive_update_errors = 0
+                    except (ConnectionError, ConnectionResetError, BrokenPipeError,
+                            TimeoutError, OSError) as e:
+                        # Connection lost - reconnect right away
+                        log(f"Failed to update presence (connection lost): {e}")
+                        count("rpc_update_failures_total")
+                        count("discord_reconnects_total")
+                        scheduler.mark_failed(payload)
                         connected = False
                         rpc = None
-                        consecutive_update_errors = 0
-
-            time.sleep(1)
+                        timers.schedule("connect", now)
+                    except (TypeError, ValueError, KeyError, AttributeError) as e:
+                        # Programming bug in payload construction — reconnect won't fix this
+                        import traceback
+                        log(f"FATAL: Bug in presence payload: {e}\n{traceback.format_exc()}")
+                        break
+                    except Exception as e:
+                        # Unexpected transient error — retry with reconnect
+                        import traceback
+                        log(f"Failed to update presence (unexpected): {e}\n{traceback.format_exc()}")
+                        count("rpc_update_failures_total")
+                        scheduler.mark_failed(payload)  # Unknown whether Discord got it - resend
+                        consecutive_update_errors += 1
+                        if consecutive_update_errors >= 5:
+                            log("Too many consecutive update failures, reconnecting")
+                            count("discord_reconnects_total")
+                            connected = False
+                            rpc = None
+                            consecutive_update_errors = 0
+                            timers.schedule("connect", now)
+                        else:
+                            timers.schedule("render", now + 1)  # Retry the update
+                    write_daemon_stats(scheduler.stats(), follower.stats(), config["metrics_textfile"], tool_latency)
+
+                # Wake when the rate limit lets the held-back update through
+                delay = scheduler.wait_time()
+                if delay is not None:
+                    timers.schedule("send", time.time() + delay)
+                else:
+                    timers.cancel("send")
+            else:
+                # Legitimately empty state (no session data yet) - wait for events
+                timers.cancel("render")
+                timers.cancel("send")
+
+            # Block until a hook event, a state file write, or the next timer
+            timeout = timers.next_deadline() - time.time()
+            if pending_events:
+                timeout = min(timeout, 1)  # Retry the failed journal write
+            if not watcher.is_open:
+                timeout = min(timeout, DAEMON_POLL_INTERVAL)
+            waiter.wait(timeout)
 
         except KeyboardInterrupt:
             break
@@ -983,12 +1055,28 @@ def run_daemon():
             rpc.close()
         except Exception as e:
             log(f"Warning: Error during RPC cleanup on shutdown: {e}")
+    tracer.flush(log)
+    history.close(log)
+    stats = scheduler.stats()
+    write_daemon_stats(stats, follower.stats(), config["metrics_textfile"], tool_latency)
+    log(f"Discord updates: {stats['sent']} sent, {stats['failed']} failed, {stats['coalesced']} coalesced, "
+        f"{stats['dropped']} dropped")
+    ingest.close()
+    watcher.close()
+    pid_watcher.close()
+    segment.close()
+    waiter.close()
     log("Daemon stopped")
 
 
 def cmd_start():
-    """Handle 'start' command - spawn daemon if needed, update state."""
-    hook_input = read_hook_input()
+    """Handle 'start' command - spawn daemon if needed, update state.
+
+    State goes through the daemon's ingest socket when a daemon is already
+    running, otherwise through the state journal.
+    """
+    hook_input = read_hook_input((("cwd",), ("session_id",)))
+    record_payload("start", hook_input)
     project = hook_input.get("cwd", os.environ.get("CLAUDE_PROJECT_DIR", ""))
     project_name = get_project_name(project) if project else get_project_name()
 
@@ -1001,40 +1089,27 @@ def cmd_start():
         print(f"[presence] ERROR: Could not register session, daemon will not start", file=sys.stderr)
         return
 
-    # Update state with file locking to prevent race conditions
-    now = int(time.time())
-    git_branch = get_git_branch(project) if project else ""
+    # First session: fresh state (clears stale file/model/tokens from previous session).
+    # Multi-session: adds this session's record next to the others.
+    # Note: model, tokens, duration, lines, agent are populated by statusline.py
+    event = {
+        "op": "start",
+        "ts": int(time.time()),
+        "fresh": session_count == 1,
+        "project": project_name,
+        "project_path": project,
+        "git_branch": get_git_branch(project) if project else "",
+        "session_id": hook_input.get("session_id", ""),
+        "pid": claude_pid,
+    }
 
-    try:
-        with StateLock():
-            # First session: fresh state (clears stale file/model/tokens from previous session).
-            # Multi-session: preserve existing state from the active session.
-            if session_count == 1:
-                state = {
-                    "session_start": now,
-                    "project": project_name,
-                    "project_path": project,
-                    "git_branch": git_branch,
-                    "tool": "",
-                }
-            else:
-                state = read_state_unlocked()
-                # Multi-session: only fill in missing project info
-                if not state.get("project"):
-                    state["project"] = project_name
-                    state["project_path"] = project
-                    state["git_branch"] = git_branch
-
-            state["last_update"] = now
-            state["session_id"] = hook_input.get("session_id", "")
-            # Note: model, tokens, duration, lines, agent are populated by statusline.py
-
-            write_state_unlocked(state)
-    except (OSError, TimeoutError) as e:
-        log(f"ERROR: Could not write session state: {e}")
-        print(f"[presence] ERROR: Could not write session state, daemon will not start: {e}", file=sys.stderr)
+    if not submit_event(event, log):
+        log("ERROR: Could not write session state")
+        print("[presence] ERROR: Could not write session state, daemon will not start", file=sys.stderr)
         return
 
+    # New state or a new session record has no statusline data yet
+    forget_statusline_digest(None if event["fresh"] else event["session_id"])
     log(f"Session started for PID {claude_pid} (active sessions: {session_count})")
 
     # Check if daemon is running
@@ -1081,56 +1156,29 @@ def cmd_start():
                 os.dup2(devnull, fd)
             if devnull > 2:
                 os.close(devnull)
-            run_daemon()
+            daemon_main()
             sys.exit(0)
 
 
-def cmd_update():
-    """Handle 'update' command - update current activity."""
-    hook_input = read_hook_input()
-    tool_name = hook_input.get("tool_name", "")
-
-    # Extract filename outside lock to minimize lock time
-    config = get_config()
-    show_file = config.get("display", {}).get("show_file", True)
-    filename = ""
-    if show_file:
-        filename = extract_file_from_tool_input(hook_input)
-
-    # Update state with file locking to prevent race conditions
-    try:
-        with StateLock():
-            state = read_state_unlocked()
-            if not state:
-                # No active session, ignore
-                return
-
-            state["tool"] = tool_name
-            state["last_update"] = int(time.time())
-
-            if show_file:
-                if filename:
-                    state["file"] = filename
-                elif tool_name not in FILE_TOOLS:
-                    state["file"] = ""
-
-            # Note: tokens are updated by statusline.py (no JSONL parsing needed)
-            write_state_unlocked(state)
-    except (OSError, TimeoutError) as e:
-        log(f"Warning: Could not update session state: {e}")
-        return
-
-    log(f"Updated: {tool_name}" + (f" ({filename})" if filename else ""))
-
-
 def cmd_stop():
-    """Handle 'stop' command - clear presence and stop daemon."""
-    read_hook_input()  # Consume stdin to prevent pipe errors
+    """Handle 'stop' command - clear presence and stop daemon.
+
+    A listening daemon is asked to stop over the ingest socket first; the
+    locked clear + SIGTERM/taskkill path remains the fallback.
+    """
+    hook_input = read_hook_input((("session_id",),))
+    record_payload("stop", hook_input)
+    session_id = hook_input.get("session_id", "")
 
     claude_pid = get_session_pid()
     remaining = remove_session(claude_pid)
 
     if remaining > 0:
+        # Drop this session's record; the others keep theirs
+        event = {"op": "end", "session_id": session_id} if session_id else {"op": "end", "pid": claude_pid}
+        if not submit_event(event, log):
+            log(f"Warning: Could not remove state of session PID {claude_pid}")
+        forget_statusline_digest(session_id)
         log(f"Session ended: PID {claude_pid} (active sessions: {remaining})")
         return  # Don't stop daemon, other sessions still active
 
@@ -1139,12 +1187,27 @@ def cmd_stop():
         return
 
     log("Last session ended, stopping daemon")
+    forget_statusline_digest()
+
+    pid = get_daemon_pid()
+
+    # Ask a listening daemon to clear state and exit on its own
+    if pid and send_event({"op": "stop"}):
+        for _ in range(10):
+            # The daemon removes its PID file on the way out (before it is reaped)
+            if not PID_FILE.exists() or not is_process_alive(pid):
+                log(f"Stopped daemon (PID {pid}) via ingest socket")
+                return
+            time.sleep(0.1)
+        if read_sessions():
+            log(f"Daemon PID {pid} kept running: a new session registered during stop")
+            return
+        log(f"Warning: Daemon PID {pid} did not exit within 1s after stop request, sending SIGTERM")
 
     # Clear state (with locking)
     clear_state(log)
 
     # Kill daemon if running
-    pid = get_daemon_pid()
     if pid:
         try:
             if sys.platform == "win32":
@@ -1181,11 +1244,39 @@ def cmd_stop():
 def cmd_status():
     """Handle 'status' command - show current status."""
     pid = get_daemon_pid()
-    state = read_state()
+    # The daemon's published copy avoids the lock and the journal replay
+    state = read_segment(writer_pid=pid) if pid else None
+    if state is None:
+        state = read_state()
     sessions = read_sessions()
 
     if pid:
         print(f"Daemon running (PID {pid})")
+        updates = read_daemon_stats()
+        if updates.get("pid") == pid and isinstance(updates.get("discord_updates"), dict):
+            counts = updates["discord_updates"]
+            print(f"Discord updates: {counts.get('sent', 0)} sent, {counts.get('failed', 0)} failed, "
+                  f"{counts.get('coalesced', 0)} coalesced, "
+                  f"{counts.get('dropped', 0)} dropped")
+        reads = updates.get("state_reads") if updates.get("pid") == pid else None
+        if isinstance(reads, dict) and reads:
+            print(f"State reads: {reads.get('reads', 0)} read, {reads.get('skipped', 0)} skipped (unchanged)")
+        locks = updates.get("locks") if updates.get("pid") == pid else None
+        if isinstance(locks, dict) and locks:
+            counts = [c for c in locks.values() if isinstance(c, dict)]
+            wait_max = max((c.get("wait_max", 0.0) for c in counts), default=0.0)
+            print(f"Daemon locks: {sum(c.get('acquired', 0) for c in counts)} acquired, "
+                  f"{sum(c.get('contended', 0) for c in counts)} contended, "
+                  f"{sum(c.get('timeouts', 0) for c in counts)} timed out, max wait {wait_max * 1000:.1f}ms")
+        tools = updates.get("tools") if updates.get("pid") == pid else None
+        if isinstance(tools, dict):
+            session_tools = (tools.get("sessions") or {}).get((state or {}).get("session_id", ""))
+            for title, histograms in (("this session", session_tools), ("all sessions", tools.get("totals"))):
+                lines = latency_table(histograms) if isinstance(histograms, dict) else []
+                if lines:
+                    print(f"Tool latency ({title}):")
+                    for line in lines:
+                        print(f"  {line}")
     else:
         print("Daemon not running")
 
@@ -1227,6 +1318,11 @@ def cmd_status():
             print(f"Tokens (cached): {format_tokens(cached)} (+{format_tokens(cache_read)} read / +{format_tokens(cache_write)} write)")
             print(f"Cost: ${cost:.2f}")
 
+        totals = state.get("totals") or {}
+        if len(sessions) > 1 and totals:
+            total_simple = totals.get("input", 0) + totals.get("output", 0)
+            print(f"All sessions: {format_tokens(total_simple)} tokens, ${totals.get('cost', 0.0):.2f}")
+
         lines_added = state.get("lines_added", 0)
         lines_removed = state.get("lines_removed", 0)
         if lines_added or lines_removed:
@@ -1244,13 +1340,143 @@ def cmd_status():
         if last_update:
             ago = int(time.time() - last_update)
             print(f"Last update: {ago}s ago")
+
+        heartbeat = statusline_heartbeat()
+        if heartbeat:
+            print(f"Statusline: refreshed {int(time.time() - heartbeat)}s ago")
     else:
         print("No active session")
 
 
+def cmd_metrics():
+    """Handle 'metrics' command - show the daemon's counters and latency histograms.
+
+    `metrics --prometheus` prints them in Prometheus text format instead.
+    """
+    stats = read_daemon_stats()
+    if not stats:
+        print("No daemon metrics yet (the daemon publishes them while it runs)")
+        return
+    if "--prometheus" in sys.argv[2:]:
+        sys.stdout.write(render_prometheus(stats))
+        return
+
+    pid = get_daemon_pid()
+    running = "running" if pid and stats.get("pid") == pid else "not running"
+    age = int(time.time()) - stats.get("updated", 0) if isinstance(stats.get("updated"), int) else None
+    print(f"Daemon metrics (PID {stats.get('pid', '?')}, {running}"
+          + (f", published {age}s ago)" if age is not None else ")"))
+    for line in format_report(stats):
+        print(f"  {line}")
+
+
+def cmd_record():
+    """Handle 'record' command - record hook and statusline payloads for tools/replay.py.
+
+    `record start` begins appending to recording.jsonl, `record stop` closes
+    it under a timestamped name, `record` alone shows whether one is running.
+    """
+    action = sys.argv[2] if len(sys.argv) > 2 else "status"
+    if action == "start":
+        if start_recording():
+            print(f"Recording hook and statusline payloads to {RECORDING_FILE}")
+        else:
+            print(f"Already recording to {RECORDING_FILE}")
+    elif action == "stop":
+        path = stop_recording()
+        print(f"Recording saved to {path}" if path else "Not recording")
+    elif action == "status":
+        if recording_active():
+            with open(RECORDING_FILE, "rb") as f:
+                lines = sum(1 for _ in f) - 1  # Minus the header
+            print(f"Recording to {RECORDING_FILE} ({lines} payloads)")
+        else:
+            print("Not recording")
+    else:
+        print("Usage: presence.py record <start|stop|status>")
+        sys.exit(1)
+
+
+def cmd_report():
+    """Handle 'report' command - usage rollups from the session history.
+
+    `report [--days N] [--project NAME]` sums tokens, cost, lines and time
+    per project, model and day over the last N days (default 30, 0 for all
+    time); with --project, also per branch. Reads only history.db's
+    daily_usage table, so it stays fast however many sessions are stored.
+    """
+    days, project = 30, ""
+    args = sys.argv[2:]
+    try:
+        while args:
+            option = args.pop(0)
+            if option == "--days":
+                days = int(args.pop(0))
+            elif option == "--project":
+                project = args.pop(0)
+            else:
+                raise ValueError(option)
+    except (IndexError, ValueError):
+        print("Usage: presence.py report [--days N] [--project NAME]")
+        sys.exit(1)
+
+    try:
+        import sqlite3  # Lazy: hooks import this module too
+    except ImportError:
+        print("Session history needs Python's sqlite3 module")
+        sys.exit(1)
+    try:
+        report = read_report(days, project)
+    except sqlite3.Error as e:
+        print(f"Could not read session history: {e}")
+        sys.exit(1)
+    if report is None:
+        print("No session history yet (the daemon records sessions while it runs)")
+        return
+    span = f"last {days} days" if days > 0 else "all time"
+    total = sum(row["sessions"] for row in report["by_project"])
+    print(f"Session history, {span}" + (f", project {project}" if project else "") + f" ({total} sessions)")
+    for line in report_lines(report):
+        print(line if line.startswith(" ") else f"\n{line}")
+
+
+def cmd_trace():
+    """Handle 'trace' command - export a session's tool timeline.
+
+    `trace export <session_id> [output.json]` writes Chrome trace-event JSON
+    (default trace-<session_id>.json) for Perfetto or chrome://tracing; a
+    unique prefix of the id will do. `trace` alone lists the traced sessions.
+    The daemon appends to the trace files every few seconds, so the last
+    moments of a running session may not be in an export yet.
+    """
+    action = sys.argv[2] if len(sys.argv) > 2 else "list"
+    if action == "list":
+        traces = list_traces()
+        if not traces:
+            print("No session traces yet (the daemon records them while it runs)")
+        for session_id, mtime in traces:
+            print(f"{session_id}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}")
+    elif action == "export" and len(sys.argv) > 3:
+        session_id = find_trace(sys.argv[3])
+        if session_id is None:
+            print(f"No trace for session '{sys.argv[3]}' (see presence.py trace list)")
+            sys.exit(1)
+        output = Path(sys.argv[4] if len(sys.argv) > 4 else f"trace-{session_id}.json")
+        try:
+            records = export_trace(session_id, output)
+        except OSError as e:
+            print(f"Could not write {output}: {e}")
+            sys.exit(1)
+        print(f"Exported {records} records of session {session_id} to {output}")
+        print("Open it in https://ui.perfetto.dev or chrome://tracing")
+    else:
+        print("Usage: presence.py trace <list|export <session_id> [output.json]>")
+        sys.exit(1)
+
+
 def main():
     if len(sys.argv) < 2:
-        print("Usage: presence.py <start|update|stop|status|daemon>")
+        print("Usage: presence.py <start|update|done|stop|status|metrics|report|record|trace|daemon>")
         sys.exit(1)
 
     command = sys.argv[1]
@@ -1259,16 +1485,29 @@ def main():
         cmd_start()
     elif command == "update":
         cmd_update()
+    elif command == "done":
+        cmd_done()
     elif command == "stop":
         cmd_stop()
     elif command == "status":
         cmd_status()
+    elif command == "metrics":
+        cmd_metrics()
+    elif command == "report":
+        cmd_report()
+    elif command == "record":
+        cmd_record()
+    elif command == "trace":
+        cmd_trace()
     elif command == "daemon":
-        run_daemon()
+        daemon_main()
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
+    # Also register as "presence": aiodaemon's `from presence import ...` then
+    # gets this module instead of executing a second copy with its own state
+    sys.modules.setdefault("presence", sys.modules[__name__])
     main()
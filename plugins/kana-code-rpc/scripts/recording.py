@@ -0,0 +1,99 @@
+"""
+Hook and statusline recording for Discord Rich Presence.
+While DATA_DIR/recording.jsonl exists, every hook command (start, update,
+done, stop) and every statusline refresh appends one line to it: the time and
+the payload fields the command read. Only those fields are kept - a Write's
+file contents never reach the trace - so recordings stay compact.
+tools/replay.py feeds a recording back through the same commands.
+
+Recording costs a hook one failed open() while it is off; there is no
+config setting to check.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from state import DATA_DIR
+
+RECORDING_FILE = DATA_DIR / "recording.jsonl"
+RECORDING_VERSION = 1
+RECORD_COMMANDS = ("start", "update", "done", "stop", "statusline")
+
+
+def record_payload(command: str, payload: dict):
+    """Append one payload to the recording, if one is in progress.
+
+    One O_APPEND write per line, so concurrent hooks never interleave.
+    """
+    try:
+        fd = os.open(RECORDING_FILE, os.O_WRONLY | os.O_APPEND)
+    except OSError:
+        return  # Not recording
+    try:
+        line = json.dumps({"t": round(time.time(), 4), "cmd": command, "in": payload},
+                          separators=(",", ":"), ensure_ascii=False)
+        os.write(fd, (line + "\n").encode("utf-8"))
+    except (OSError, TypeError, ValueError):
+        pass  # A lost trace line must never fail the hook
+    finally:
+        os.close(fd)
+
+
+def recording_active() -> bool:
+    return RECORDING_FILE.exists()
+
+
+def start_recording() -> bool:
+    """Begin a recording. Returns False if one is already in progress."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(RECORDING_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return False
+    try:
+        header = {"t": round(time.time(), 4), "cmd": "header", "in": {"version": RECORDING_VERSION}}
+        os.write(fd, (json.dumps(header, separators=(",", ":")) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+    return True
+
+
+def stop_recording() -> Path | None:
+    """End the recording, renaming it to recording-<start time>.jsonl in
+    DATA_DIR. Returns the new path, or None if nothing was recording."""
+    started = time.localtime()
+    try:
+        started = time.localtime(os.stat(RECORDING_FILE).st_mtime)
+        with open(RECORDING_FILE, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+        if isinstance(header, dict) and isinstance(header.get("t"), (int, float)):
+            started = time.localtime(header["t"])
+    except (OSError, ValueError):
+        if not RECORDING_FILE.exists():
+            return None
+    target = DATA_DIR / f"recording-{time.strftime('%Y%m%d-%H%M%S', started)}.jsonl"
+    try:
+        os.replace(RECORDING_FILE, target)
+    except FileNotFoundError:
+        return None
+    return target
+
+
+def read_recording(path) -> list:
+    """Recorded commands from a recording file, oldest first:
+    [{"t", "cmd", "in"}] without the header. Torn or unknown lines are
+    skipped."""
+    entries = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if (isinstance(entry, dict) and entry.get("cmd") in RECORD_COMMANDS
+                    and isinstance(entry.get("t"), (int, float)) and isinstance(entry.get("in"), dict)):
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry["t"])
+    return entries
@@ -0,0 +1,143 @@
+"""
+Discord update scheduler for Discord Rich Presence.
+Sits between the presence builder and pypresence: Discord accepts roughly
+5 activity updates per 20 seconds, so updates go through a token bucket,
+only the newest pending payload is ever sent, and changes the user can see
+(tool, file, project) take precedence over cosmetic ones (token view flip).
+"""
+
+import time
+
+# Discord's presence rate limit
+UPDATE_BURST = 5
+UPDATE_PERIOD = 20.0
+
+# Tokens held back for visible changes: a cosmetic update only goes out
+# when sending it would still leave this many in the bucket
+COSMETIC_RESERVE = 2
+
+PRIORITY_COSMETIC = 0
+PRIORITY_VISIBLE = 1
+
+
+class UpdateScheduler:
+    """
+    Token-bucket, latest-wins scheduler for presence payloads.
+
+    Usage:
+        scheduler = UpdateScheduler()
+        scheduler.offer(payload)        # after every render
+        payload = scheduler.take()      # None if nothing is due yet
+        if payload:
+            try:
+                rpc.update(...)
+                scheduler.mark_sent()
+            except ...:
+                scheduler.mark_failed(payload)  # Queued again for the next take()
+        delay = scheduler.wait_time()   # seconds until take() can succeed, or None
+
+    Payloads are compared without ignore_keys (the elapsed-timer start), and
+    a change is visible when any of visible_keys differs from the last payload
+    sent. Call reset() after reconnecting so the next payload is sent again.
+
+    take() spends a token whether or not the update then succeeds: Discord
+    counts rejected updates against its rate limit too.
+
+    Counters (stats()):
+        sent       payloads Discord accepted (mark_sent())
+        failed     payloads whose update failed or was rejected (mark_failed())
+        coalesced  pending payloads replaced by a newer one before sending
+        dropped    pending payloads discarded because the presence went back
+                   to what Discord already shows
+    """
+
+    def __init__(self, burst: int = UPDATE_BURST, period: float = UPDATE_PERIOD,
+                 visible_keys=("details",), ignore_keys=("start",), clock=time.monotonic):
+        self.burst = burst
+        self.rate = burst / period  # Tokens per second
+        self.visible_keys = tuple(visible_keys)
+        self.ignore_keys = tuple(ignore_keys)
+        self._clock = clock
+        self._tokens = float(burst)
+        self._refilled = clock()
+        self._last_sent = None
+        self._pending = None
+        self._priority = PRIORITY_COSMETIC
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def _key(self, payload: dict) -> dict:
+        return {k: v for k, v in payload.items() if k not in self.ignore_keys}
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _needed(self) -> float:
+        return 1.0 if self._priority == PRIORITY_VISIBLE else 1.0 + COSMETIC_RESERVE
+
+    @property
+    def pending(self) -> dict | None:
+        return self._pending
+
+    def offer(self, payload: dict):
+        """Queue payload as the newest presence (replacing any pending one)."""
+        key = self._key(payload)
+        if self._last_sent is not None and key == self._last_sent:
+            if self._pending is not None:
+                self.dropped += 1  # Change reverted before it was sent
+                self._pending = None
+            return
+        if self._pending is not None:
+            if key == self._key(self._pending):
+                self._pending = payload  # Same presence, fresher timer start
+                return
+            self.coalesced += 1
+        self._pending = payload
+        if self._last_sent is None or any(key.get(k) != self._last_sent.get(k) for k in self.visible_keys):
+            self._priority = PRIORITY_VISIBLE
+        else:
+            self._priority = PRIORITY_COSMETIC
+
+    def take(self) -> dict | None:
+        """Return the pending payload if the rate limit allows sending it now."""
+        if self._pending is None:
+            return None
+        self._refill()
+        if self._tokens < self._needed():
+            return None
+        self._tokens -= 1.0
+        payload, self._pending = self._pending, None
+        self._last_sent = self._key(payload)
+        return payload
+
+    def mark_sent(self):
+        """The payload from the last take() reached Discord."""
+        self.sent += 1
+
+    def mark_failed(self, payload: dict):
+        """The update with payload (from take()) failed: Discord may not show
+        it, so it is queued again unless a newer payload is already pending."""
+        self.failed += 1
+        self._last_sent = None
+        if self._pending is None:
+            self._pending = payload
+            self._priority = PRIORITY_VISIBLE
+
+    def wait_time(self) -> float | None:
+        """Seconds until take() can return the pending payload (None if nothing pending)."""
+        if self._pending is None:
+            return None
+        self._refill()
+        return max(0.0, (self._needed() - self._tokens) / self.rate)
+
+    def reset(self):
+        """Forget what Discord shows (new connection); the rate limit carries over."""
+        self._last_sent = None
+        self._pending = None
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "failed": self.failed, "coalesced": self.coalesced, "dropped": self.dropped}
@@ -0,0 +1,278 @@
+"""
+Binary state segment for Discord Rich Presence.
+The daemon publishes its in-memory state into a fixed-layout, memory-mapped
+file (state.seg) that other processes read without locks or JSON parsing.
+Writes happen in place under a seqlock: the sequence number is odd while a
+write is in progress, and a reader retries until it sees the same even
+number before and after copying the payload.
+
+The segment only mirrors what state.json + the journal already hold; it is
+never the source of truth, and readers fall back to read_state() when it is
+missing, stale or cannot represent the current state.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+from state import DATA_DIR, STATUSLINE_KEYS, TOTAL_KEYS
+
+SEGMENT_FILE = DATA_DIR / "state.seg"
+
+# ═══════════════════════════════════════════════════════════════
+# Layout
+# ═══════════════════════════════════════════════════════════════
+#
+#   header   magic, version, flags, sequence, writer pid
+#   payload  present-key bitmask, integer-valued bitmask,
+#            numbers (as doubles), fixed string slots (length + UTF-8)
+#
+# Only the presence view is published, not the per-session records.
+
+SEGMENT_MAGIC = b"KRPC"
+SEGMENT_VERSION = 2
+FLAG_LIVE = 0x1  # Writer is publishing; cleared when it exits
+
+_HEADER = struct.Struct("<4sHHQI4x")
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+_FLAGS = struct.Struct("<H")
+_FLAGS_OFFSET = 6
+
+# Numeric state keys, then the keys of the numeric sub-dicts (stored as "<dict>.<key>")
+NUMBER_KEYS = (
+    "session_start", "last_update", "statusline_update", "duration_ms",
+    "lines_added", "lines_removed", "context_pct", "context_size",
+)
+TOKEN_KEYS = ("input", "output", "cache_read", "cache_write", "cost")
+DICT_KEYS = {"tokens": TOKEN_KEYS, "totals": TOTAL_KEYS}
+STRING_KEYS = (
+    "project", "project_path", "git_branch", "tool", "file",
+    "session_id", "model", "model_id", "agent_name",
+)
+STRING_SLOT = 512  # Bytes per string slot, including its 2-byte length
+STRING_MAX = STRING_SLOT - 2
+
+_NUMBER_FIELDS = NUMBER_KEYS + tuple(f"{name}.{key}" for name, keys in DICT_KEYS.items() for key in keys)
+_FIELDS = _NUMBER_FIELDS + STRING_KEYS
+_DICT_BITS = {name: 1 << (len(_FIELDS) + i) for i, name in enumerate(DICT_KEYS)}  # Dict present (possibly empty)
+_MASKS = struct.Struct("<QQ")
+_NUMBERS = struct.Struct(f"<{len(_NUMBER_FIELDS)}d")
+_STRING_LEN = struct.Struct("<H")
+
+PAYLOAD_SIZE = _MASKS.size + _NUMBERS.size + len(STRING_KEYS) * STRING_SLOT
+SEGMENT_SIZE = _HEADER.size + PAYLOAD_SIZE
+
+# Every key the segment can carry - anything else makes a state unrepresentable.
+# Per-session records are not published: the segment is the presence view.
+SEGMENT_KEYS = frozenset(NUMBER_KEYS + STRING_KEYS + tuple(DICT_KEYS))
+assert set(STATUSLINE_KEYS) <= SEGMENT_KEYS
+
+
+# ═══════════════════════════════════════════════════════════════
+# JSON Schema Conversion
+# ═══════════════════════════════════════════════════════════════
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and abs(value) < 2 ** 53
+
+
+def encode_state(state: dict) -> bytes | None:
+    """Encode a state dict (minus its "sessions" records) as a segment payload,
+    or None if it does not fit the layout (unknown key, wrong type, string
+    longer than its slot)."""
+    if not SEGMENT_KEYS.issuperset(key for key in state if key != "sessions"):
+        return None
+    values = [state.get(key) for key in NUMBER_KEYS]
+    keys_present = [key in state for key in NUMBER_KEYS]
+    present = 0
+    for name, keys in DICT_KEYS.items():
+        sub = state.get(name, {})
+        if not isinstance(sub, dict) or not set(keys).issuperset(sub):
+            return None
+        if name in state:
+            present |= _DICT_BITS[name]
+        values += [sub.get(key) for key in keys]
+        keys_present += [key in sub for key in keys]
+
+    integral = 0
+    numbers = []
+    for bit, (value, is_present) in enumerate(zip(values, keys_present)):
+        if not is_present:
+            numbers.append(0.0)
+            continue
+        if not _is_number(value):
+            return None
+        present |= 1 << bit
+        if isinstance(value, int):
+            integral |= 1 << bit
+        numbers.append(float(value))
+
+    strings = []
+    for i, key in enumerate(STRING_KEYS, start=len(numbers)):
+        value = state.get(key)
+        if key not in state:
+            strings.append(_STRING_LEN.pack(0).ljust(STRING_SLOT, b"\0"))
+            continue
+        if not isinstance(value, str):
+            return None
+        data = value.encode("utf-8")
+        if len(data) > STRING_MAX:
+            return None
+        present |= 1 << i
+        strings.append((_STRING_LEN.pack(len(data)) + data).ljust(STRING_SLOT, b"\0"))
+
+    return _MASKS.pack(present, integral) + _NUMBERS.pack(*numbers) + b"".join(strings)
+
+
+def decode_state(payload: bytes) -> dict:
+    """Decode a segment payload back into the JSON state schema (the view)."""
+    present, integral = _MASKS.unpack_from(payload, 0)
+    numbers = _NUMBERS.unpack_from(payload, _MASKS.size)
+    state = {}
+    subs = {name: {} for name in DICT_KEYS}
+    for bit, value in enumerate(numbers):
+        if not present & (1 << bit):
+            continue
+        if integral & (1 << bit):
+            value = int(value)
+        field = _NUMBER_FIELDS[bit]
+        if bit < len(NUMBER_KEYS):
+            state[field] = value
+        else:
+            name, key = field.split(".", 1)
+            subs[name][key] = value
+    for name, sub in subs.items():
+        if present & _DICT_BITS[name]:
+            state[name] = sub
+
+    offset = _MASKS.size + _NUMBERS.size
+    for i, key in enumerate(STRING_KEYS, start=len(numbers)):
+        if present & (1 << i):
+            (length,) = _STRING_LEN.unpack_from(payload, offset)
+            start = offset + _STRING_LEN.size
+            state[key] = payload[start:start + min(length, STRING_MAX)].decode("utf-8", errors="replace")
+        offset += STRING_SLOT
+    return state
+
+
+# ═══════════════════════════════════════════════════════════════
+# Writer
+# ═══════════════════════════════════════════════════════════════
+
+class SegmentWriter:
+    """
+    Single-writer side of the segment (the daemon).
+
+    Usage:
+        writer = SegmentWriter()
+        if writer.open():
+            writer.publish(state)   # After every state change
+        writer.close()              # Marks the segment stale for readers
+
+    A state the layout cannot hold clears FLAG_LIVE, so readers fall back to
+    JSON until the next publish that fits.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or SEGMENT_FILE
+        self._map = None
+        self._payload = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._map is not None
+
+    def open(self) -> bool:
+        # Build the file aside and swap it in, so readers never map a short file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0, 0, os.getpid()))
+                f.write(b"\0" * PAYLOAD_SIZE)
+            os.replace(tmp_path, self.path)
+            with open(self.path, "r+b") as f:
+                self._map = mmap.mmap(f.fileno(), SEGMENT_SIZE)
+        except (OSError, ValueError):
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _set_live(self, live: bool):
+        (flags,) = _FLAGS.unpack_from(self._map, _FLAGS_OFFSET)
+        flags = flags | FLAG_LIVE if live else flags & ~FLAG_LIVE
+        _FLAGS.pack_into(self._map, _FLAGS_OFFSET, flags)
+
+    def publish(self, state: dict) -> bool:
+        """Write state in place. Returns False if it cannot be represented."""
+        if self._map is None:
+            return False
+        payload = encode_state(state)
+        if payload is None:
+            self._set_live(False)
+            self._payload = None
+            return False
+        if payload == self._payload:
+            self._set_live(True)
+            return True  # Unchanged - readers already see it
+        (seq,) = _SEQ.unpack_from(self._map, _SEQ_OFFSET)
+        _SEQ.pack_into(self._map, _SEQ_OFFSET, seq + 1)  # Odd: write in progress
+        self._map[_HEADER.size:SEGMENT_SIZE] = payload
+        _SEQ.pack_into(self._map, _SEQ_OFFSET, seq + 2)
+        self._set_live(True)
+        self._payload = payload
+        return True
+
+    def close(self):
+        if self._map is None:
+            return
+        try:
+            self._set_live(False)
+            self._map.close()
+        except (OSError, ValueError):
+            pass
+        self._map = None
+        self._payload = None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Reader
+# ═══════════════════════════════════════════════════════════════
+
+READ_RETRIES = 100
+
+
+def read_segment(writer_pid: int | None = None, path=None) -> dict | None:
+    """
+    Read the published state without locking.
+
+    Returns None when there is no live segment, it was written by a process
+    other than writer_pid (pass the daemon PID), or no consistent copy could
+    be taken - callers then read the JSON state instead.
+    """
+    try:
+        with open(path or SEGMENT_FILE, "rb") as f:
+            segment = mmap.mmap(f.fileno(), SEGMENT_SIZE, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None  # Missing or short file
+    try:
+        for _ in range(READ_RETRIES):
+            magic, version, flags, seq, pid = _HEADER.unpack_from(segment, 0)
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+                return None
+            if not flags & FLAG_LIVE or (writer_pid is not None and pid != writer_pid):
+                return None
+            if seq & 1:
+                time.sleep(0)  # Writer mid-update, let it finish
+                continue
+            payload = segment[_HEADER.size:SEGMENT_SIZE]
+            if _SEQ.unpack_from(segment, _SEQ_OFFSET)[0] == seq:
+                return decode_state(payload)
+        return None
+    finally:
+        segment.close()
@@ -3,13 +3,15 @@ Shared state management for Discord Rich Presence.
 Provides process-safe state file operations with cross-platform file locking.
 """
 
+import _thread
 import json
 import os
 import sys
-import tempfile
 import time
 from pathlib import Path
 
+from metrics import observe
+
 # Platform-specific imports for file locking
 if sys.platform == "win32":
     import msvcrt
@@ -31,6 +33,21 @@ else:
 
 STATE_FILE = DATA_DIR / "state.json"
 LOCK_FILE = DATA_DIR / "state.lock"
+JOURNAL_FILE = DATA_DIR / "state.journal"
+JOURNAL_OLD_FILE = DATA_DIR / "state.journal.old"  # Only exists mid-compaction
+
+# Logs, stats, history and statusline digests: files that never carry state
+# for the daemon. The daemon watches DATA_DIR with inotify, which reports
+# every file in the directory, so these live one level down where their
+# writes do not wake it.
+OUTPUT_DIR = DATA_DIR / "output"
+
+# Event journal (append-only, see "Event Journal" below). Windows appends are
+# not atomic across processes, so Windows keeps the locked rewrite path.
+JOURNAL_AVAILABLE = sys.platform != "win32"
+JOURNAL_RECORD_MAX = 4096  # One O_APPEND write per record stays atomic below this
+JOURNAL_COMPACT_SIZE = 256 * 1024  # Writers compact past this when no daemon does
+JOURNAL_MARKER_KEY = "_journal"  # state.json key recording the journal position it covers
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -55,6 +72,168 @@ def format_tokens(count: int) -> str:
 # File Locking
 # ═══════════════════════════════════════════════════════════════
 
+# One lock fd per lock file, opened once per process and reused; the
+# in-process lock serializes threads, since flock() treats every thread
+# sharing an fd as the same owner.
+_lock_handles = {}  # path -> [pid, fd, thread lock]
+_lock_handles_guard = _thread.allocate_lock()
+
+# Per-caller counters, see lock_stats()
+_lock_stats = {}
+
+# Helper threads left blocked in flock() by waiters that timed out. Each holds
+# a thread and an fd until the lock comes free; past the cap, waiters poll
+# instead, so a holder that never releases cannot leak them without bound.
+LOCK_HELPERS_MAX = 4
+_abandoned_helpers = 0
+_abandoned_helpers_guard = _thread.allocate_lock()
+
+
+def _lock_handle(path: Path) -> list:
+    with _lock_handles_guard:
+        handle = _lock_handles.get(path)
+        if handle is None or handle[0] != os.getpid():
+            # First use in this process (an inherited fd after fork() would share
+            # the parent's lock ownership, so it is never reused)
+            handle = [os.getpid(), -1, _thread.allocate_lock()]
+            _lock_handles[path] = handle
+        return handle
+
+
+def _drop_fd(handle: list):
+    """Close a handle's fd (next acquisition reopens the lock file)."""
+    if handle[1] >= 0:
+        try:
+            os.close(handle[1])
+        except OSError as close_err:
+            _log_stderr(f"FD close failed for lock file: {close_err}")
+        handle[1] = -1
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        if sys.platform == "win32":
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd: int):
+    if sys.platform == "win32":
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _lock_polling(handle: list, timeout: float) -> bool:
+    """Retry a non-blocking lock with backoff (1ms doubling to 10ms) until timeout."""
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        if _try_lock(handle[1]):
+            return True
+        delay = min(delay * 2, 0.01)
+
+
+def _lock_blocking(handle: list, timeout: float) -> bool:
+    """
+    Wait in the kernel for the lock, giving up after timeout seconds.
+
+    flock() has no timeout, so a helper thread makes the blocking call while
+    this thread waits on it with one. Waiters are woken as soon as the holder
+    releases instead of on their next poll, so no caller is starved by
+    unlucky retry timing. A waiter that gives up hands the fd over to the
+    helper, which releases and closes it if the lock arrives later. Once
+    LOCK_HELPERS_MAX helpers are stranded that way, callers poll instead.
+    """
+    global _abandoned_helpers
+    if sys.platform == "win32":
+        # msvcrt has no usable blocking mode (LK_LOCK retries 10 times, 1s apart)
+        return _lock_polling(handle, timeout)
+    with _abandoned_helpers_guard:
+        if _abandoned_helpers >= LOCK_HELPERS_MAX:
+            return _lock_polling(handle, timeout)
+
+    fd = handle[1]
+    guard = _thread.allocate_lock()
+    done = _thread.allocate_lock()
+    done.acquire()
+    result = {"acquired": False, "finished": False, "abandoned": False}
+
+    def wait_for_lock():
+        global _abandoned_helpers
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            locked = True
+        except OSError:
+            locked = False
+        with guard:
+            result["acquired"] = locked
+            result["finished"] = True
+            if result["abandoned"]:
+                try:
+                    if locked:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                finally:
+                    os.close(fd)
+                    with _abandoned_helpers_guard:
+                        _abandoned_helpers -= 1
+        done.release()
+
+    try:
+        _thread.start_new_thread(wait_for_lock, ())
+    except RuntimeError:
+        return _lock_polling(handle, timeout)  # Can't start new thread
+    done.acquire(timeout=timeout)
+    with guard:
+        if result["finished"]:
+            return result["acquired"]
+        result["abandoned"] = True
+        with _abandoned_helpers_guard:
+            _abandoned_helpers += 1
+    handle[1] = -1  # Now owned by the helper
+    return False
+
+
+def _record_wait(caller: str, wait: float, acquired: bool, contended: bool):
+    stats = _lock_stats.get(caller)
+    if stats is None:
+        stats = _lock_stats[caller] = {
+            "acquired": 0, "contended": 0, "timeouts": 0,
+            "wait_total": 0.0, "wait_max": 0.0, "hold_total": 0.0, "hold_max": 0.0,
+        }
+    stats["acquired" if acquired else "timeouts"] += 1
+    stats["contended"] += contended
+    stats["wait_total"] += wait
+    stats["wait_max"] = max(stats["wait_max"], wait)
+    observe("lock_wait_seconds", wait)
+
+
+def lock_stats() -> dict:
+    """
+    Lock counters for this process, keyed by caller (the function that
+    created the StateLock, or its caller= argument):
+
+        acquired    successful acquisitions
+        contended   acquisitions that had to wait for another holder
+        timeouts    acquisitions that gave up (TimeoutError)
+        wait_total, wait_max   seconds spent waiting to acquire
+        hold_total, hold_max   seconds between acquire and release
+    """
+    return {caller: dict(stats) for caller, stats in _lock_stats.items()}
+
+
+def reset_lock_stats():
+    _lock_stats.clear()
+
+
 class StateLock:
     """
     Cross-platform file lock for state operations.
@@ -70,85 +249,100 @@ class StateLock:
     that acquire their own locks — prefer _unlocked variants with explicit
     StateLock for multi-step operations.
 
+    An uncontended acquisition is one non-blocking flock() on an fd kept open
+    for the life of the process. Under contention the caller blocks in the
+    kernel and is woken when the holder releases, rather than polling.
+    Not reentrant: nesting two StateLocks on the same file times out.
+
     Args:
         timeout: Max seconds to wait for lock acquisition.
         lock_file: Path to lock file. Defaults to state.lock.
                    Pass a different path for independent locks (e.g., sessions.lock).
+        caller: Name to record wait/hold times under (see lock_stats()).
+                Defaults to the function creating the lock.
     """
 
-    def __init__(self, timeout: float = 5.0, lock_file: Path | None = None):
+    def __init__(self, timeout: float = 5.0, lock_file: Path | None = None, caller: str | None = None):
         self.timeout = timeout
         self._lock_file = lock_file or LOCK_FILE
-        self._lock_fd = None
+        self._handle = None
+        self._acquired_at = 0.0
+        self.caller = caller or sys._getframe(1).f_code.co_name
 
     def __enter__(self):
         try:
             DATA_DIR.mkdir(parents=True, exist_ok=True)
         except OSError as e:
             raise OSError(f"Cannot create data directory for lock file: {e}") from e
-        start = time.time()
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        contended = False
 
-        while True:
-            try:
-                # Open lock file (create if doesn't exist)
-                self._lock_fd = os.open(str(self._lock_file), os.O_CREAT | os.O_RDWR)
-
-                if sys.platform == "win32":
-                    # Windows: lock first byte exclusively
-                    msvcrt.locking(self._lock_fd, msvcrt.LK_NBLCK, 1)
-                else:
-                    # Unix: exclusive non-blocking lock
-                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        handle = _lock_handle(self._lock_file)
+        # Threads of this process queue here first
+        if not handle[2].acquire(False):
+            contended = True
+            if not handle[2].acquire(timeout=max(0.0, self.timeout)):
+                _record_wait(self.caller, time.perf_counter() - start, False, True)
+                raise TimeoutError(f"Could not acquire state lock within {self.timeout}s")
 
-                return self
-
-            except (OSError, IOError):
-                # Lock acquisition failed, close and retry
-                if self._lock_fd is not None:
-                    try:
-                        os.close(self._lock_fd)
-                    except OSError as close_err:
-                        try:
-                            print(f"[state] Warning: FD close failed during lock retry: {close_err}", file=sys.stderr)
-                        except (ValueError, OSError, TypeError):
-                            pass
-                    self._lock_fd = None
+        try:
+            while True:
+                if handle[1] < 0:
+                    handle[1] = os.open(str(self._lock_file), os.O_CREAT | os.O_RDWR)
+                if not _try_lock(handle[1]):
+                    contended = True
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or not _lock_blocking(handle, remaining):
+                        raise TimeoutError(f"Could not acquire state lock within {self.timeout}s")
+                # Locked - unless the lock file was deleted and recreated meanwhile,
+                # in which case other processes are locking a different inode
+                if sys.platform == "win32" or self._same_file(handle[1]):
+                    break
+                try:
+                    _unlock(handle[1])
+                except OSError:
+                    pass
+                _drop_fd(handle)
+        except BaseException:
+            handle[2].release()
+            _record_wait(self.caller, time.perf_counter() - start, False, contended)
+            raise
 
-                if time.time() - start > self.timeout:
-                    raise TimeoutError(f"Could not acquire state lock within {self.timeout}s")
+        self._handle = handle
+        self._acquired_at = time.perf_counter()
+        _record_wait(self.caller, self._acquired_at - start, True, contended)
+        return self
 
-                time.sleep(0.01)  # 10ms retry interval
+    def _same_file(self, fd: int) -> bool:
+        try:
+            return os.fstat(fd).st_ino == os.stat(self._lock_file).st_ino
+        except OSError:
+            return False
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._lock_fd is not None:
+        handle, self._handle = self._handle, None
+        if handle is None:
+            return False
+        hold = time.perf_counter() - self._acquired_at
+        stats = _lock_stats[self.caller]
+        stats["hold_total"] += hold
+        stats["hold_max"] = max(stats["hold_max"], hold)
+        try:
+            _unlock(handle[1])
+        except OSError as e:
+            # Log unlock failures - can cause future lock timeouts
+            # Write to stderr AND a log file (stderr may be closed in daemon)
+            _log_stderr(f"Failed to unlock {self._lock_file}: {e}")
             try:
-                if sys.platform == "win32":
-                    msvcrt.locking(self._lock_fd, msvcrt.LK_UNLCK, 1)
-                else:
-                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
-            except (OSError, IOError) as e:
-                # Log unlock failures - can cause future lock timeouts
-                # Write to stderr AND a log file (stderr may be closed in daemon)
-                try:
-                    if sys.stderr and not sys.stderr.closed:
-                        print(f"[state] Warning: Failed to unlock {self._lock_file}: {e}", file=sys.stderr)
-                except (ValueError, OSError, TypeError):
-                    pass  # stderr unavailable (closed in daemon context)
-                try:
-                    err_file = DATA_DIR / "lock_error.log"
-                    with open(err_file, "a", encoding="utf-8") as f:
-                        f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Unlock failed for {self._lock_file}: {e}\n")
-                except OSError:
-                    pass
-            finally:
-                try:
-                    os.close(self._lock_fd)
-                except OSError as close_err:
-                    try:
-                        print(f"[state] Warning: FD close failed during unlock: {close_err}", file=sys.stderr)
-                    except (ValueError, OSError, TypeError):
-                        pass
-                self._lock_fd = None
+                err_file = DATA_DIR / "lock_error.log"
+                with open(err_file, "a", encoding="utf-8") as f:
+                    f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Unlock failed for {self._lock_file}: {e}\n")
+            except OSError:
+                pass
+            _drop_fd(handle)  # Closing the fd releases the lock
+        finally:
+            handle[2].release()
         return False
 
 
@@ -156,42 +350,96 @@ class StateLock:
 # State Read/Write (Low-level, no locking)
 # ═══════════════════════════════════════════════════════════════
 
+def _log_stderr(message: str):
+    """Print a warning to stderr, tolerating closed/invalid stderr (daemon context)."""
+    try:
+        if sys.stderr and not sys.stderr.closed:
+            print(f"[state] Warning: {message}", file=sys.stderr)
+    except (ValueError, OSError, TypeError):
+        pass
+
+
+def _read_snapshot() -> tuple[dict, dict | None]:
+    """Read state.json. Returns (state, journal marker) with the marker stripped from state."""
+    try:
+        state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}, None  # No state file yet, not an error
+    except (json.JSONDecodeError, OSError, UnicodeDecodeError) as e:
+        # Log corruption to stderr - this is critical for debugging
+        _log_stderr(f"State file corrupt or unreadable: {e}")
+        return {}, None
+    if not isinstance(state, dict):
+        return {}, None
+    marker = state.pop(JOURNAL_MARKER_KEY, None)
+    return state, marker if isinstance(marker, dict) else None
+
+
+def _read_state_positioned() -> tuple[dict, dict | None]:
+    """Read state.json and fold the journal on top of it.
+
+    Returns (state, position) where position is the journal marker a snapshot
+    of this state should carry (see write_state_unlocked). With sharded state
+    this is the merged shards and no position.
+    """
+    if sharded():
+        return merge_shards(read_shards()), None
+    state, marker = _read_snapshot()
+    marker_id = marker.get("id") if marker else None
+
+    old = _load_journal(JOURNAL_OLD_FILE)
+    live = _load_journal(JOURNAL_FILE)
+
+    # A snapshot taken against the live journal already covers the old one
+    # (every such write read the old journal first); a snapshot taken against
+    # the old journal covers it up to the marker offset; anything else is newer.
+    live_journal_id = live[0] if live else None
+    journals = []
+    if old and marker_id != live_journal_id:
+        start = marker.get("offset", 0) if marker_id == old[0] else old[2]
+        journals.append((old, start))
+    if live:
+        start = marker.get("offset", 0) if marker_id == live[0] else live[2]
+        journals.append((live, start))
+
+    position = marker
+    for (journal_id, data, _header_end), start in journals:
+        events, end = _parse_records(data, start)
+        for event in events:
+            state = apply_event(state, event)
+        position = {"id": journal_id, "offset": end}
+    return state, position
+
+
 def read_state_unlocked() -> dict:
     """
-    Read current state from state file without locking.
+    Read current state (state.json plus the event journal) without locking.
     Use read_state() or wrap with StateLock for safe access.
 
     Returns empty dict if file doesn't exist or is corrupt.
     Logs to stderr on corruption since this is a low-level function
     that may be called before presence.py logging is available.
     """
-    try:
-        return json.loads(STATE_FILE.read_text(encoding="utf-8"))
-    except FileNotFoundError:
-        return {}  # No state file yet, not an error
-    except (json.JSONDecodeError, OSError, UnicodeDecodeError) as e:
-        # Log corruption to stderr - this is critical for debugging
-        try:
-            if sys.stderr and not sys.stderr.closed:
-                print(f"[state] Warning: State file corrupt or unreadable: {e}", file=sys.stderr)
-        except (ValueError, OSError, TypeError):
-            pass
-    return {}
+    state, _ = _read_state_positioned()
+    return state
 
 
 def atomic_write_json(target: Path, data: dict, indent: int | None = None):
     """Write JSON data to file atomically using temp file + os.replace.
 
     Shared by write_state_unlocked and presence.py's _write_sessions_unlocked.
+    The temp file is created next to target, so writes to OUTPUT_DIR stay there.
     Raises OSError on write failure. Logs orphaned temp files to stderr.
     """
+    directory = target.parent
     try:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        directory.mkdir(parents=True, exist_ok=True)
     except OSError as e:
-        raise OSError(f"Cannot create data directory {DATA_DIR}: {e}") from e
+        raise OSError(f"Cannot create data directory {directory}: {e}") from e
     content = json.dumps(data, indent=indent)
 
-    fd, tmp_path = tempfile.mkstemp(dir=DATA_DIR, suffix='.tmp')
+    import tempfile  # Lazy: keeps the PreToolUse hook's import set minimal
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
     try:
         with os.fdopen(fd, 'w', encoding='utf-8') as f:
             f.write(content)
@@ -201,21 +449,27 @@ def atomic_write_json(target: Path, data: dict, indent: int | None = None):
         try:
             os.unlink(tmp_path)
         except OSError as cleanup_err:
-            try:
-                print(f"[state] Warning: Orphaned temp file {tmp_path}: {cleanup_err}", file=sys.stderr)
-            except (ValueError, OSError, TypeError):
-                pass
+            _log_stderr(f"Orphaned temp file {tmp_path}: {cleanup_err}")
         raise
 
 
-def write_state_unlocked(state: dict):
+def write_state_unlocked(state: dict, position: dict | None = None):
     """
     Write state to state file using atomic write pattern (no locking).
     Use write_state() or wrap with StateLock for safe access.
 
+    The snapshot records how much of the journal it already contains. Pass
+    the position from a read to keep events journaled since that read; by
+    default the write supersedes everything journaled so far.
+
     Raises OSError if data directory cannot be created or write fails.
     """
-    atomic_write_json(STATE_FILE, state, indent=2)
+    if position is None:
+        position = _journal_end()
+    snapshot = dict(state)
+    if position:
+        snapshot[JOURNAL_MARKER_KEY] = position
+    atomic_write_json(STATE_FILE, snapshot, indent=2)
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -232,6 +486,8 @@ def read_state(logger=None) -> dict | None:
     Returns:
         State dict on success (may be empty {}), or None on lock/read error
     """
+    if sharded():
+        return read_state_unlocked()  # Shards are replaced atomically, no lock needed
     try:
         with StateLock():
             return read_state_unlocked()
@@ -253,6 +509,9 @@ def write_state(state: dict, logger=None) -> bool:
         True if write succeeded, False on error
     """
     try:
+        if sharded():
+            _update_sharded(state, replace=True)
+            return True
         with StateLock():
             write_state_unlocked(state)
         return True
@@ -265,7 +524,8 @@ def write_state(state: dict, logger=None) -> bool:
 def update_state(updates: dict, logger=None) -> dict | None:
     """
     Atomically update state with locking (read-modify-write).
-    Only updates specified keys, preserving other state.
+    Only updates specified keys, preserving other state. Keys of a session
+    record are updated in the active session's record too.
 
     Args:
         updates: Dict of key-value pairs to update
@@ -275,10 +535,12 @@ def update_state(updates: dict, logger=None) -> dict | None:
         Updated state dict on success, or None on lock/write error
     """
     try:
+        if sharded():
+            return _update_sharded(updates)
         with StateLock():
-            state = read_state_unlocked()
-            state.update(updates)
-            write_state_unlocked(state)
+            state, position = _read_state_positioned()
+            update_active_session(state, updates)
+            write_state_unlocked(state, position)
             return state
     except (OSError, TimeoutError) as e:
         if logger:
@@ -286,6 +548,30 @@ def update_state(updates: dict, logger=None) -> dict | None:
         return None
 
 
+def apply_events_locked(events: list, logger=None) -> dict | None:
+    """
+    Fold events into state.json with a locked read-modify-write.
+
+    Fallback for when the journal is unavailable (Windows, oversized record,
+    unwritable journal). Without a journal at all (Windows) each event goes
+    to its shard under that shard's lock instead. Returns the updated state,
+    or None on lock/write error.
+    """
+    try:
+        if sharded():
+            return _apply_events_sharded(events)
+        with StateLock():
+            state, position = _read_state_positioned()
+            for event in events:
+                state = apply_event(state, event)
+            write_state_unlocked(state, position)
+            return state
+    except (OSError, TimeoutError) as e:
+        if logger:
+            logger(f"Warning: Could not apply {len(events)} state event(s): {e}")
+        return None
+
+
 def clear_state(logger=None):
     """
     Clear state file with locking.
@@ -294,6 +580,9 @@ def clear_state(logger=None):
         logger: Optional logging function for warnings
     """
     try:
+        if sharded():
+            _update_sharded({}, replace=True)
+            return
         with StateLock():
             write_state_unlocked({})
     except (OSError, TimeoutError) as e:
@@ -301,3 +590,781 @@ def clear_state(logger=None):
             logger(f"Warning: Could not clear state: {e}")
 
 
+# ═══════════════════════════════════════════════════════════════
+# Event Journal
+# ═══════════════════════════════════════════════════════════════
+#
+# Writers append one JSON record per line with O_APPEND, which needs no lock
+# for records this small. The first line of each journal file is a header
+# carrying a unique journal id, so snapshot markers survive inode reuse.
+# Writers never create the journal themselves: the journal is created and
+# swapped out under StateLock, and a writer that finds it missing waits for
+# the lock once and creates it.
+
+def _new_journal_id() -> str:
+    return f"{time.time_ns():x}-{os.getpid()}"
+
+
+def _load_journal(path: Path) -> tuple[str, bytes, int] | None:
+    """Read a journal file. Returns (journal id, content, header end) or None if missing."""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        _log_stderr(f"Journal {path.name} unreadable: {e}")
+        return None
+    header_end = data.find(b"\n") + 1
+    try:
+        header = json.loads(data[:header_end]) if header_end else {}
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        header = {}
+    journal_id = header.get("journal") if isinstance(header, dict) else None
+    if journal_id is None:
+        return ("", data, 0)  # Headerless journal - fold from the start
+    return (journal_id, data, header_end)
+
+
+def _parse_records(data: bytes, start: int) -> tuple[list, int]:
+    """Parse complete records from data[start:]. Returns (events, end offset).
+
+    A trailing partial line (append still in flight) is left for the next read.
+    """
+    end = data.rfind(b"\n", start) + 1
+    if end <= start:
+        return [], start
+    events = []
+    for line in data[start:end].splitlines():
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue  # Torn or corrupt record - skip it
+        if isinstance(event, dict) and "op" in event:
+            events.append(event)
+    return events, end
+
+
+def _journal_end() -> dict | None:
+    """Marker for the current end of the live journal (None if there is none)."""
+    journal = _load_journal(JOURNAL_FILE)
+    if journal is None:
+        return None
+    journal_id, data, header_end = journal
+    return {"id": journal_id, "offset": max(header_end, data.rfind(b"\n") + 1)}
+
+
+def _create_journal(path: Path):
+    """Create an empty journal with a fresh header (call under StateLock)."""
+    header = json.dumps({"journal": _new_journal_id()}).encode("utf-8") + b"\n"
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=DATA_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError as cleanup_err:
+            _log_stderr(f"Orphaned temp file {tmp_path}: {cleanup_err}")
+        raise
+
+
+def encode_record(event: dict) -> bytes | None:
+    """Encode an event as one journal line, or None if it is too large to append atomically."""
+    try:
+        record = json.dumps(event, separators=(",", ":")).encode("utf-8") + b"\n"
+    except (TypeError, ValueError):
+        return None
+    return record if len(record) <= JOURNAL_RECORD_MAX else None
+
+
+def append_events(events: list, logger=None) -> bool:
+    """
+    Append events to the journal in a single O_APPEND write (no StateLock).
+
+    Returns False when the journal is unavailable or a record is too large;
+    callers then fall back to apply_events_locked().
+    """
+    if not events:
+        return True
+    if not JOURNAL_AVAILABLE:
+        return False
+    records = [encode_record(event) for event in events]
+    if any(record is None for record in records):
+        return False
+    data = b"".join(records)
+
+    try:
+        try:
+            fd = os.open(str(JOURNAL_FILE), os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            # First write (or mid-compaction): create under the lock
+            with StateLock():
+                if not JOURNAL_FILE.exists():
+                    _create_journal(JOURNAL_FILE)
+                fd = os.open(str(JOURNAL_FILE), os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, data)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+    except (OSError, TimeoutError) as e:
+        if logger:
+            logger(f"Warning: Could not append to state journal: {e}")
+        return False
+
+    if size > JOURNAL_COMPACT_SIZE:
+        # Nobody else is compacting (no daemon) - do it here, but never wait for it
+        compact_journal(timeout=0.05, logger=logger)
+    return True
+
+
+def append_event(event: dict, logger=None) -> bool:
+    """Append a single event to the journal. See append_events()."""
+    return append_events([event], logger)
+
+
+def compact_journal(timeout: float = 1.0, logger=None) -> bool:
+    """
+    Fold the journal into state.json and start a fresh journal.
+
+    Runs under StateLock; writers that find no journal mid-swap wait for the
+    lock. Returns True if the journal was compacted.
+    """
+    if not JOURNAL_AVAILABLE:
+        return False
+    try:
+        with StateLock(timeout=timeout):
+            if not JOURNAL_FILE.exists():
+                return False
+            # 1. Snapshot everything so far (this also absorbs a leftover old journal)
+            state, position = _read_state_positioned()
+            write_state_unlocked(state, position)
+            try:
+                os.unlink(JOURNAL_OLD_FILE)
+            except FileNotFoundError:
+                pass
+
+            # 2. Swap in a fresh journal
+            os.replace(JOURNAL_FILE, JOURNAL_OLD_FILE)
+            _create_journal(JOURNAL_FILE)
+
+            # 3. Fold records that landed in the old journal after step 1 (and
+            #    any already in the new one), then drop the old journal
+            state, position = _read_state_positioned()
+            write_state_unlocked(state, position)
+            os.unlink(JOURNAL_OLD_FILE)
+            return True
+    except (OSError, TimeoutError) as e:
+        if logger:
+            logger(f"Warning: Could not compact state journal: {e}")
+        return False
+
+
+class StateFollower:
+    """
+    Incremental reader of state.json + journal for the daemon.
+
+    Keeps the folded state in memory and only reads bytes appended to the
+    journal since the last refresh; state.json is reparsed (under StateLock)
+    only when it was rewritten (compaction, clear, locked fallback writes).
+    With sharded state, only shards whose file changed are reread and the
+    cached shards are merged again. A refresh where no file moved (see
+    state_signature()) costs a few stat() calls and opens nothing.
+
+    Usage:
+        follower = StateFollower()
+        if follower.refresh(log):
+            state = follower.state
+    """
+
+    def __init__(self):
+        self.state = {}
+        self._snapshot_sig = None
+        self._journal_id = None
+        self._offset = 0
+        self._shards = {}  # name -> (file signature, shard)
+        self._signature = None  # state_signature() taken before the last read
+        self.reads = 0  # Refreshes that had to read a file
+        self.skipped = 0  # Refreshes short-circuited because nothing moved
+
+    def _refresh_shards(self) -> bool:
+        changed = False
+        for name in SHARDS:
+            sig = _file_signature(shard_file(name))
+            cached = self._shards.get(name)
+            if cached and cached[0] == sig:
+                continue
+            shard = _read_shard(name)
+            if cached and cached[1] == shard:
+                self._shards[name] = (sig, cached[1])
+                continue  # Same generation rewritten or touched
+            self._shards[name] = (sig, shard)
+            changed = True
+        if changed:
+            self.state = merge_shards({name: shard for name, (_, shard) in self._shards.items()})
+        return changed
+
+    def _reload(self, logger=None) -> bool:
+        try:
+            with StateLock():
+                sig = _file_signature(STATE_FILE)
+                state, position = _read_state_positioned()
+        except (OSError, TimeoutError) as e:
+            if logger:
+                logger(f"Warning: Could not read state: {e}")
+            self._signature = None  # Retry on the next refresh
+            return False
+        self.state = state
+        self._snapshot_sig = sig
+        live = _journal_end()
+        if position and live and position.get("id") == live["id"]:
+            self._journal_id = position["id"]
+            self._offset = position.get("offset", 0)
+        else:
+            # No live journal yet - the next refresh reloads once one appears
+            self._journal_id = None
+            self._offset = 0
+        return True
+
+    def refresh(self, logger=None) -> bool:
+        """Bring the in-memory state up to date. Returns True if anything was read."""
+        # Taken before reading: a write landing mid-read changes it for next time
+        signature = state_signature()
+        if signature == self._signature:
+            self.skipped += 1
+            return False
+        self._signature = signature
+        self.reads += 1
+        if sharded():
+            return self._refresh_shards()
+        if _file_signature(STATE_FILE) != self._snapshot_sig:
+            return self._reload(logger)
+
+        try:
+            with open(JOURNAL_FILE, "rb") as f:
+                header = f.readline()
+                try:
+                    journal_id = json.loads(header).get("journal")
+                except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                    journal_id = None
+                if journal_id != self._journal_id:
+                    return self._reload(logger)
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return False  # Mid-swap or not created yet - state.json is current
+        except OSError as e:
+            if logger:
+                logger(f"Warning: Could not read state journal: {e}")
+            self._signature = None
+            return False
+
+        events, end = _parse_records(data, 0)
+        self._offset += end
+        for event in events:
+            self.state = apply_event(self.state, event)
+        return bool(events)
+
+    @property
+    def journal_size(self) -> int:
+        return self._offset
+
+    def stats(self) -> dict:
+        return {"reads": self.reads, "skipped": self.skipped}
+
+
+def _file_signature(path: Path) -> tuple | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def state_signature() -> tuple:
+    """
+    Cheap "has state changed" check: (inode, size, mtime_ns) of every file
+    state is read from. Equal signatures mean nothing was written in between -
+    snapshots and shards are replaced (new inode) and journal appends grow
+    the file.
+    """
+    if sharded():
+        return tuple(_file_signature(shard_file(name)) for name in SHARDS)
+    return (_file_signature(STATE_FILE), _file_signature(JOURNAL_FILE), _file_signature(JOURNAL_OLD_FILE))
+
+
+# ═══════════════════════════════════════════════════════════════
+# Statusline Write Elision
+# ═══════════════════════════════════════════════════════════════
+#
+# The statusline refreshes far more often than its data changes. Each
+# session's statusline keeps a digest of the last event it delivered in
+# statusline.<session_id>.digest and skips delivery when the new event
+# matches; the file's mtime doubles as the statusline heartbeat, bumped with
+# utime() instead of a rewrite.
+
+STATUSLINE_DIGEST_FILE = OUTPUT_DIR / "statusline.digest"  # Events without a session_id
+
+# Deliver an unchanged event anyway after this long (catches up after a
+# daemon or session restart that missed the invalidation below)
+STATUSLINE_RESEND_INTERVAL = 60
+
+
+# Fields that change on every refresh without changing what is displayed: the
+# daemon derives the elapsed timer from duration_ms once, and a newer value
+# rides along with the next real change (or the periodic resend)
+STATUSLINE_VOLATILE_KEYS = ("ts", "duration_ms")
+
+
+def statusline_digest_file(session_id: str = "") -> Path:
+    """Digest file of one session's statusline."""
+    name = "".join(c for c in session_id if c.isalnum() or c in "-_")[:64]
+    return OUTPUT_DIR / f"statusline.{name}.digest" if name else STATUSLINE_DIGEST_FILE
+
+
+def statusline_digest(event: dict) -> str:
+    """Digest of a statusline event, ignoring STATUSLINE_VOLATILE_KEYS."""
+    import zlib  # Lazy: only the statusline needs it
+    payload = json.dumps({k: v for k, v in event.items() if k not in STATUSLINE_VOLATILE_KEYS},
+                         sort_keys=True, separators=(",", ":"))
+    data = payload.encode("utf-8")
+    return f"{zlib.crc32(data):08x}{len(data):x}"
+
+
+def statusline_unchanged(digest: str, now: float | None = None, session_id: str = "") -> bool:
+    """True if digest matches the session's last delivered event and that delivery is recent."""
+    try:
+        content = statusline_digest_file(session_id).read_text(encoding="utf-8").split()
+    except (OSError, UnicodeDecodeError):
+        return False
+    if len(content) != 2 or content[0] != digest:
+        return False
+    try:
+        sent = float(content[1])
+    except ValueError:
+        return False
+    return (now or time.time()) - sent < STATUSLINE_RESEND_INTERVAL
+
+
+def record_statusline(digest: str, now: float | None = None, session_id: str = ""):
+    """Remember digest as delivered (also counts as a heartbeat)."""
+    try:
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        statusline_digest_file(session_id).write_text(f"{digest} {int(now or time.time())}\n", encoding="utf-8")
+    except OSError as e:
+        _log_stderr(f"Could not record statusline digest: {e}")
+
+
+def touch_statusline_heartbeat(session_id: str = ""):
+    """Mark a statusline refresh that delivered nothing (mtime only)."""
+    try:
+        os.utime(statusline_digest_file(session_id))
+    except OSError:
+        pass  # Next delivery recreates it
+
+
+def _digest_files() -> list:
+    try:
+        return list(OUTPUT_DIR.glob("statusline*.digest"))
+    except OSError:
+        return []
+
+
+def statusline_heartbeat() -> float | None:
+    """Time of the last statusline refresh in any session, or None if unknown."""
+    times = []
+    for path in _digest_files():
+        try:
+            times.append(os.stat(path).st_mtime)
+        except OSError:
+            continue
+    return max(times, default=None)
+
+
+def forget_statusline_digest(session_id: str | None = None):
+    """Make the next statusline refresh deliver its event (state was reset).
+    None forgets every session's digest."""
+    paths = _digest_files() if session_id is None else [statusline_digest_file(session_id)]
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _log_stderr(f"Could not remove statusline digest: {e}")
+
+
+# ═══════════════════════════════════════════════════════════════
+# Session Records
+# ═══════════════════════════════════════════════════════════════
+#
+# Every session has its own record in state["sessions"], keyed by the
+# session_id its hooks and statusline send, so concurrent sessions never
+# overwrite each other's tool, file or tokens. The top level of the state is
+# the presence view:
+#
+#   <VIEW_KEYS>   copy of the most recently active session's record
+#                 (the last one to start or run a tool)
+#   session_id    that session's id
+#   totals        token counts and cost summed over all sessions
+#   sessions      {session_id: record}; records also keep the session's pid
+#
+# An event touches only its own record, the view when its session is (or
+# becomes) the active one, and the totals by the change in its tokens - so
+# the cost of an event does not grow with the number of sessions. Only
+# ending the active session looks through the others for a successor.
+
+# Keys copied verbatim from statusline events
+STATUSLINE_KEYS = (
+    "model", "model_id", "tokens", "duration_ms", "lines_added",
+    "lines_removed", "context_pct", "context_size", "agent_name",
+)
+
+VIEW_KEYS = (
+    "session_start", "project", "project_path", "git_branch", "tool", "file",
+    "last_update", "statusline_update",
+) + STATUSLINE_KEYS
+
+TOTAL_KEYS = ("input", "output", "cache_read", "cache_write", "cost")
+
+
+def _token_count(tokens, key: str):
+    value = tokens.get(key, 0) if isinstance(tokens, dict) else 0
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def _add_totals(state: dict, old_tokens, new_tokens):
+    """Move state["totals"] by the difference between two token dicts."""
+    totals = state.setdefault("totals", {})
+    for key in TOTAL_KEYS:
+        total = totals.get(key, 0) + _token_count(new_tokens, key) - _token_count(old_tokens, key)
+        totals[key] = round(total, 6) if isinstance(total, float) else total
+
+
+def _show_session(state: dict, session_id: str):
+    """Make session_id the active session: copy its record into the view."""
+    record = state["sessions"][session_id]
+    state["session_id"] = session_id
+    for key in VIEW_KEYS:
+        if key in record:
+            value = record[key]
+            state[key] = dict(value) if isinstance(value, dict) else value
+        else:
+            state.pop(key, None)
+
+
+def _sessions(state: dict) -> dict:
+    """state["sessions"], converting a state written before session records."""
+    sessions = state.get("sessions")
+    if isinstance(sessions, dict):
+        return sessions
+    sessions = {}
+    if state:
+        sessions[state.get("session_id", "")] = {key: state[key] for key in VIEW_KEYS if key in state}
+    state["sessions"] = sessions
+    state["totals"] = {}
+    _add_totals(state, None, state.get("tokens"))
+    return sessions
+
+
+def rebuild_view(state: dict) -> dict:
+    """Recompute the view and totals from the session records (after a merge)."""
+    sessions = _sessions(state)
+    if not sessions:
+        return {}
+    state["totals"] = {}
+    for record in sessions.values():
+        _add_totals(state, None, record.get("tokens"))
+    _show_session(state, max(sessions, key=lambda sid: sessions[sid].get("last_update", 0)))
+    return state
+
+
+def update_active_session(state: dict, updates: dict):
+    """Set keys directly (update_state()): in the view, and in the active
+    session's record for the keys a record holds."""
+    record = _sessions(state).setdefault(state.get("session_id", ""), {})
+    old_tokens = record.get("tokens")
+    record.update((key, value) for key, value in updates.items() if key in VIEW_KEYS)
+    _add_totals(state, old_tokens, record.get("tokens"))
+    state.update(updates)
+
+
+# ═══════════════════════════════════════════════════════════════
+# State Events
+# ═══════════════════════════════════════════════════════════════
+
+def apply_event(state: dict, event: dict) -> dict:
+    """
+    Fold one event into a state dict and return the resulting state.
+
+    The single definition of what each event does: the journal replay, the
+    daemon's in-memory state and the locked fallback path all go through it,
+    so they agree on the resulting state for the same event stream.
+
+    Events name their session with "session_id"; events without one (older
+    hooks) belong to the active session.
+
+    Event ops:
+        start:      {"op": "start", "ts", "fresh", "project", "project_path",
+                     "git_branch", "session_id", "pid"} - fresh replaces the whole
+                     state; otherwise the session gets a record if it has none,
+                     or only missing project info is filled in. The session
+                     becomes the active one
+        update:     {"op": "update", "ts", "tool", ["file"]} - ignored without an
+                     active session; "file" is only set when present. The
+                     session becomes the active one
+        statusline: {"op": "statusline", "ts", <STATUSLINE_KEYS>, "project",
+                     "project_path", "git_branch"} - ignored without a session
+        end:        {"op": "end", "session_id" or "pid"} - drops one session's
+                     record; the most recently active remaining session
+                     becomes the active one
+        stop:       {"op": "stop"} - clears the state
+    """
+    op = event.get("op")
+    if op == "stop" or (not state and op != "start"):
+        return {}  # Everything but a start is ignored without a session
+    if op == "start" and event.get("fresh"):
+        state = {}
+    sessions = _sessions(state)
+    session_id = event.get("session_id") or state.get("session_id", "")
+    ts = event.get("ts", 0)
+
+    if op == "start":
+        record = sessions.get(session_id)
+        if record is None:
+            record = sessions[session_id] = {
+                "session_start": ts,
+                "project": event.get("project", ""),
+                "project_path": event.get("project_path", ""),
+                "git_branch": event.get("git_branch", ""),
+                "tool": "",
+            }
+        elif not record.get("project"):
+            record["project"] = event.get("project", "")
+            record["project_path"] = event.get("project_path", "")
+            record["git_branch"] = event.get("git_branch", "")
+        if "pid" in event:
+            record["pid"] = event["pid"]
+        record["last_update"] = ts
+        _show_session(state, session_id)
+
+    elif op == "update":
+        record = sessions.setdefault(session_id, {"session_start": ts})
+        record["tool"] = event.get("tool", "")
+        record["last_update"] = ts
+        if "file" in event:
+            record["file"] = event["file"]
+        _show_session(state, session_id)
+
+    elif op == "statusline":
+        record = sessions.setdefault(session_id, {"session_start": ts, "last_update": ts})
+        old_tokens = record.get("tokens")
+        for key in STATUSLINE_KEYS:
+            if key in event:
+                record[key] = event[key]
+        project_path = event.get("project_path")
+        if project_path:
+            # Only update project name when the session's project changes.
+            # Preserves the git remote name from cmd_start.
+            if record.get("project_path") != project_path:
+                record["project"] = event.get("project", "")
+                record["project_path"] = project_path
+            if event.get("git_branch"):
+                record["git_branch"] = event["git_branch"]
+        record["statusline_update"] = ts
+        _add_totals(state, old_tokens, record.get("tokens"))
+        if session_id == state.get("session_id"):
+            _show_session(state, session_id)
+
+    elif op == "end":
+        if "pid" in event:
+            session_id = next((sid for sid, record in sessions.items() if record.get("pid") == event["pid"]), None)
+        record = sessions.pop(session_id, None)
+        if record is None:
+            return state
+        if not sessions:
+            return {}
+        _add_totals(state, record.get("tokens"), None)
+        if session_id == state.get("session_id"):
+            _show_session(state, max(sessions, key=lambda sid: sessions[sid].get("last_update", 0)))
+
+    return state
+
+
+# ═══════════════════════════════════════════════════════════════
+# Sharded State
+# ═══════════════════════════════════════════════════════════════
+#
+# Without the journal (Windows), state lives in one file per writer instead
+# of a single state.json, each with its own lock, so the statusline, hooks
+# and session start/stop never wait for each other:
+#
+#   state.session.json     start/stop: session, project, branch, timer start
+#   state.statusline.json  statusline: model, tokens, context, lines, ...
+#   state.hook.json        update: tool, file, last_update
+#
+# The session shard holds the whole state as of its last write; the others
+# hold only their keys of each session record, which the merge lays over it.
+# Each shard is {"gen": n, "epoch": e, "state": {...}}. gen counts writes to
+# the shard. epoch is the session shard's gen at the last fresh start or
+# stop; statusline/hook shards record the epoch they were written in, and a
+# shard from an older epoch (a previous session) is left out of the merge.
+
+SHARDS = ("session", "statusline", "hook")  # Merge order: later shards win
+
+# Keys of each session record a shard contributes (the session shard holds everything else)
+SHARD_KEYS = {
+    "statusline": STATUSLINE_KEYS + ("statusline_update", "project", "project_path", "git_branch"),
+    "hook": ("tool", "file", "last_update"),
+}
+
+_EMPTY_SHARD = {"gen": 0, "epoch": 0, "state": {}}
+
+
+def sharded() -> bool:
+    """True when state lives in shards (no event journal on this platform)."""
+    return not JOURNAL_AVAILABLE
+
+
+def shard_file(name: str) -> Path:
+    return DATA_DIR / f"state.{name}.json"
+
+
+def shard_lock_file(name: str) -> Path:
+    return DATA_DIR / f"state.{name}.lock"
+
+
+def _shard_for(event: dict) -> str:
+    op = event.get("op")
+    if op == "update":
+        return "hook"
+    if op == "statusline":
+        return "statusline"
+    return "session"  # start, stop
+
+
+def _read_shard(name: str) -> dict:
+    try:
+        shard = json.loads(shard_file(name).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return _EMPTY_SHARD
+    except (json.JSONDecodeError, OSError, UnicodeDecodeError) as e:
+        _log_stderr(f"State shard {name} corrupt or unreadable: {e}")
+        return _EMPTY_SHARD
+    if not isinstance(shard, dict) or not isinstance(shard.get("state"), dict):
+        return _EMPTY_SHARD
+    return shard
+
+
+def read_shards() -> dict:
+    """Read every shard (no locking - shards are replaced atomically)."""
+    return {name: _read_shard(name) for name in SHARDS}
+
+
+def merge_shards(shards: dict) -> dict:
+    """Merge shards into one state dict (the same view apply_event produces)."""
+    session = shards.get("session") or _EMPTY_SHARD
+    state = dict(session["state"])
+    if not state:
+        return state  # No session - statusline/hook shards are leftovers
+    sessions = {sid: dict(record) for sid, record in _sessions(state).items()}
+    state["sessions"] = sessions
+    for name in SHARDS[1:]:
+        shard = shards.get(name) or _EMPTY_SHARD
+        parts = shard["state"].get("sessions")
+        if not isinstance(parts, dict) or shard.get("epoch") != session.get("epoch"):
+            continue
+        # Only sessions the session shard knows about (it records start/end),
+        # and not a part left from an earlier run of the same session id
+        for session_id, part in parts.items():
+            record = sessions.get(session_id)
+            if record is None or not isinstance(part, dict) or part.get("session_start") != record.get("session_start"):
+                continue
+            for key, value in part.items():
+                if key == "last_update":
+                    record[key] = max(record.get(key, 0), value)
+                else:
+                    record[key] = value
+    return rebuild_view(state)
+
+
+def _write_shard(name: str, shards: dict, state: dict, reset: bool = False):
+    """Write name's part of state as its next generation (call under its shard lock).
+
+    reset (session shard only) starts a new epoch, retiring the other shards.
+    """
+    gen = shards[name].get("gen", 0) + 1
+    if name == "session":
+        epoch = gen if reset else shards["session"].get("epoch", 0)
+        part = state
+    else:
+        epoch = shards["session"].get("epoch", 0)
+        # session_start tags which run of the session the keys belong to
+        part = {"sessions": {
+            session_id: {key: record[key] for key in SHARD_KEYS[name] + ("session_start",) if key in record}
+            for session_id, record in state.get("sessions", {}).items()
+        }}
+    shards[name] = {"gen": gen, "epoch": epoch, "state": part}
+    atomic_write_json(shard_file(name), shards[name])
+
+
+def _apply_events_sharded(events: list) -> dict:
+    """Fold events into their shards, locking one shard at a time."""
+    shards = None
+    i = 0
+    while i < len(events):
+        # Consecutive events for the same shard share one write
+        name = _shard_for(events[i])
+        j = i
+        while j < len(events) and _shard_for(events[j]) == name:
+            j += 1
+        with StateLock(lock_file=shard_lock_file(name), caller=f"{name} shard"):
+            shards = read_shards()
+            state = merge_shards(shards)
+            reset = False
+            for event in events[i:j]:
+                state = apply_event(state, event)
+                reset = reset or event.get("op") == "stop" or bool(event.get("op") == "start" and event.get("fresh"))
+            _write_shard(name, shards, state, reset)
+        i = j
+    return merge_shards(shards or read_shards())
+
+
+def _update_sharded(updates: dict, replace: bool = False) -> dict:
+    """update_state()/write_state() for shards: each key is written to the shard that owns it."""
+    if replace:
+        # Whole new state: a new session epoch, the other shards are retired
+        with StateLock(lock_file=shard_lock_file("session"), caller="session shard"):
+            shards = read_shards()
+            _write_shard("session", shards, dict(updates), reset=True)
+        return merge_shards(shards)
+
+    owners = {}
+    for key in updates:
+        owner = next((name for name, keys in SHARD_KEYS.items() if key in keys), "session")
+        owners.setdefault(owner, {})[key] = updates[key]
+    for name in SHARDS:
+        if name not in owners:
+            continue
+        with StateLock(lock_file=shard_lock_file(name), caller=f"{name} shard"):
+            # Only the own shard and the session epoch matter here
+            shards = {"session": _read_shard("session")}
+            if name != "session":
+                shards[name] = _read_shard(name)
+            own = shards[name]
+            state = dict(own["state"]) if own.get("epoch") == shards["session"].get("epoch") else {}
+            if name == "session":
+                update_active_session(state, owners[name])
+            else:
+                # Shard keys belong to the active session's record
+                sessions = {sid: dict(record) for sid, record in state.get("sessions", {}).items()}
+                view = shards["session"]["state"]
+                record = sessions.setdefault(view.get("session_id", ""), {})
+                record.update(owners[name], session_start=view.get("session_start"))
+                state = {"sessions": sessions}
+            _write_shard(name, shards, state)
+    return read_state_unlocked()
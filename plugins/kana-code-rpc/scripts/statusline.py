@@ -4,8 +4,9 @@ Claude Code Statusline with Discord RPC Integration
 
 Displays a breadcrumb-style status bar (inspired by macOS Finder path bar)
 showing model, tokens, cost, and git branch.
-Also updates state.json to provide token/cost, duration, lines changed,
-agent name, and context data to the Discord RPC daemon.
+Also feeds token/cost, duration, lines changed, agent name, and context data
+to the Discord RPC daemon (ingest socket, or the state journal when no daemon
+is running).
 
 Setup in ~/.claude/settings.json (use appropriate path for your OS):
 {
@@ -18,11 +19,24 @@ Setup in ~/.claude/settings.json (use appropriate path for your OS):
 import json
 import sys
 import os
-from pathlib import Path
 import time as _time  # used for statusline_update timestamp
 
-# Shared state management (provides process-safe file locking and utilities)
-from state import StateLock, read_state_unlocked, write_state_unlocked, format_tokens
+# Shared state management (provides lock-free event delivery and utilities)
+from state import (
+    format_tokens,
+    statusline_digest,
+    statusline_unchanged,
+    record_statusline,
+    touch_statusline_heartbeat,
+)
+from ingest import submit_event
+from gitinfo import get_project_info, get_git_branch as resolve_git_branch
+from jsonstream import read_json_fields
+from recording import record_payload
+from toolstats import format_latency, read_tool_hint
+
+# The parts of the statusline payload main() reads
+STATUSLINE_FIELDS = (("model",), ("cost",), ("context_window",), ("workspace",), ("agent",), ("session_id",))
 
 # Fix Windows console encoding for Unicode characters
 if sys.platform == "win32":
@@ -86,19 +100,9 @@ def create_progress_bar(percent: float, width: int = 10) -> str:
 
 
 def get_git_branch(cwd: str) -> str | None:
-    """Get current git branch via git rev-parse (handles worktrees and detached HEAD)."""
-    try:
-        import subprocess
-        result = subprocess.run(
-            ["git", "-C", cwd, "rev-parse", "--abbrev-ref", "HEAD"],
-            capture_output=True, text=True, timeout=2
-        )
-        if result.returncode == 0:
-            branch = result.stdout.strip()
-            return branch if branch != "HEAD" else None  # Detached HEAD
-    except (FileNotFoundError, subprocess.TimeoutExpired, OSError):
-        pass
-    return None
+    """Get current git branch from .git/HEAD (handles worktrees and detached HEAD)."""
+    branch = resolve_git_branch(cwd, timeout=2)
+    return branch if branch and branch != "HEAD" else None  # Detached HEAD
 
 
 def truncate(s: str, max_len: int) -> str:
@@ -114,23 +118,24 @@ def truncate(s: str, max_len: int) -> str:
 # ═══════════════════════════════════════════════════════════════
 
 def main():
-    # Read JSON from stdin using os.read() to avoid blocking on EOF.
-    # os.read() returns immediately when pipe data is available, while
-    # sys.stdin.read()/json.load() wait for pipe closure which may hang.
+    # Read only the fields used below, stopping as soon as the JSON object
+    # is complete - sys.stdin.read()/json.load() wait for pipe closure,
+    # which may hang.
     try:
         if sys.stdin is None:
             print("")
             return
-        raw = os.read(sys.stdin.fileno(), 262144)
-        if not raw:
+        data = read_json_fields(STATUSLINE_FIELDS)
+        if not data:
             print("")
             return
-        data = json.loads(raw.decode("utf-8", errors="replace"))
     except (json.JSONDecodeError, ValueError, UnicodeDecodeError, OSError) as e:
         print(f"[statusline] Error reading input: {e}", file=sys.stderr)
         print(f"{C.RED}[statusline error]{C.RESET}")
         return
 
+    record_payload("statusline", data)
+
     # Extract data
     model_info = data.get("model") or {}
     model = model_info.get("display_name", "")
@@ -160,39 +165,45 @@ def main():
     agent_info = data.get("agent", {}) or {}
     agent_name = agent_info.get("name", "")
 
-    # Update state.json for Discord RPC (with file locking to prevent race conditions)
-    try:
-        with StateLock(timeout=1.0):  # Short timeout since statusline runs frequently
-            state = read_state_unlocked()
-            if state.get("session_start"):  # Only update if session exists
-                state["model"] = model
-                state["model_id"] = model_id
-                state["tokens"] = {
-                    "input": total_input,
-                    "output": total_output,
-                    "cache_read": cache_read,
-                    "cache_write": cache_write,
-                    "cost": cost,
-                }
-                state["duration_ms"] = duration_ms
-                state["lines_added"] = lines_added
-                state["lines_removed"] = lines_removed
-                state["context_pct"] = used_percent or 0
-                state["context_size"] = context_size
-                state["agent_name"] = agent_name
-                if project_dir:
-                    # Only update project name when active project changes (multi-session switch).
-                    # Preserves git remote name from cmd_start for single session.
-                    if state.get("project_path") != project_dir:
-                        state["project"] = Path(project_dir).name
-                        state["project_path"] = project_dir
-                    if git_branch:
-                        state["git_branch"] = git_branch
-                state["statusline_update"] = int(_time.time())
-                write_state_unlocked(state)
-    except (OSError, TimeoutError) as e:
+    # Feed state for Discord RPC: daemon socket or journal append, no state lock
+    # (ignored until a session has started, see state.apply_event)
+    event = {
+        "op": "statusline",
+        "ts": int(_time.time()),
+        "model": model,
+        "model_id": model_id,
+        "tokens": {
+            "input": total_input,
+            "output": total_output,
+            "cache_read": cache_read,
+            "cache_write": cache_write,
+            "cost": cost,
+        },
+        "duration_ms": duration_ms,
+        "lines_added": lines_added,
+        "lines_removed": lines_removed,
+        "context_pct": used_percent or 0,
+        "context_size": context_size,
+        "agent_name": agent_name,
+    }
+    session_id = data.get("session_id") or ""
+    if session_id:
+        event["session_id"] = session_id
+    if project_dir:
+        # Same repo name cmd_start reports (projects.json lookup, no git fork)
+        event["project"] = get_project_info(project_dir, timeout=2)["name"]
+        event["project_path"] = project_dir
+        if git_branch:
+            event["git_branch"] = git_branch
+    # Most refreshes repeat this session's last event - deliver only what changed
+    digest = statusline_digest(event)
+    if statusline_unchanged(digest, session_id=session_id):
+        touch_statusline_heartbeat(session_id)
+    elif submit_event(event):
+        record_statusline(digest, session_id=session_id)
+    else:
         # Don't fail statusline display if state update fails
-        print(f"[statusline] Warning: Could not update state: {e}", file=sys.stderr)
+        print("[statusline] Warning: Could not update state", file=sys.stderr)
 
     # ─────────────────────────────────────────────────────────────
     # Build Apple Finder Path Bar Statusline
@@ -221,6 +232,11 @@ def main():
         cost_str = format_cost(cost)
         parts.append(f"{C.GREEN}{cost_str}{C.RESET}")
 
+    # Slowest tool this session (p95), once the daemon has timed a slow one
+    hint = read_tool_hint(session_id) if session_id else None
+    if hint:
+        parts.append(f"{C.ORANGE}slowest {hint['tool']} {format_latency(hint['p95_ms'])}{C.RESET}")
+
     # Git branch (subtle, at the end)
     if git_branch:
         branch_display = truncate(git_branch, 16)
@@ -0,0 +1,352 @@
+"""
+Session timelines for Discord Rich Presence.
+The daemon notes every hook event it receives - tool calls from the
+PreToolUse/PostToolUse hooks, context, tokens and cost from the statusline -
+in a bounded ring, and appends the ring to one JSONL file per session in
+DATA_DIR/traces every few seconds. A full ring drops its oldest records and
+a session's file is rotated once it grows past TRACE_FILE_MAX, so neither
+memory nor disk use grows with the length of a session.
+
+`presence.py trace export <session_id>` turns a session's file into Chrome
+trace-event JSON for Perfetto (ui.perfetto.dev) or chrome://tracing: one
+track per agent, a span per tool call, and counter tracks for context,
+tokens and cost.
+
+Trace file records, one JSON object per line ("t" is epoch seconds):
+    {"k": "session", "t", "project", "branch", "start"}  session start, or a
+                                                         new project/branch
+    {"k": "b", "t", "tool", "id", "agent", ["file"]}    tool started
+    {"k": "e", "t", "tool", "id"}                        tool finished
+    {"k": "c", "t", "context_pct", "tokens": {...}, "cost"}
+"""
+
+import json
+import os
+import time
+from collections import deque
+from pathlib import Path
+
+from state import DATA_DIR
+from metrics import count
+
+TRACE_DIR = DATA_DIR / "traces"
+
+TRACE_RING_MAX = 4096  # Records buffered in the daemon; the oldest go first when full
+TRACE_FLUSH_INTERVAL = 5  # Seconds between appends to the trace files
+TRACE_FLUSH_COUNT = 1024  # Flush early once this many records are waiting
+TRACE_FILE_MAX = 4 * 1024 * 1024  # Rotate a session's file to .1 beyond this
+TRACE_FILES_MAX = 20  # Sessions whose traces are kept, oldest removed first
+SESSIONS_MAX = 32  # Per-session counter/agent state kept, least recently used dropped first
+
+COUNTER_TOKEN_KEYS = ("input", "output", "cache_read", "cache_write")
+
+
+def trace_file(session_id: str) -> Path:
+    """A session's trace file (the id is sanitized like the digest files)."""
+    name = "".join(c for c in session_id if c.isalnum() or c in "-_")[:64]
+    return TRACE_DIR / f"{name or 'default'}.jsonl"
+
+
+# ═══════════════════════════════════════════════════════════════
+# Recorder (daemon)
+# ═══════════════════════════════════════════════════════════════
+
+class TraceRecorder:
+    """
+    Turns hook events into trace records and streams them to disk.
+
+    Usage (daemon, on every batch drained from the ingest socket):
+        tracer = TraceRecorder()
+        for event in drained:
+            tracer.observe(event)
+        if tracer.should_flush():
+            tracer.flush(log)
+        ...
+        tracer.flush(log)                      # On shutdown
+
+    The asyncio daemon splits a flush: take() on the event loop, write() in
+    a worker thread, restore() of the failed records back on the loop.
+
+    Events without a session_id (hooks older than session records) are not
+    traced.
+    """
+
+    def __init__(self):
+        self.ring = deque(maxlen=TRACE_RING_MAX)  # (session_id, record), oldest first
+        self.sessions = {}  # session_id -> {"agent", "counters", "place"}, least recently used first
+        self.last_flush = time.time()
+
+    def _session(self, session_id: str) -> dict:
+        info = self.sessions.pop(session_id, None) or {"agent": "", "counters": None, "place": None}
+        self.sessions[session_id] = info  # Most recently used last
+        while len(self.sessions) > SESSIONS_MAX:
+            del self.sessions[next(iter(self.sessions))]
+        return info
+
+    def _add(self, session_id: str, record: dict):
+        if len(self.ring) == self.ring.maxlen:
+            count("trace_records_dropped_total")
+        self.ring.append((session_id, record))
+
+    def _place(self, session_id: str, info: dict, event: dict, t: float, start: bool):
+        """Record the session's project and branch when they are new."""
+        place = (event.get("project", ""), event.get("git_branch", ""))
+        if start or (place[0] and place != info["place"]):
+            info["place"] = place
+            self._add(session_id, {"k": "session", "t": t, "project": place[0], "branch": place[1],
+                                   "start": start})
+
+    def observe(self, event: dict, now: float | None = None):
+        """Note one hook event. Tool events carry the hook's own time ("t");
+        everything else is stamped with the time it arrived."""
+        session_id = event.get("session_id")
+        if not session_id:
+            return
+        op = event.get("op")
+        now = round(now or time.time(), 3)
+        t = event.get("t") if isinstance(event.get("t"), (int, float)) else now
+
+        if op == "update":
+            record = {"k": "b", "t": t, "tool": event.get("tool", ""), "id": event.get("tool_use_id", ""),
+                      "agent": self._session(session_id)["agent"]}
+            if event.get("file"):
+                record["file"] = event["file"]
+            self._add(session_id, record)
+        elif op == "done":
+            self._add(session_id, {"k": "e", "t": t, "tool": event.get("tool", ""),
+                                   "id": event.get("tool_use_id", "")})
+        elif op == "statusline":
+            info = self._session(session_id)
+            info["agent"] = event.get("agent_name") or ""
+            self._place(session_id, info, event, t, start=False)
+            tokens = event.get("tokens") if isinstance(event.get("tokens"), dict) else {}
+            counters = (event.get("context_pct", 0),
+                        tuple(tokens.get(key, 0) for key in COUNTER_TOKEN_KEYS),
+                        tokens.get("cost", 0))
+            if counters != info["counters"]:
+                info["counters"] = counters
+                self._add(session_id, {"k": "c", "t": t, "context_pct": counters[0],
+                                       "tokens": dict(zip(COUNTER_TOKEN_KEYS, counters[1])),
+                                       "cost": counters[2]})
+        elif op == "start":
+            self._place(session_id, self._session(session_id), event, t, start=True)
+        elif op == "end":
+            self.sessions.pop(session_id, None)
+
+    def should_flush(self, now: float | None = None) -> bool:
+        return bool(self.ring) and (len(self.ring) >= TRACE_FLUSH_COUNT
+                                    or (now or time.time()) - self.last_flush >= TRACE_FLUSH_INTERVAL)
+
+    def flush(self, logger=None) -> bool:
+        """Append the buffered records to their sessions' trace files.
+
+        Records whose file cannot be written stay in the ring for the next
+        flush (until the ring overflows). Returns False if any write failed.
+        """
+        failed = self.write(self.take(), logger)
+        self.restore(failed)
+        return not failed
+
+    def take(self) -> dict:
+        """Empty the ring into {session_id: [record, ...]}, oldest first."""
+        self.last_flush = time.time()
+        batches = {}
+        while self.ring:
+            session_id, record = self.ring.popleft()
+            batches.setdefault(session_id, []).append(record)
+        return batches
+
+    def restore(self, failed: list):
+        """Put (session_id, record) pairs that write() could not store back
+        in the ring, ahead of anything recorded since take()."""
+        if failed:
+            self.ring.extendleft(reversed(failed))  # Oldest first again, before anything newer
+
+    def write(self, batches: dict, logger=None) -> list:
+        """Append take()'s batches to the trace files. Touches only the files,
+        so it may run in a worker thread. Returns the (session_id, record)
+        pairs that could not be written."""
+        new_files = False
+        failed = []
+        for session_id, records in batches.items():
+            path = trace_file(session_id)
+            data = "".join(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+                           for record in records).encode("utf-8")
+            try:
+                TRACE_DIR.mkdir(parents=True, exist_ok=True)
+                try:
+                    size = os.stat(path).st_size
+                except FileNotFoundError:
+                    size = 0
+                    new_files = True
+                if size and size + len(data) > TRACE_FILE_MAX:
+                    os.replace(path, path.with_suffix(".jsonl.1"))
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                if logger:
+                    logger(f"Warning: Could not write trace file {path.name}: {e}")
+                failed.extend((session_id, record) for record in records)
+        if new_files:
+            prune_traces(logger)
+        return failed
+
+
+def prune_traces(logger=None):
+    """Remove the traces of all but the TRACE_FILES_MAX most recent sessions."""
+    try:
+        paths = sorted(TRACE_DIR.glob("*.jsonl"), key=lambda p: p.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for path in paths[TRACE_FILES_MAX:]:
+        for old in (path, path.with_suffix(".jsonl.1")):
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                if logger:
+                    logger(f"Warning: Could not remove old trace {old.name}: {e}")
+
+
+# ═══════════════════════════════════════════════════════════════
+# Export
+# ═══════════════════════════════════════════════════════════════
+
+def list_traces() -> list[tuple[str, float]]:
+    """[(session_id, last written)] of the sessions with a trace, newest first."""
+    traces = []
+    try:
+        for path in TRACE_DIR.glob("*.jsonl"):
+            traces.append((path.stem, path.stat().st_mtime))
+    except OSError:
+        pass
+    traces.sort(key=lambda trace: trace[1], reverse=True)
+    return traces
+
+
+def find_trace(session_id: str) -> str | None:
+    """The traced session named by session_id or a unique prefix of it."""
+    names = [name for name, _ in list_traces()]
+    if session_id in names:
+        return session_id
+    matches = [name for name in names if name.startswith(session_id)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def read_trace(session_id: str) -> list[dict]:
+    """A session's trace records, oldest first (rotated file included).
+    Torn or unknown lines are skipped."""
+    path = trace_file(session_id)
+    records = []
+    for part in (path.with_suffix(".jsonl.1"), path):
+        try:
+            with open(part, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(record, dict) and isinstance(record.get("t"), (int, float)) and "k" in record:
+                        records.append(record)
+        except FileNotFoundError:
+            continue
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def _us(t: float) -> int:
+    return int(round(t * 1_000_000))
+
+
+def chrome_trace(session_id: str, records: list[dict]) -> dict:
+    """Chrome trace-event JSON (object format) for one session's records.
+
+    The session is one process; each agent gets a thread ("main" for the
+    top-level agent), with extra lanes ("main #2") only where tool calls
+    running in parallel overlap. A PreToolUse without its PostToolUse
+    becomes an instant event.
+    """
+    # Pair tool starts and ends by tool_use_id
+    spans = []  # (start, end or None, agent, tool, file)
+    open_spans = {}
+    for record in records:
+        kind = record["k"]
+        if kind == "b":
+            span = [record["t"], None, record.get("agent") or "main", record.get("tool", ""), record.get("file", "")]
+            spans.append(span)
+            if record.get("id"):
+                open_spans[record["id"]] = span
+        elif kind == "e":
+            span = open_spans.pop(record.get("id"), None)
+            if span is not None:
+                span[1] = max(record["t"], span[0])
+
+    # Lay spans out on lanes per agent so no two on a lane overlap
+    threads = {}  # (agent, lane) -> tid
+    lane_ends = {}  # agent -> [end time of each lane's last span]
+    events = []
+    for start, end, agent, tool, filename in sorted(spans, key=lambda span: span[0]):
+        ends = lane_ends.setdefault(agent, [])
+        lane = next((i for i, lane_end in enumerate(ends) if lane_end <= start), len(ends))
+        if lane == len(ends):
+            ends.append(0)
+        ends[lane] = end if end is not None else start
+        tid = threads.setdefault((agent, lane), len(threads) + 1)
+        event = {"name": tool or "tool", "cat": "tool", "pid": 1, "tid": tid, "ts": _us(start)}
+        if filename:
+            event["args"] = {"file": filename}
+        if end is None:
+            event.update(ph="i", s="t")
+        else:
+            event.update(ph="X", dur=_us(end) - _us(start))
+        events.append(event)
+
+    project = ""
+    for record in records:
+        kind = record["k"]
+        if kind == "session":
+            project = project or record.get("project", "")
+            name = "session start" if record.get("start") else f"on {record.get('branch') or 'no branch'}"
+            events.append({"name": name, "cat": "session", "ph": "i", "s": "p", "pid": 1, "tid": 0,
+                           "ts": _us(record["t"]), "args": {"project": record.get("project", ""),
+                                                            "branch": record.get("branch", "")}})
+        elif kind == "c":
+            ts = _us(record["t"])
+            tokens = record.get("tokens") if isinstance(record.get("tokens"), dict) else {}
+            events.append({"name": "context_pct", "ph": "C", "pid": 1, "ts": ts,
+                           "args": {"context_pct": record.get("context_pct", 0)}})
+            events.append({"name": "tokens", "ph": "C", "pid": 1, "ts": ts,
+                           "args": {key: tokens.get(key, 0) for key in COUNTER_TOKEN_KEYS}})
+            events.append({"name": "cost_usd", "ph": "C", "pid": 1, "ts": ts, "args": {"cost": record.get("cost", 0)}})
+
+    title = f"{project} ({session_id})" if project else session_id
+    metadata = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": title}}]
+    for (agent, lane), tid in threads.items():
+        name = agent if lane == 0 else f"{agent} #{lane + 1}"
+        metadata.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+        metadata.append({"name": "thread_sort_index", "ph": "M", "pid": 1, "tid": tid, "args": {"sort_index": tid}})
+    events.sort(key=lambda event: event["ts"])
+    return {"traceEvents": metadata + events, "displayTimeUnit": "ms",
+            "otherData": {"session_id": session_id, "project": project}}
+
+
+def export_trace(session_id: str, output: Path) -> int:
+    """Write session_id's trace to output as Chrome trace JSON. Returns the
+    number of trace records exported."""
+    records = read_trace(session_id)
+    trace = chrome_trace(session_id, records)
+    tmp = output.with_name(f".{output.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        # One event per line keeps large traces diffable and greppable
+        f.write('{"traceEvents":[\n')
+        f.write(",\n".join(json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+                           for event in trace["traceEvents"]))
+        f.write('\n],"displayTimeUnit":"ms","otherData":')
+        f.write(json.dumps(trace["otherData"], ensure_ascii=False))
+        f.write("}\n")
+    os.replace(tmp, output)
+    return len(records)
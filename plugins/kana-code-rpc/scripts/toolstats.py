@@ -0,0 +1,267 @@
+"""
+Per-tool latency for Discord Rich Presence.
+The PreToolUse hook ("update" events) and the PostToolUse hook ("done"
+events) both send the tool_use_id and the time they ran; the daemon pairs
+them by session and tool_use_id and records the difference in a latency
+histogram per tool group, per session and across sessions.
+
+Histograms are HdrHistogram-style: log-linear buckets of millisecond
+values with 16 sub-buckets per power of two, so every value up to about
+4.6 hours is kept within ~6% and a histogram is a fixed 336 counters
+however many samples it holds. Tools are grouped by their TOOL_DISPLAY name
+(e.g. "Bash"), MCP tools by server ("mcp:github"), anything else as "other".
+
+The daemon publishes the histograms in daemon_stats.json for `presence.py
+status`, and each session's slowest tool in tool_hints.json for the
+statusline.
+"""
+
+import json
+import math
+
+from state import OUTPUT_DIR, atomic_write_json
+
+TOOL_HINTS_FILE = OUTPUT_DIR / "tool_hints.json"
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HIST_MAX_MS = (1 << 24) - 1  # ~4.6 hours; slower samples are clamped
+HIST_BUCKETS = SUB_BUCKETS * (HIST_MAX_MS.bit_length() - SUB_BUCKET_BITS + 1)
+
+PENDING_MAX = 512  # Unpaired pre/post events kept (a tool whose PostToolUse never came)
+SESSIONS_MAX = 32  # Per-session histogram sets kept, least recently used dropped first
+HINT_MIN_SAMPLES = 3  # Calls of a tool before it can be the statusline's slowest tool
+HINT_MIN_MS = 1000  # Only slow tools are worth statusline space
+
+
+# ═══════════════════════════════════════════════════════════════
+# Histogram
+# ═══════════════════════════════════════════════════════════════
+
+def _bucket_index(ms: int) -> int:
+    if ms < 2 * SUB_BUCKETS:
+        return ms
+    shift = ms.bit_length() - (SUB_BUCKET_BITS + 1)
+    return SUB_BUCKETS * (shift + 1) + (ms >> shift) - SUB_BUCKETS
+
+
+def _bucket_highest(index: int) -> int:
+    """Largest millisecond value that lands in bucket index."""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    sub = index % SUB_BUCKETS + SUB_BUCKETS
+    return ((sub + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram of latencies in milliseconds."""
+
+    __slots__ = ("counts", "total", "sum_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * HIST_BUCKETS
+        self.total = 0
+        self.sum_ms = 0
+        self.max_ms = 0
+
+    def record(self, ms: float):
+        value = min(HIST_MAX_MS, max(0, round(ms)))
+        self.counts[_bucket_index(value)] += 1
+        self.total += 1
+        self.sum_ms += value
+        self.max_ms = max(self.max_ms, value)
+
+    def quantile(self, q: float) -> int:
+        """Upper bound (ms) of the bucket holding quantile q; 0 when empty."""
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(q * self.total))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_bucket_highest(index), self.max_ms)
+        return self.max_ms
+
+    def to_json(self) -> dict:
+        """Sparse form: {"n", "sum", "max", "c": {bucket index: count}}."""
+        return {"n": self.total, "sum": self.sum_ms, "max": self.max_ms,
+                "c": {str(index): n for index, n in enumerate(self.counts) if n}}
+
+    @classmethod
+    def from_json(cls, data) -> "LatencyHistogram":
+        hist = cls()
+        if not isinstance(data, dict):
+            return hist
+        for index, n in (data.get("c") or {}).items():
+            try:
+                index, n = int(index), int(n)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < HIST_BUCKETS and n > 0:
+                hist.counts[index] += n
+                hist.total += n
+        hist.sum_ms = data.get("sum", 0) if isinstance(data.get("sum"), int) else 0
+        hist.max_ms = data.get("max", 0) if isinstance(data.get("max"), int) else 0
+        return hist
+
+
+def format_latency(ms: int) -> str:
+    """Short human form: 850ms, 4.2s, 3m10s."""
+    if ms < 1000:
+        return f"{ms}ms"
+    if ms < 60_000:
+        return f"{ms / 1000:.1f}s"
+    return f"{ms // 60_000}m{ms % 60_000 // 1000:02d}s"
+
+
+# ═══════════════════════════════════════════════════════════════
+# Pairing (daemon)
+# ═══════════════════════════════════════════════════════════════
+
+def tool_group(tool: str, known=()) -> str:
+    """Histogram group of a tool: its name if known, "mcp:<server>" for
+    MCP tools (mcp__<server>__<tool>), else "other"."""
+    if tool in known:
+        return tool
+    if tool.startswith("mcp__"):
+        server = tool[5:].split("__", 1)[0]
+        return f"mcp:{server}" if server else "mcp"
+    return "other"
+
+
+class ToolLatency:
+    """
+    Pairs PreToolUse/PostToolUse events and keeps the latency histograms.
+
+    Usage (daemon, on every batch drained from the ingest socket):
+        tools = ToolLatency(TOOL_DISPLAY)
+        events = [e for e in drained if not tools.observe(e)]   # "done" events are consumed
+        ...
+        stats["tools"] = tools.snapshot()
+        if tools.changed:
+            tools.write_hints()
+
+    Either event may arrive first - both hooks run asynchronously.
+    """
+
+    def __init__(self, known_tools=()):
+        self.known = frozenset(known_tools)
+        self.pending = {}  # (session_id, tool_use_id) -> (op, time, tool)
+        self.sessions = {}  # session_id -> {group: LatencyHistogram}, least recently used first
+        self.totals = {}  # group -> LatencyHistogram
+        self.changed = False
+
+    def observe(self, event: dict) -> bool:
+        """Take note of one hook event. Returns True if the event is only
+        meant for this (a "done" event) and should not be journaled."""
+        op = event.get("op")
+        if op == "end":
+            if self.sessions.pop(event.get("session_id", ""), None) is not None:
+                self.changed = True
+            return False
+        if op == "stop":
+            self.pending.clear()
+            if self.sessions:
+                self.sessions.clear()
+                self.changed = True
+            return False
+        if op not in ("update", "done"):
+            return False
+
+        tool_use_id = event.get("tool_use_id")
+        t = event.get("t")
+        if not tool_use_id or not isinstance(t, (int, float)):
+            return op == "done"
+        key = (event.get("session_id", ""), tool_use_id)
+        other = self.pending.pop(key, None)
+        if other is None or other[0] == op:
+            self.pending[key] = (op, t, event.get("tool", ""))
+            while len(self.pending) > PENDING_MAX:
+                del self.pending[next(iter(self.pending))]
+        else:
+            start, end = (other[1], t) if op == "done" else (t, other[1])
+            self.record(key[0], event.get("tool") or other[2], (end - start) * 1000)
+        return op == "done"
+
+    def record(self, session_id: str, tool: str, ms: float):
+        group = tool_group(tool, self.known)
+        self.totals.setdefault(group, LatencyHistogram()).record(ms)
+        groups = self.sessions.pop(session_id, None) or {}
+        groups.setdefault(group, LatencyHistogram()).record(ms)
+        self.sessions[session_id] = groups  # Most recently used last
+        while len(self.sessions) > SESSIONS_MAX:
+            del self.sessions[next(iter(self.sessions))]
+        self.changed = True
+
+    def snapshot(self) -> dict:
+        """JSON form for daemon_stats.json: {"totals": {group: hist},
+        "sessions": {session_id: {group: hist}}}."""
+        return {
+            "totals": {group: hist.to_json() for group, hist in self.totals.items()},
+            "sessions": {sid: {group: hist.to_json() for group, hist in groups.items()}
+                         for sid, groups in self.sessions.items()},
+        }
+
+    def hints(self) -> dict:
+        """{session_id: {"tool", "p95_ms", "count"}} - each session's tool
+        with the highest p95, when it is slow enough to mention."""
+        hints = {}
+        for session_id, groups in self.sessions.items():
+            slowest = max(((hist.quantile(0.95), group, hist.total) for group, hist in groups.items()
+                           if hist.total >= HINT_MIN_SAMPLES), default=None)
+            if slowest and slowest[0] >= HINT_MIN_MS:
+                hints[session_id] = {"tool": slowest[1], "p95_ms": slowest[0], "count": slowest[2]}
+        return hints
+
+    def write_hints(self, logger=None):
+        if write_tool_hints(self.hints(), logger):
+            self.changed = False
+
+
+# ═══════════════════════════════════════════════════════════════
+# Hints File
+# ═══════════════════════════════════════════════════════════════
+
+def write_tool_hints(hints: dict, logger=None) -> bool:
+    """Write ToolLatency.hints() to tool_hints.json. Returns False on failure."""
+    try:
+        atomic_write_json(TOOL_HINTS_FILE, hints)
+    except OSError as e:
+        if logger:
+            logger(f"Warning: Could not write tool hints: {e}")
+        return False
+    return True
+
+
+def read_tool_hint(session_id: str) -> dict | None:
+    """This session's slowest-tool hint from tool_hints.json, if any."""
+    try:
+        with open(TOOL_HINTS_FILE, "r", encoding="utf-8") as f:
+            hints = json.load(f)
+    except (OSError, ValueError):
+        return None
+    hint = hints.get(session_id) if isinstance(hints, dict) else None
+    if isinstance(hint, dict) and isinstance(hint.get("tool"), str) and isinstance(hint.get("p95_ms"), int):
+        return hint
+    return None
+
+
+# ═══════════════════════════════════════════════════════════════
+# Status Output
+# ═══════════════════════════════════════════════════════════════
+
+def latency_table(histograms: dict) -> list[str]:
+    """Lines of "group  calls  p50  p95  max" from {group: hist JSON},
+    slowest p95 first."""
+    rows = []
+    for group, data in histograms.items():
+        hist = LatencyHistogram.from_json(data)
+        if hist.total:
+            rows.append((hist.quantile(0.95), group, hist))
+    rows.sort(key=lambda row: (-row[0], row[1]))
+    width = max((len(group) for _, group, _ in rows), default=0)
+    return [f"{group:<{width}} {hist.total:>6} calls  p50 {format_latency(hist.quantile(0.5)):>7}  "
+            f"p95 {format_latency(p95):>7}  max {format_latency(hist.max_ms):>7}"
+            for p95, group, hist in rows]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Hook benchmark for Discord Rich Presence.
+Measures the `hook.py update` wall time and StateLock waits for each state
+write path - locked shard rewrite (the no-journal path), journal append,
+daemon ingest socket -
+while a statusline-style writer feeds state through the same path.
+
+Runs against a throwaway data directory - never touches your real state.
+
+Usage:
+    python tools/bench.py                  # in-process hook calls
+    python tools/bench.py --spawn          # full `python hook.py update` processes
+    python tools/bench.py -n 500 --contend-interval 0.002
+"""
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+
+# Point DATA_DIR at a scratch directory before the plugin modules compute it
+_SCRATCH_HOME = tempfile.mkdtemp(prefix="kana-rpc-bench-")
+atexit.register(shutil.rmtree, _SCRATCH_HOME, ignore_errors=True)
+os.environ["HOME"] = _SCRATCH_HOME
+os.environ["APPDATA"] = _SCRATCH_HOME
+os.environ.pop("CLAUDE_PLUGIN_ROOT", None)
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import state  # noqa: E402
+import hook  # noqa: E402
+import presence  # noqa: E402
+from ingest import IngestServer, submit_event  # noqa: E402
+
+HOOK_PAYLOAD = {
+    "session_id": "bench-session",
+    "hook_event_name": "PreToolUse",
+    "tool_name": "Edit",
+    "tool_input": {"file_path": "/tmp/project/src/main.py", "old_string": "a", "new_string": "b"},
+    "cwd": "/tmp/project",
+}
+
+SEED_STATE = {
+    "session_start": int(time.time()),
+    "project": "bench-project",
+    "project_path": "/tmp/project",
+    "git_branch": "main",
+    "tool": "Read",
+    "file": "main.py",
+    "last_update": int(time.time()),
+    "session_id": "bench-session",
+    "model": "Opus 4.6",
+    "model_id": "claude-opus-4-6",
+    "tokens": {"input": 20000, "output": 2900, "cache_read": 51_000_000, "cache_write": 3_300_000, "cost": 0.18},
+    "duration_ms": 600_000,
+    "lines_added": 156,
+    "lines_removed": 23,
+    "context_pct": 42,
+    "context_size": 200000,
+    "agent_name": "",
+    "statusline_update": int(time.time()),
+}
+
+
+# ═══════════════════════════════════════════════════════════════
+# Instrumentation
+# ═══════════════════════════════════════════════════════════════
+
+_lock_waits = []
+_hook_thread = threading.get_ident()
+_original_enter = state.StateLock.__enter__
+
+
+def _timed_enter(self):
+    """StateLock.__enter__ wrapper recording acquisition wait on the hook thread."""
+    start = time.perf_counter()
+    result = _original_enter(self)
+    if threading.get_ident() == _hook_thread:
+        _lock_waits.append(time.perf_counter() - start)
+    return result
+
+
+state.StateLock.__enter__ = _timed_enter
+
+
+def _contender(stop: threading.Event, interval: float):
+    """Feed statusline events the way statusline.py does on every refresh."""
+    tick = 0
+    while not stop.is_set():
+        submit_event({
+            "op": "statusline", "ts": int(time.time()), "model": "Opus 4.6",
+            "tokens": SEED_STATE["tokens"], "context_pct": tick % 100,
+        })
+        tick += 1
+        time.sleep(interval)
+
+
+def _daemon_ingest(server: IngestServer, stop: threading.Event):
+    """Stand-in for run_daemon(): journal socket events in batches and follow the journal."""
+    follower = state.StateFollower()
+    while not stop.is_set():
+        if server.wait(0.05):
+            events = server.drain()
+            if events and not state.append_events(events):
+                state.apply_events_locked(events)
+        follower.refresh()
+        if follower.journal_size > presence.DAEMON_COMPACT_SIZE:
+            state.compact_journal(timeout=0.5)
+
+
+# ═══════════════════════════════════════════════════════════════
+# Benchmark
+# ═══════════════════════════════════════════════════════════════
+
+def _percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _run_hook(spawn: bool):
+    """Run one `update` hook and return its wall time in seconds."""
+    if spawn:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(SCRIPTS_DIR / "hook.py"), "update"],
+            input=json.dumps(HOOK_PAYLOAD).encode("utf-8"),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env=os.environ.copy(), check=False,
+        )
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    hook.cmd_update()
+    return time.perf_counter() - start
+
+
+def run_case(name: str, path: str, iterations: int, spawn: bool, interval: float) -> dict:
+    """Run one case. path is "locked", "journal" or "socket"."""
+    use_socket = path == "socket"
+    # Child processes (--spawn) cannot be switched to the locked path
+    if path == "locked" and spawn:
+        print(f"{name}: not available with --spawn, skipping")
+        return {}
+    state.JOURNAL_AVAILABLE = path != "locked"
+    state.write_state(dict(SEED_STATE))
+    _lock_waits.clear()
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=_contender, args=(stop, interval), daemon=True)]
+    server = IngestServer()
+    if use_socket:
+        if not server.open():
+            print(f"{name}: ingest socket unavailable on this platform, skipping")
+            return {}
+        threads.append(threading.Thread(target=_daemon_ingest, args=(server, stop), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    samples = []
+    try:
+        for _ in range(iterations):
+            samples.append(_run_hook(spawn))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        server.close()
+
+    result = {
+        "case": name,
+        "iterations": iterations,
+        "hook_p50_ms": _percentile(samples, 50) * 1000,
+        "hook_p99_ms": _percentile(samples, 99) * 1000,
+        "hook_mean_ms": statistics.fmean(samples) * 1000,
+        "lock_acquisitions": len(_lock_waits),
+        "lock_wait_total_ms": sum(_lock_waits) * 1000,
+        "lock_wait_max_ms": max(_lock_waits, default=0.0) * 1000,
+    }
+    if spawn:
+        # Child processes are not instrumented; lock waits are only visible in-process
+        result["lock_acquisitions"] = None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PreToolUse hook path")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("--spawn", action="store_true",
+                        help="spawn `python hook.py update` per iteration (includes interpreter start)")
+    parser.add_argument("--contend-interval", type=float, default=0.005,
+                        help="seconds between statusline-style rewrites (default: 0.005)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    hook.read_hook_input = lambda fields=None: dict(HOOK_PAYLOAD)
+
+    results = [
+        run_case("locked shards", "locked", args.iterations, args.spawn, args.contend_interval),
+        run_case("journal append", "journal", args.iterations, args.spawn, args.contend_interval),
+        run_case("ingest socket", "socket", args.iterations, args.spawn, args.contend_interval),
+    ]
+    results = [r for r in results if r]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'case':<18} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'locks':>6} {'wait ms':>9} {'max wait':>9}")
+    for r in results:
+        locks = "-" if r["lock_acquisitions"] is None else str(r["lock_acquisitions"])
+        waits = "-" if r["lock_acquisitions"] is None else f"{r['lock_wait_total_ms']:.1f}"
+        max_wait = "-" if r["lock_acquisitions"] is None else f"{r['lock_wait_max_ms']:.1f}"
+        print(f"{r['case']:<18} {r['hook_p50_ms']:>8.2f} {r['hook_p99_ms']:>8.2f} {r['hook_mean_ms']:>8.2f} "
+              f"{locks:>6} {waits:>9} {max_wait:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for Discord Rich Presence.
+Runs the hot paths one after another and stores the results as JSON, so a
+run can be compared against an earlier one:
+
+    cold_start    spawn-to-exit time of `hook.py update`, `presence.py update`
+                  and `statusline.py` (the hook and statusline processes)
+    lock          StateLock throughput with 1/4/16 concurrent writers
+                  (tools/lock_bench.py)
+    atomic_write  atomic_write_json() at realistic state sizes
+    render        build_presence() - the daemon's details/state strings
+    e2e           tool event to the rpc.update payload arriving at Discord,
+                  through a running daemon
+    reconnect     the same with Discord dropping the connection on every
+                  second update: reconnect time and re-send of the update
+
+Runs offline: the daemon cases talk to tools/fake_discord.py running in
+this process, and everything uses a throwaway data directory - never
+touches your real state or Discord client.
+
+Metrics ending in _per_s are higher-is-better, all others lower-is-better.
+
+Usage:
+    python tools/bench_suite.py --output base.json
+    python tools/bench_suite.py --baseline base.json              # compare
+    python tools/bench_suite.py --baseline base.json --max-regression 20
+    python tools/bench_suite.py --cases cold_start,render -n 50
+"""
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+TOOLS_DIR = Path(__file__).resolve().parent
+SCRIPTS_DIR = TOOLS_DIR.parent / "scripts"
+
+# Point DATA_DIR at a scratch directory before the plugin modules compute it
+# (removed on exit; the daemon cases wait for their daemon to exit first)
+_SCRATCH_HOME = tempfile.mkdtemp(prefix="kana-rpc-suite-")
+atexit.register(shutil.rmtree, _SCRATCH_HOME, ignore_errors=True)
+os.environ["HOME"] = _SCRATCH_HOME
+os.environ["APPDATA"] = _SCRATCH_HOME
+os.environ.pop("CLAUDE_PLUGIN_ROOT", None)
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(0, str(TOOLS_DIR))
+
+import state  # noqa: E402
+from config import freeze, load_config  # noqa: E402
+from fake_discord import FakeDiscord  # noqa: E402
+
+RESULTS_VERSION = 1
+CASES = ("cold_start", "lock", "atomic_write", "render", "e2e", "reconnect")
+
+PROJECT_DIR = Path(_SCRATCH_HOME) / "project"
+RUNTIME_DIR = Path(_SCRATCH_HOME) / "run"  # XDG_RUNTIME_DIR for the daemon: where it looks for discord-ipc-0
+
+
+def _percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summary(samples: list, scale: float, unit: str) -> dict:
+    return {
+        f"p50_{unit}": _percentile(samples, 50) * scale,
+        f"p99_{unit}": _percentile(samples, 99) * scale,
+        f"mean_{unit}": statistics.fmean(samples) * scale if samples else 0.0,
+    }
+
+
+def _hook_payload(file_name: str = "main.py") -> dict:
+    return {
+        "session_id": "bench-session",
+        "hook_event_name": "PreToolUse",
+        "tool_name": "Edit",
+        "tool_input": {"file_path": str(PROJECT_DIR / "src" / file_name), "old_string": "a", "new_string": "b"},
+        "cwd": str(PROJECT_DIR),
+    }
+
+
+def _statusline_payload(tick: int) -> dict:
+    return {
+        "session_id": "bench-session",
+        "model": {"id": "claude-opus-4-6", "display_name": "Opus 4.6"},
+        "workspace": {"current_dir": str(PROJECT_DIR), "project_dir": str(PROJECT_DIR)},
+        "cost": {"total_cost_usd": 0.18 + tick / 100, "total_duration_ms": 600_000,
+                 "total_lines_added": 156 + tick, "total_lines_removed": 23},
+        "context_window": {"total_input_tokens": 20000, "total_output_tokens": 2900, "used_percentage": 42,
+                           "context_window_size": 200000,
+                           "current_usage": {"cache_read_input_tokens": 51_000, "cache_creation_input_tokens": 3_300}},
+    }
+
+
+def _setup_project():
+    """A project directory with a .git/HEAD, so branch lookups never run git."""
+    git_dir = PROJECT_DIR / ".git"
+    git_dir.mkdir(parents=True, exist_ok=True)
+    (git_dir / "HEAD").write_text("ref: refs/heads/main\n", encoding="utf-8")
+    (PROJECT_DIR / "src").mkdir(exist_ok=True)
+
+
+def _child_env() -> dict:
+    env = os.environ.copy()
+    env["XDG_RUNTIME_DIR"] = str(RUNTIME_DIR)
+    return env
+
+
+def _spawn(script: str, args: list, payload: dict | None) -> float:
+    """Run one plugin script to completion and return its wall time in seconds."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(SCRIPTS_DIR / script), *args], input=data,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=_child_env(), check=False)
+    return time.perf_counter() - start
+
+
+# ═══════════════════════════════════════════════════════════════
+# Cases
+# ═══════════════════════════════════════════════════════════════
+
+def case_cold_start(iterations: int) -> dict:
+    """Process spawn to exit, with no daemon running (journal path)."""
+    state.write_state({})
+    results = {}
+    commands = {
+        "hook_update": ("hook.py", ["update"], lambda i: _hook_payload()),
+        "presence_update": ("presence.py", ["update"], lambda i: _hook_payload()),
+        "statusline": ("statusline.py", [], _statusline_payload),
+    }
+    for name, (script, args, payload) in commands.items():
+        _spawn(script, args, payload(0))  # Warm the page cache and __pycache__
+        samples = [_spawn(script, args, payload(i + 1)) for i in range(iterations)]
+        for metric, value in _summary(samples, 1000, "ms").items():
+            results[f"{name}_{metric}"] = value
+    return results
+
+
+def case_lock(updates: int) -> dict:
+    """update_state() throughput with 1/4/16 writer processes."""
+    import lock_bench
+    results = {}
+    for writers in (1, 4, 16):
+        r = lock_bench.run_benchmark(writers, updates, spin=False, sharded=False)
+        results[f"w{writers}_updates_per_s"] = r["updates_per_s"]
+        results[f"w{writers}_update_p99_ms"] = r["update_p99_ms"]
+        results[f"w{writers}_failures"] = r["failures"]
+    return results
+
+
+def _state_with_sessions(count: int) -> dict:
+    """A state built the way the hooks build it: count sessions, each with
+    a start, a statusline refresh and a tool update."""
+    now = int(time.time())
+    current = {}
+    for i in range(count):
+        session_id = f"{i:08x}-5e55-4f0e-9a11-bench{i:07d}"
+        current = state.apply_event(current, {
+            "op": "start", "ts": now, "project": f"project-{i}", "project_path": f"/home/user/src/project-{i}",
+            "git_branch": "main", "session_id": session_id, "pid": 10000 + i,
+        })
+        current = state.apply_event(current, {
+            "op": "statusline", "ts": now, "session_id": session_id, "model": "Opus 4.6", "model_id": "claude-opus-4-6",
+            "tokens": {"input": 20000, "output": 2900, "cache_read": 51_000_000, "cache_write": 3_300_000,
+                       "cost": 0.18},
+            "duration_ms": 600_000, "lines_added": 156, "lines_removed": 23,
+            "context_pct": 42, "context_size": 200000, "agent_name": "",
+        })
+        current = state.apply_event(current, {"op": "update", "ts": now, "tool": "Edit",
+                                              "file": "main.py", "session_id": session_id})
+    return current
+
+
+def case_atomic_write(iterations: int) -> dict:
+    """atomic_write_json() of state.json with 1, 10 and 50 session records."""
+    results = {}
+    target = state.DATA_DIR / "bench_state.json"
+    state.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    for sessions in (1, 10, 50):
+        data = _state_with_sessions(sessions)
+        state.atomic_write_json(target, data)
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            state.atomic_write_json(target, data)
+            samples.append(time.perf_counter() - start)
+        results[f"s{sessions}_bytes"] = target.stat().st_size
+        for metric, value in _summary(samples, 1e6, "us").items():
+            results[f"s{sessions}_{metric}"] = value
+    return results
+
+
+def case_render(iterations: int) -> dict:
+    """build_presence() for one and fifty sessions, default and totals config."""
+    import presence
+    results = {}
+    base = load_config()
+    configs = {
+        "default": freeze(base),
+        "totals": freeze({**base, "display": {**base["display"], "show_session_totals": True}}),
+    }
+    for sessions in (1, 50):
+        data = _state_with_sessions(sessions)
+        for name, config in configs.items():
+            session_start = data.get("session_start", int(time.time()))
+            samples = []
+            for _ in range(iterations):
+                # Batches of 100 calls - a single call is below timer resolution on Windows
+                start = time.perf_counter()
+                for _ in range(100):
+                    presence.build_presence(data, config, session_start, time.time())
+                samples.append((time.perf_counter() - start) / 100)
+            for metric, value in _summary(samples, 1e6, "us").items():
+                results[f"s{sessions}_{name}_{metric}"] = value
+    return results
+
+
+def _drive_daemon(fake: FakeDiscord, name: str, samples: int, interval: float,
+                  settle: float = 0.0) -> tuple[list, list, int] | None:
+    """Start a session, send samples tool events interval seconds apart and
+    time each from hook spawn to the first accepted SET_ACTIVITY naming its
+    file. The daemon is stopped settle seconds after the last one.
+
+    Returns (totals, hook wall times, missed), or None if the daemon never
+    reached Discord.
+    """
+    state.write_state({})
+    totals = []
+    hooks = []
+    missed = 0
+    try:
+        _spawn("presence.py", ["start"], {"cwd": str(PROJECT_DIR), "session_id": "bench-session"})
+        if fake.wait_for(lambda record: record["cmd"] == "SET_ACTIVITY", timeout=30) is None:
+            print(f"{name}: daemon never reached the fake Discord, skipping", file=sys.stderr)
+            return None
+        for i in range(samples):
+            time.sleep(interval)
+            file_name = f"bench_{i}.py"
+            seen = len(fake.records)
+            start = time.perf_counter()
+            hook = _spawn("hook.py", ["update"], _hook_payload(file_name))
+            record = fake.wait_for(lambda r: r["result"] == "ok"
+                                   and file_name in ((r["activity"] or {}).get("details") or ""),
+                                   timeout=interval + 10, since=seen)
+            if record is None:
+                missed += 1
+                continue
+            totals.append(record["clock"] - start)
+            hooks.append(hook)
+        time.sleep(settle)
+    finally:
+        _spawn("presence.py", ["stop"], None)
+        _wait_daemon_exit()
+    return totals, hooks, missed
+
+
+def _wait_daemon_exit(timeout: float = 5.0):
+    """Wait for the daemon to remove its PID file, so the next case (or the
+    scratch cleanup on exit) does not race its last writes."""
+    pid_file = state.DATA_DIR / "daemon.pid"
+    deadline = time.time() + timeout
+    while pid_file.exists() and time.time() < deadline:
+        time.sleep(0.1)
+
+
+def case_e2e(samples: int, interval: float) -> dict:
+    """Hook spawn to the matching SET_ACTIVITY at the fake Discord.
+
+    Updates are spaced interval seconds apart so the daemon's token bucket
+    (5 updates per 20 s) never holds one back - the figure is the delivery
+    path, not rate limiting.
+    """
+    with FakeDiscord(RUNTIME_DIR) as fake:
+        driven = _drive_daemon(fake, "e2e", samples, interval)
+    if driven is None:
+        return {}
+    totals, hooks, missed = driven
+    results = {"missed": missed}
+    results.update({f"total_{k}": v for k, v in _summary(totals, 1000, "ms").items()})
+    # The update usually reaches Discord before the hook process has finished exiting
+    results.update({f"hook_{k}": v for k, v in _summary(hooks, 1000, "ms").items()})
+    return results
+
+
+def case_reconnect(samples: int, interval: float) -> dict:
+    """Tool events while Discord drops the connection on every second
+    SET_ACTIVITY (the dropped one is never acknowledged).
+
+    reconnect: from the dropped update to the daemon's next handshake.
+    resend: from the dropped update to the same activity arriving again.
+    """
+    with FakeDiscord(RUNTIME_DIR, disconnect_every=2) as fake:
+        driven = _drive_daemon(fake, "reconnect", samples, interval, settle=interval)
+        records = list(fake.records)
+    if driven is None:
+        return {}
+    totals, _, missed = driven
+
+    reconnects = []
+    resends = []
+    disconnects = lost = 0
+    for i, record in enumerate(records):
+        if record["result"] != "disconnected" or record["activity"] is None:
+            continue  # The clear sent on shutdown is not re-sent
+        disconnects += 1
+        later = records[i + 1:]
+        ready = next((r for r in later if r["result"] == "ready"), None)
+        if ready is not None:
+            reconnects.append(ready["clock"] - record["clock"])
+        resent = next((r for r in later if r["result"] == "ok"), None)
+        # The token view may have flipped meanwhile - match on the details line
+        details = record["activity"].get("details")
+        if resent is not None and (resent["activity"] or {}).get("details") == details:
+            resends.append(resent["clock"] - record["clock"])
+        elif resent is None or resent["activity"] is None:
+            lost += 1  # Never shown - a newer activity replacing it is fine
+    results = {"missed": missed, "disconnects": disconnects, "lost": lost}
+    results.update({f"total_{k}": v for k, v in _summary(totals, 1000, "ms").items()})
+    results.update({f"reconnect_{k}": v for k, v in _summary(reconnects, 1000, "ms").items()})
+    results.update({f"resend_{k}": v for k, v in _summary(resends, 1000, "ms").items()})
+    return results
+
+
+# ═══════════════════════════════════════════════════════════════
+# Results
+# ═══════════════════════════════════════════════════════════════
+
+def compare(results: dict, baseline: dict) -> list:
+    """[(case, metric, baseline, current, change %, % worse)]; baseline and
+    the changes are None for metrics the baseline does not have."""
+    rows = []
+    for case, metrics in results["cases"].items():
+        base_metrics = baseline.get("cases", {}).get(case, {})
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if not isinstance(base, (int, float)) or not isinstance(value, (int, float)):
+                rows.append((case, metric, None, value, None, None))
+                continue
+            change = (value - base) / base * 100 if base else 0.0
+            worse = -change if metric.endswith("_per_s") else change
+            rows.append((case, metric, base, value, change, worse))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the hook, statusline and daemon benchmarks")
+    parser.add_argument("--cases", default=",".join(CASES),
+                        help=f"comma-separated cases to run (default: {','.join(CASES)})")
+    parser.add_argument("-n", "--iterations", type=int, default=30,
+                        help="spawns per cold-start command, samples per in-process case (default: 30)")
+    parser.add_argument("--lock-updates", type=int, default=200, help="update_state() calls per writer (default: 200)")
+    parser.add_argument("--e2e-samples", type=int, default=5, help="tool events sent through the daemon per case (default: 5)")
+    parser.add_argument("--e2e-interval", type=float, default=4.5,
+                        help="seconds between e2e events (default: 4.5, one rate-limit token)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="exit 1 if any metric is this many percent worse than the baseline")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    selected = [case.strip() for case in args.cases.split(",") if case.strip()]
+    unknown = [case for case in selected if case not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)} (choose from {', '.join(CASES)})")
+
+    if not hasattr(socket, "AF_UNIX") and {"e2e", "reconnect"} & set(selected):
+        print("e2e/reconnect need Unix sockets for the fake Discord, skipping", file=sys.stderr)
+        selected = [case for case in selected if case not in ("e2e", "reconnect")]
+
+    _setup_project()
+    runners = {
+        "cold_start": lambda: case_cold_start(args.iterations),
+        "lock": lambda: case_lock(args.lock_updates),
+        "atomic_write": lambda: case_atomic_write(args.iterations),
+        "render": lambda: case_render(args.iterations),
+        "e2e": lambda: case_e2e(args.e2e_samples, args.e2e_interval),
+        "reconnect": lambda: case_reconnect(args.e2e_samples, args.e2e_interval),
+    }
+    results = {
+        "version": RESULTS_VERSION,
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": {},
+    }
+    for case in selected:
+        if not args.json:
+            print(f"running {case}...", file=sys.stderr)
+        case_results = runners[case]()
+        if case_results:
+            results["cases"][case] = case_results
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    elif baseline is None:
+        for case, metrics in results["cases"].items():
+            for metric, value in metrics.items():
+                print(f"{case:<13} {metric:<32} {value:>12.2f}")
+    else:
+        print(f"{'case':<13} {'metric':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+        for case, metric, base, value, change, _ in compare(results, baseline):
+            if base is None:
+                print(f"{case:<13} {metric:<32} {'-':>12} {value:>12.2f} {'new':>8}")
+            else:
+                print(f"{case:<13} {metric:<32} {base:>12.2f} {value:>12.2f} {change:>+7.1f}%")
+
+    if baseline is not None and args.max_regression is not None:
+        regressed = [(case, metric, worse) for case, metric, _, _, _, worse in compare(results, baseline)
+                     if worse is not None and worse > args.max_regression and not metric.endswith(("_bytes", "failures", "missed", "disconnects", "lost"))]
+        for case, metric, worse in regressed:
+            print(f"REGRESSION: {case} {metric} is {worse:.1f}% worse than the baseline", file=sys.stderr)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Import-time regression check for the PreToolUse hook.
+Runs `python -X importtime scripts/hook.py update` against a throwaway data
+directory and fails when the hook imports a module it should never need, or
+when its total import time exceeds the budget.
+
+Usage:
+    python tools/check_importtime.py                 # default budget
+    python tools/check_importtime.py --budget-ms 40 -n 9
+    python tools/check_importtime.py --show 15       # list the slowest imports
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+
+HOOK_PAYLOAD = {
+    "session_id": "importtime-session",
+    "hook_event_name": "PreToolUse",
+    "tool_name": "Edit",
+    "tool_input": {"file_path": "/tmp/project/src/main.py", "old_string": "a", "new_string": "b"},
+    "cwd": "/tmp/project",
+}
+
+# Modules that belong to the daemon or to other commands, never to `update`
+FORBIDDEN_MODULES = (
+    "presence", "yaml", "pypresence", "asyncio", "subprocess",
+    "datetime", "tempfile", "copy", "sqlite3",
+)
+
+DEFAULT_BUDGET_MS = 60.0
+
+
+def run_hook(env: dict) -> list:
+    """Run the hook once and return [(module, self_us, cumulative_us, depth)]."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(SCRIPTS_DIR / "hook.py"), "update"],
+        input=json.dumps(HOOK_PAYLOAD).encode("utf-8"),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        env=env, check=False,
+    )
+    imports = []
+    for line in result.stderr.decode("utf-8", errors="replace").splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # Column header
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the PreToolUse hook's import time")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"fail if median total import time exceeds this (default: {DEFAULT_BUDGET_MS:g})")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="measured runs (default: 5)")
+    parser.add_argument("--show", type=int, default=0, help="print the N slowest imports of the last run")
+    args = parser.parse_args()
+
+    totals = []
+    imports = []
+    with tempfile.TemporaryDirectory(prefix="kana-rpc-importtime-") as scratch:
+        env = os.environ.copy()
+        env.update(HOME=scratch, APPDATA=scratch)
+        # Measure what users get: cached bytecode, not a recompile on every run
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        env.pop("CLAUDE_PLUGIN_ROOT", None)
+
+        run_hook(env)  # Warm-up: writes __pycache__ and creates the state journal
+
+        for _ in range(max(1, args.runs)):
+            imports = run_hook(env)
+            totals.append(sum(cumulative for _, _, cumulative, depth in imports if depth == 0) / 1000)
+
+    failures = []
+    forbidden = sorted({name for name, _, _, _ in imports
+                        if name.split(".")[0] in FORBIDDEN_MODULES})
+    if forbidden:
+        failures.append(f"hook imports forbidden modules: {', '.join(forbidden)}")
+
+    median = statistics.median(totals)
+    if median > args.budget_ms:
+        failures.append(f"median import time {median:.1f} ms exceeds budget {args.budget_ms:g} ms")
+
+    print(f"hook import time: median {median:.1f} ms, min {min(totals):.1f} ms "
+          f"over {len(totals)} runs ({len(imports)} modules)")
+    if args.show:
+        print(f"{'self ms':>8} {'cumul ms':>9}  module")
+        for name, self_us, cumulative, depth in sorted(imports, key=lambda i: -i[2])[:args.show]:
+            print(f"{self_us / 1000:>8.2f} {cumulative / 1000:>9.2f}  {'  ' * depth}{name}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Fake Discord client for Discord Rich Presence.
+Listens on a discord-ipc-0 Unix socket and speaks the framed JSON protocol
+pypresence uses: the handshake (op 0) is answered with READY, commands
+(op 1) with a success reply, pings (op 3) with a pong. Every frame is
+recorded with its arrival time, and faults can be injected to exercise the
+daemon's reconnect and rate-limit handling without a Discord client:
+
+    latency      delay before each command reply (plus random jitter)
+    disconnects  drop the connection after every N SET_ACTIVITY commands
+    rate limit   answer SET_ACTIVITY with an ERROR frame once more than
+                 N arrive within a window of seconds
+
+Point the daemon at it with XDG_RUNTIME_DIR (the first directory pypresence
+searches for discord-ipc-N). By default a fresh directory is used, so a real
+Discord client is never shadowed.
+
+Usage:
+    python tools/fake_discord.py                        # prints the export line
+    python tools/fake_discord.py --latency 0.2 --jitter 0.1
+    python tools/fake_discord.py --disconnect-every 3 --record frames.jsonl
+    python tools/fake_discord.py --rate-limit 5/20
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+OP_HANDSHAKE = 0
+OP_FRAME = 1
+OP_CLOSE = 2
+OP_PING = 3
+OP_PONG = 4
+
+_FRAME_HEADER = struct.Struct("<II")
+
+RATE_LIMIT_ERROR = {"code": 4000, "message": "You are being rate limited."}
+
+
+class FakeDiscord:
+    """
+    Discord IPC server running on background threads.
+
+    Usage:
+        fake = FakeDiscord(runtime_dir, latency=0.05, disconnect_every=3)
+        fake.start()
+        ...                                   # run the daemon with XDG_RUNTIME_DIR=runtime_dir
+        fake.wait_for(lambda r: r["cmd"] == "SET_ACTIVITY", timeout=10)
+        fake.records                          # Every frame received, oldest first
+        fake.stop()
+
+    Each record is {"time" (epoch), "clock" (perf_counter), "connection",
+    "op", "cmd", "nonce", "activity", "result"}, with result one of "ready",
+    "ok", "rate_limited", "disconnected" (this frame closed the connection),
+    "pong" or "closed" (client sent op 2).
+    """
+
+    def __init__(self, runtime_dir: Path, pipe: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 disconnect_every: int = 0, rate_limit: tuple[int, float] | None = None,
+                 record_file: Path | None = None):
+        self.path = Path(runtime_dir) / f"discord-ipc-{pipe}"
+        self.latency = latency
+        self.jitter = jitter
+        self.disconnect_every = disconnect_every
+        self.rate_limit = rate_limit
+        self.records = []
+        self.connections = 0
+        self._record_file = open(record_file, "a", encoding="utf-8") if record_file else None
+        self._cond = threading.Condition()
+        self._server = None
+        self._conns = set()
+        self._activity_times = []  # Accepted SET_ACTIVITY arrival clocks, for the rate limit window
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(str(self.path))
+        self._server.listen(8)
+        threading.Thread(target=self._accept, name="fake-discord", daemon=True).start()
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.close()
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+        self.disconnect()
+        if self._record_file is not None:
+            self._record_file.close()
+            self._record_file = None
+
+    def disconnect(self):
+        """Drop every open connection now (as a Discord restart would)."""
+        with self._cond:
+            conns = list(self._conns)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # ───────────────────────────────────────────────────────────────
+    # Inspection
+    # ───────────────────────────────────────────────────────────────
+
+    def activities(self, since: int = 0) -> list:
+        """SET_ACTIVITY records from records[since:] on, accepted or not."""
+        with self._cond:
+            return [r for r in self.records[since:] if r["cmd"] == "SET_ACTIVITY"]
+
+    def wait_for(self, predicate, timeout: float, since: int = 0) -> dict | None:
+        """First record from records[since:] on that satisfies predicate,
+        waiting up to timeout seconds for it; None on timeout."""
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while True:
+                for record in self.records[since:]:
+                    if predicate(record):
+                        return record
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def summary(self) -> dict:
+        """Counts by result, plus the gaps between accepted SET_ACTIVITYs."""
+        with self._cond:
+            records = list(self.records)
+        results = {}
+        for record in records:
+            results[record["result"]] = results.get(record["result"], 0) + 1
+        accepted = [r["clock"] for r in records if r["cmd"] == "SET_ACTIVITY" and r["result"] == "ok"]
+        gaps = [b - a for a, b in zip(accepted, accepted[1:])]
+        return {
+            "connections": self.connections,
+            "frames": len(records),
+            "results": results,
+            "activities": len(accepted),
+            "min_gap_s": min(gaps, default=None),
+            "mean_gap_s": sum(gaps) / len(gaps) if gaps else None,
+        }
+
+    # ───────────────────────────────────────────────────────────────
+    # Protocol
+    # ───────────────────────────────────────────────────────────────
+
+    def _accept(self):
+        while True:
+            server = self._server
+            if server is None:
+                return
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with self._cond:
+                self.connections += 1
+                self._conns.add(conn)
+                connection = self.connections
+            threading.Thread(target=self._serve, args=(conn, connection), daemon=True).start()
+
+    @staticmethod
+    def _recv(conn, size: int) -> bytes | None:
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    @staticmethod
+    def _send(conn, op: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        conn.sendall(_FRAME_HEADER.pack(op, len(data)) + data)
+
+    def _record(self, connection: int, op: int, body: dict, result: str) -> dict:
+        args = body.get("args") if isinstance(body.get("args"), dict) else {}
+        record = {
+            "time": time.time(),
+            "clock": time.perf_counter(),
+            "connection": connection,
+            "op": op,
+            "cmd": body.get("cmd"),
+            "nonce": body.get("nonce"),
+            "activity": args.get("activity"),
+            "result": result,
+        }
+        with self._cond:
+            self.records.append(record)
+            if self._record_file is not None:
+                self._record_file.write(json.dumps(record) + "\n")
+                self._record_file.flush()
+            self._cond.notify_all()
+        return record
+
+    def _activity_result(self, now: float, accepted: int) -> str:
+        """Outcome of the accepted-th SET_ACTIVITY on a connection."""
+        if self.disconnect_every and accepted % self.disconnect_every == 0:
+            return "disconnected"
+        if self.rate_limit:
+            limit, window = self.rate_limit
+            with self._cond:
+                self._activity_times = [t for t in self._activity_times if now - t < window]
+                if len(self._activity_times) >= limit:
+                    return "rate_limited"
+                self._activity_times.append(now)
+        return "ok"
+
+    def _serve(self, conn, connection: int):
+        accepted = 0
+        try:
+            while True:
+                header = self._recv(conn, _FRAME_HEADER.size)
+                if header is None:
+                    return
+                op, length = _FRAME_HEADER.unpack(header)
+                try:
+                    body = json.loads(self._recv(conn, length) or b"{}")
+                except ValueError:
+                    return
+                if not isinstance(body, dict):
+                    return
+
+                if op == OP_HANDSHAKE:
+                    self._record(connection, op, body, "ready")
+                    self._send(conn, OP_FRAME, {"cmd": "DISPATCH", "evt": "READY", "nonce": None,
+                                                "data": {"v": 1, "user": {"id": "0", "username": "fake"}}})
+                elif op == OP_PING:
+                    self._record(connection, op, body, "pong")
+                    self._send(conn, OP_PONG, body)
+                elif op == OP_CLOSE:
+                    self._record(connection, op, body, "closed")
+                    return
+                elif op == OP_FRAME:
+                    result = "ok"
+                    if body.get("cmd") == "SET_ACTIVITY":
+                        accepted += 1
+                        result = self._activity_result(time.perf_counter(), accepted)
+                    self._record(connection, op, body, result)
+                    if result == "disconnected":
+                        return
+                    delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+                    if delay > 0:
+                        time.sleep(delay)
+                    reply = {"cmd": body.get("cmd"), "nonce": body.get("nonce")}
+                    if result == "rate_limited":
+                        reply.update(evt="ERROR", data=dict(RATE_LIMIT_ERROR))
+                    else:
+                        reply.update(evt=None, data=(body.get("args") or {}).get("activity") or {})
+                    self._send(conn, OP_FRAME, reply)
+                else:
+                    return  # Unknown opcode: Discord drops the connection
+        except OSError:
+            return
+        finally:
+            with self._cond:
+                self._conns.discard(conn)
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+def _parse_rate_limit(value: str) -> tuple[int, float]:
+    try:
+        count, window = value.split("/", 1)
+        return int(count), float(window)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected COUNT/SECONDS, got '{value}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Discord IPC server for the presence daemon")
+    parser.add_argument("--runtime-dir", help="directory for discord-ipc-0 (default: a new temporary directory)")
+    parser.add_argument("--pipe", type=int, default=0, help="N in discord-ipc-N (default: 0)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each command reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per reply")
+    parser.add_argument("--disconnect-every", type=int, default=0, metavar="N",
+                        help="drop the connection on every Nth SET_ACTIVITY")
+    parser.add_argument("--rate-limit", type=_parse_rate_limit, metavar="COUNT/SECONDS",
+                        help="reject SET_ACTIVITY beyond COUNT per SECONDS with an ERROR frame (e.g. 5/20)")
+    parser.add_argument("--record", help="append every received frame to this JSONL file")
+    args = parser.parse_args()
+
+    if not hasattr(socket, "AF_UNIX"):
+        parser.error("needs Unix domain sockets (Linux/macOS)")
+    runtime_dir = Path(args.runtime_dir or tempfile.mkdtemp(prefix="kana-rpc-discord-"))
+    fake = FakeDiscord(runtime_dir, pipe=args.pipe, latency=args.latency, jitter=args.jitter,
+                       disconnect_every=args.disconnect_every, rate_limit=args.rate_limit,
+                       record_file=args.record)
+    fake.start()
+    print(f"Listening on {fake.path}")
+    print(f"Run the daemon with: export XDG_RUNTIME_DIR={runtime_dir}")
+
+    seen = 0
+    try:
+        while True:
+            if fake.wait_for(lambda r: True, timeout=1.0, since=seen) is None:
+                continue
+            for record in fake.records[seen:]:
+                seen += 1
+                activity = record["activity"] or {}
+                detail = f" {activity.get('details', '')} | {activity.get('state', '')}" if activity else ""
+                print(f"[{time.strftime('%H:%M:%S')}] #{record['connection']} "
+                      f"{record['cmd'] or 'op ' + str(record['op'])} -> {record['result']}{detail}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+        print(json.dumps(fake.summary(), indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
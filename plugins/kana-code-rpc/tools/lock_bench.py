@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+StateLock contention benchmark for Discord Rich Presence.
+Starts N writer processes that each call update_state() in a tight loop
+(every call a locked read-modify-write of state.json) and reports p50/p99
+of the update latency and of the lock wait, plus hold times and timeouts.
+Half the writers update hook keys and half statusline keys, so --sharded
+shows what separate shards save.
+
+Runs against a throwaway data directory - never touches your real state.
+
+Usage:
+    python tools/lock_bench.py                   # 8 writers x 200 updates
+    python tools/lock_bench.py -w 16 -n 500
+    python tools/lock_bench.py --spin            # compare with a 10 ms retry loop
+    python tools/lock_bench.py --sharded         # per-writer shards (the no-journal store)
+    python tools/lock_bench.py --json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+
+
+def _percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ═══════════════════════════════════════════════════════════════
+# Worker
+# ═══════════════════════════════════════════════════════════════
+
+def _spin_enter(self):
+    """The pre-blocking StateLock: reopen and retry LOCK_NB every 10 ms."""
+    import fcntl
+    import state
+    state.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    while True:
+        fd = os.open(str(self._lock_file), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._spin_fd = fd
+            return self
+        except OSError:
+            os.close(fd)
+        if time.time() - start > self.timeout:
+            raise TimeoutError(f"Could not acquire state lock within {self.timeout}s")
+        time.sleep(0.01)
+
+
+def _spin_exit(self, exc_type, exc_val, exc_tb):
+    import fcntl
+    fcntl.flock(self._spin_fd, fcntl.LOCK_UN)
+    os.close(self._spin_fd)
+    return False
+
+
+def run_worker(worker: int, updates: int, spin: bool, sharded: bool, start_at: float):
+    """Child process: time update_state() calls and print one JSON line."""
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    import state
+
+    state.JOURNAL_AVAILABLE = not sharded
+    if spin:
+        state.StateLock.__enter__ = _spin_enter
+        state.StateLock.__exit__ = _spin_exit
+
+    # Line up the writers so they actually contend
+    time.sleep(max(0.0, start_at - time.time()))
+    latencies = []
+    failures = 0
+    begin_all = time.time()
+    for i in range(updates):
+        if worker % 2:
+            change = {"context_pct": i % 100, "statusline_update": int(time.time())}  # statusline.py
+        else:
+            change = {"tool": f"Tool{worker}", "last_update": int(time.time())}  # hook.py
+        begin = time.perf_counter()
+        if state.update_state(change) is None:
+            failures += 1
+        latencies.append(time.perf_counter() - begin)
+
+    elapsed = time.time() - max(start_at, begin_all)
+
+    # update_state (state.lock) or "<name> shard" callers
+    stats = {}
+    for counts in state.lock_stats().values():
+        for key, value in counts.items():
+            stats[key] = max(stats.get(key, 0), value) if key.endswith("_max") else stats.get(key, 0) + value
+    print(json.dumps({"latencies": latencies, "failures": failures, "locks": stats, "elapsed": elapsed}))
+
+
+# ═══════════════════════════════════════════════════════════════
+# Benchmark
+# ═══════════════════════════════════════════════════════════════
+
+def run_benchmark(writers: int, updates: int, spin: bool, sharded: bool) -> dict:
+    with tempfile.TemporaryDirectory(prefix="kana-rpc-lockbench-") as scratch:
+        env = os.environ.copy()
+        env.update(HOME=scratch, APPDATA=scratch)
+        env.pop("CLAUDE_PLUGIN_ROOT", None)
+
+        start_at = time.time() + 0.5 + writers * 0.05
+        command = [sys.executable, __file__, "--worker", "-n", str(updates), "--start-at", str(start_at)]
+        if spin:
+            command.append("--spin")
+        if sharded:
+            command.append("--sharded")
+        procs = [subprocess.Popen(command + ["--worker-id", str(i)], env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                 for i in range(writers)]
+
+        latencies = []
+        failures = 0
+        elapsed = 0.0
+        waits_max = holds_max = 0.0
+        waits_total = holds_total = 0.0
+        contended = acquired = timeouts = 0
+        for proc in procs:
+            out, _ = proc.communicate()
+            try:
+                result = json.loads(out.decode("utf-8").strip().splitlines()[-1])
+            except (ValueError, IndexError):
+                failures += updates  # Worker crashed
+                continue
+            latencies.extend(result["latencies"])
+            failures += result["failures"]
+            elapsed = max(elapsed, result.get("elapsed", 0.0))
+            locks = result["locks"]
+            acquired += locks.get("acquired", 0)
+            contended += locks.get("contended", 0)
+            timeouts += locks.get("timeouts", 0)
+            waits_total += locks.get("wait_total", 0.0)
+            waits_max = max(waits_max, locks.get("wait_max", 0.0))
+            holds_total += locks.get("hold_total", 0.0)
+            holds_max = max(holds_max, locks.get("hold_max", 0.0))
+
+    return {
+        "lock": ("spin (10 ms retry)" if spin else "blocking") + (", shards" if sharded else ""),
+        "writers": writers,
+        "updates": len(latencies),
+        "failures": failures,
+        "updates_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "update_p50_ms": _percentile(latencies, 50) * 1000,
+        "update_p99_ms": _percentile(latencies, 99) * 1000,
+        "update_max_ms": max(latencies, default=0.0) * 1000,
+        # Lock counters come from StateLock itself (not recorded by --spin)
+        "contended": None if spin else contended,
+        "lock_timeouts": None if spin else timeouts,
+        "wait_mean_ms": None if spin or not acquired else waits_total / acquired * 1000,
+        "wait_max_ms": None if spin else waits_max * 1000,
+        "hold_mean_ms": None if spin or not acquired else holds_total / acquired * 1000,
+        "hold_max_ms": None if spin else holds_max * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StateLock under concurrent update_state() writers")
+    parser.add_argument("-w", "--writers", type=int, default=8, help="concurrent writer processes (default: 8)")
+    parser.add_argument("-n", "--updates", type=int, default=200, help="update_state() calls per writer (default: 200)")
+    parser.add_argument("--spin", action="store_true", help="also run the old 10 ms retry loop for comparison")
+    parser.add_argument("--sharded", action="store_true",
+                        help="write per-writer shards instead of state.json (as on Windows)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-id", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker_id, args.updates, args.spin, args.sharded, args.start_at)
+        return
+    if sys.platform == "win32" and args.spin:
+        parser.error("--spin needs fcntl (Unix only)")
+
+    results = [run_benchmark(args.writers, args.updates, spin=False, sharded=args.sharded)]
+    if args.spin:
+        results.append(run_benchmark(args.writers, args.updates, spin=True, sharded=args.sharded))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'lock':<28} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>7} "
+          f"{'contended':>10} {'wait avg':>9} {'wait max':>9} {'hold avg':>9}")
+    for r in results:
+        def fmt(value, spec=".2f"):
+            return "-" if value is None else format(value, spec)
+        print(f"{r['lock']:<28} {r['update_p50_ms']:>8.2f} {r['update_p99_ms']:>8.2f} {r['update_max_ms']:>8.2f} "
+              f"{r['failures']:>7} {fmt(r['contended'], 'd'):>10} {fmt(r['wait_mean_ms']):>9} "
+              f"{fmt(r['wait_max_ms']):>9} {fmt(r['hold_mean_ms']):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Replay load generator for Discord Rich Presence.
+Feeds a recording (`presence.py record start` ... `record stop`) back
+through `presence.py start/stop`, `hook.py update/done` and `statusline.py` -
+at the recorded pace, N times faster, or as fast as possible - with M
+copies of every recorded session running concurrently, against a running
+daemon and tools/fake_discord.py. Reports:
+
+    hook latency      spawn-to-exit time per command, p50/p99
+    schedule lag      how far commands started behind the scaled recording
+    dropped updates   tool updates never shown on Discord (coalesced or
+                      dropped by the daemon's rate limiting), plus the
+                      daemon's own sent/failed/coalesced/dropped counts
+    lock timeouts     StateLock acquisitions that gave up, in any process
+    payload lag       hook spawn to the SET_ACTIVITY showing that update
+
+Each simulated session runs in its own worker process, which the commands
+it spawns find as their Claude Code ancestor (it renames itself
+"claude-replay" on Linux; elsewhere they fall back to their parent PID,
+which is the same worker unless the replay itself runs under Claude Code).
+Tool updates get a short tag in front of the filename so their payloads can
+be recognized on the fake Discord; tags survive filename truncation.
+
+Runs against a throwaway data directory - never touches your real state or
+Discord client. Needs Unix sockets for the fake Discord.
+
+Usage:
+    python tools/replay.py ~/.local/share/kana-code-rpc/recording-20261018-101500.jsonl
+    python tools/replay.py TRACE --speed 10 --sessions 8
+    python tools/replay.py TRACE --speed 0 --sessions 16 --json   # no pacing
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+TOOLS_DIR = Path(__file__).resolve().parent
+SCRIPTS_DIR = TOOLS_DIR.parent / "scripts"
+
+COMMANDS = {
+    "start": ("presence.py", ["start"]),
+    "update": ("hook.py", ["update"]),
+    "done": ("hook.py", ["done"]),
+    "stop": ("presence.py", ["stop"]),
+    "statusline": ("statusline.py", []),
+}
+
+
+def _percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _ms(samples: list) -> dict:
+    return {
+        "count": len(samples),
+        "p50_ms": _percentile(samples, 50) * 1000,
+        "p99_ms": _percentile(samples, 99) * 1000,
+        "max_ms": max(samples, default=0.0) * 1000,
+    }
+
+
+# ═══════════════════════════════════════════════════════════════
+# Worker (one simulated session)
+# ═══════════════════════════════════════════════════════════════
+
+def _name_process(name: bytes):
+    """Set this process's name (Linux) so spawned hooks take it for Claude Code."""
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None)
+        libc.prctl(15, name, 0, 0, 0)  # PR_SET_NAME
+    except (OSError, AttributeError):
+        pass
+
+
+def run_worker():
+    """Child process: run one session's commands on schedule, print one JSON line.
+
+    Reads {"start_at", "commands": [{"at", "cmd", "in", "tag"}]} from stdin;
+    "at" is seconds after start_at.
+    """
+    job = json.loads(sys.stdin.read())
+    _name_process(b"claude-replay")
+    start_at = job["start_at"]
+    results = []
+    for command in job["commands"]:
+        target = start_at + command["at"]
+        delay = target - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        script, args = COMMANDS[command["cmd"]]
+        lag = max(0.0, time.time() - target)
+        begin = time.perf_counter()
+        subprocess.run([sys.executable, str(SCRIPTS_DIR / script), *args],
+                       input=json.dumps(command["in"]).encode("utf-8"),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        results.append({"cmd": command["cmd"], "tag": command.get("tag"), "begin": begin,
+                        "duration": time.perf_counter() - begin, "lag": lag})
+    print(json.dumps(results))
+
+
+# ═══════════════════════════════════════════════════════════════
+# Trace Preparation
+# ═══════════════════════════════════════════════════════════════
+
+def _tag_file(payload: dict, tag: str) -> dict:
+    """Copy of an update payload whose file name starts with tag."""
+    tool_input = payload.get("tool_input")
+    if not isinstance(tool_input, dict):
+        return payload
+    tool_input = dict(tool_input)
+    for key in ("file_path", "notebook_path"):
+        if isinstance(tool_input.get(key), str) and tool_input[key]:
+            path = Path(tool_input[key])
+            tool_input[key] = str(path.with_name(f"{tag}-{path.name}"))
+            return {**payload, "tool_input": tool_input}
+    return payload
+
+
+def build_jobs(entries: list, sessions: int, speed: float, project_dir: str) -> list:
+    """One job per (copy, recorded session): its commands with session ids
+    made unique per copy, times scaled by speed, and a start/stop added
+    where the recording began or ended mid-session."""
+    t0 = entries[0]["t"] if entries else 0.0
+    by_session = {}
+    for entry in entries:
+        session_id = entry["in"].get("session_id") or ""
+        by_session.setdefault(session_id, []).append(entry)
+
+    jobs = []
+    for copy in range(sessions):
+        for index, (session_id, recorded) in enumerate(sorted(by_session.items())):
+            worker = len(jobs)
+            new_id = f"{session_id or 'session'}-r{copy}"
+            commands = []
+            for seq, entry in enumerate(recorded):
+                payload = {**entry["in"], "session_id": new_id}
+                tag = None
+                if entry["cmd"] == "update":
+                    tag = f"{worker:x}x{seq:x}"
+                    payload = _tag_file(payload, tag)
+                at = (entry["t"] - t0) / speed if speed > 0 else 0.0
+                commands.append({"at": at, "cmd": entry["cmd"], "in": payload, "tag": tag})
+            if not commands or commands[0]["cmd"] != "start":
+                cwd = next((c["in"].get("cwd") for c in commands if c["in"].get("cwd")), project_dir)
+                first = commands[0]["at"] if commands else 0.0
+                commands.insert(0, {"at": first, "cmd": "start", "in": {"cwd": cwd, "session_id": new_id}})
+            if commands[-1]["cmd"] != "stop":
+                commands.append({"at": commands[-1]["at"], "cmd": "stop", "in": {"session_id": new_id}})
+            jobs.append({"commands": commands})
+    return jobs
+
+
+# ═══════════════════════════════════════════════════════════════
+# Replay
+# ═══════════════════════════════════════════════════════════════
+
+def replay(trace: Path, sessions: int, speed: float, latency: float) -> dict:
+    scratch = Path(tempfile.mkdtemp(prefix="kana-rpc-replay-"))
+    runtime_dir = scratch / "run"
+    os.environ.update(HOME=str(scratch), APPDATA=str(scratch), XDG_RUNTIME_DIR=str(runtime_dir))
+    os.environ.pop("CLAUDE_PLUGIN_ROOT", None)
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    sys.path.insert(0, str(TOOLS_DIR))
+    from fake_discord import FakeDiscord
+    from recording import read_recording
+    from state import DATA_DIR, OUTPUT_DIR
+
+    entries = read_recording(trace)
+    if not entries:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise SystemExit(f"{trace}: no recorded commands")
+    project_dir = scratch / "project"
+    project_dir.mkdir()
+    jobs = build_jobs(entries, sessions, speed, str(project_dir))
+
+    fake = FakeDiscord(runtime_dir, latency=latency)
+    fake.start()
+    start_at = time.time() + 0.5 + len(jobs) * 0.02
+    procs = []
+    for job in jobs:
+        proc = subprocess.Popen([sys.executable, __file__, "--worker"], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        proc.stdin.write(json.dumps({"start_at": start_at, **job}).encode("utf-8"))
+        proc.stdin.close()
+        procs.append(proc)
+
+    results = []
+    crashed = 0
+    for proc in procs:
+        out = proc.stdout.read()
+        proc.wait()
+        try:
+            results.extend(json.loads(out.decode("utf-8").strip().splitlines()[-1]))
+        except (ValueError, IndexError):
+            crashed += 1
+    elapsed = time.time() - start_at
+
+    # The last stop shuts the daemon down; it publishes its counters on the way out
+    pid_file = DATA_DIR / "daemon.pid"
+    for _ in range(50):
+        if not pid_file.exists():
+            break
+        time.sleep(0.1)
+    fake.stop()
+
+    try:
+        return summarize(results, fake, OUTPUT_DIR, len(jobs), crashed, elapsed)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def summarize(results: list, fake, output_dir: Path, workers: int, crashed: int, elapsed: float) -> dict:
+    latency = {}
+    for result in results:
+        latency.setdefault(result["cmd"], []).append(result["duration"])
+
+    # First accepted SET_ACTIVITY showing each tagged update
+    shown = {}
+    for record in fake.records:
+        if record["cmd"] != "SET_ACTIVITY" or record["result"] != "ok" or not record["activity"]:
+            continue
+        details = record["activity"].get("details") or ""
+        for word in details.split():
+            tag = word.split("-", 1)[0]
+            if "-" in word and tag not in shown:
+                shown[tag] = record["clock"]
+    updates = [r for r in results if r["cmd"] == "update"]
+    payload_lag = [shown[r["tag"]] - r["begin"] for r in updates if r["tag"] in shown]
+
+    try:
+        stats = json.loads((output_dir / "daemon_stats.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        stats = {}
+    discord = stats.get("discord_updates") if isinstance(stats.get("discord_updates"), dict) else {}
+    locks = stats.get("locks") if isinstance(stats.get("locks"), dict) else {}
+    try:
+        log_lines = (output_dir / "daemon.log").read_text(encoding="utf-8", errors="replace").splitlines()
+    except OSError:
+        log_lines = []
+
+    summary = fake.summary()
+    return {
+        "workers": workers,
+        "crashed_workers": crashed,
+        "commands": len(results),
+        "elapsed_s": elapsed,
+        "commands_per_s": len(results) / elapsed if elapsed > 0 else 0.0,
+        "hook_latency": {cmd: _ms(samples) for cmd, samples in sorted(latency.items())},
+        "schedule_lag": _ms([r["lag"] for r in results]),
+        "updates": {
+            "sent_by_hooks": len(updates),
+            "shown": sum(1 for r in updates if r["tag"] in shown),
+            "not_shown": sum(1 for r in updates if r["tag"] not in shown),
+            "daemon_sent": discord.get("sent", 0),
+            "daemon_failed": discord.get("failed", 0),
+            "daemon_coalesced": discord.get("coalesced", 0),
+            "daemon_dropped": discord.get("dropped", 0),
+        },
+        "lock_timeouts": {
+            # Hooks and the statusline log theirs; the daemon also counts its own
+            "logged": sum("Could not acquire" in line for line in log_lines),
+            "daemon": sum(lock.get("timeouts", 0) for lock in locks.values() if isinstance(lock, dict)),
+        },
+        "failed_updates": sum("Could not update session state" in line for line in log_lines),
+        "payload_lag": _ms(payload_lag),
+        "discord": {"activities": summary["activities"], "connections": summary["connections"],
+                    "min_gap_s": summary["min_gap_s"]},
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['workers']} sessions, {report['commands']} commands in {report['elapsed_s']:.1f}s "
+          f"({report['commands_per_s']:.1f}/s)" + (f", {report['crashed_workers']} workers crashed"
+                                                  if report["crashed_workers"] else ""))
+    print(f"\n{'latency':<14} {'count':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    rows = list(report["hook_latency"].items()) + [("schedule lag", report["schedule_lag"]),
+                                                   ("payload lag", report["payload_lag"])]
+    for name, row in rows:
+        print(f"{name:<14} {row['count']:>6} {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+    updates = report["updates"]
+    print(f"\nTool updates: {updates['sent_by_hooks']} sent by hooks, {updates['shown']} shown on Discord, "
+          f"{updates['not_shown']} never shown")
+    print(f"Daemon: {updates['daemon_sent']} sent, {updates['daemon_failed']} failed, "
+          f"{updates['daemon_coalesced']} coalesced, "
+          f"{updates['daemon_dropped']} dropped")
+    locks = report["lock_timeouts"]
+    print(f"Lock timeouts: {locks['logged']} logged, {locks['daemon']} in the daemon; "
+          f"failed updates: {report['failed_updates']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a hook/statusline recording against the daemon")
+    parser.add_argument("trace", nargs="?", help="recording file (DATA_DIR/recording-*.jsonl)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay N times faster than recorded; 0 = no pacing (default: 1)")
+    parser.add_argument("--sessions", type=int, default=1,
+                        help="concurrent copies of every recorded session (default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Discord reply latency in seconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return
+    if not args.trace:
+        parser.error("a recording file is required")
+    import socket
+    if not hasattr(socket, "AF_UNIX"):
+        parser.error("needs Unix domain sockets for the fake Discord (Linux/macOS)")
+
+    report = replay(Path(args.trace).expanduser(), max(1, args.sessions), args.speed, args.latency)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()